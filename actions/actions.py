@@ -1,9 +1,12 @@
 """Custom actions"""
+import abc
+import hashlib
+import json
 import os
-from typing import Dict, Text, Any, List
+from typing import Dict, Text, Any, List, Optional
 import logging
 from dateutil import parser
-import sqlalchemy as sa
+from sqlalchemy.engine.base import Engine
 
 from rasa_sdk.interfaces import Action
 from rasa_sdk.events import (
@@ -18,29 +21,143 @@ from rasa_sdk.events import (
 from rasa_sdk import Tracker
 from rasa_sdk.executor import CollectingDispatcher
 
-from actions.parsing import (
-    parse_duckling_time_as_interval,
-    parse_duckling_time,
-    get_entity_details,
-    parse_duckling_currency,
-)
+from actions.parsing import normalize_entities
 
-from actions.profile_db import create_database, ProfileDB
+from actions.profile_db import (
+    create_database,
+    create_database_engine,
+    ProfileDB,
+    AsyncProfileDB,
+    SQLITE_PRAGMAS,
+)
+from actions.prefork import ProcessLocal
+from actions.sharding import ShardedProfileDB
 
 from actions.custom_forms import CustomFormValidationAction
 
 
 logger = logging.getLogger(__name__)
 
-# The profile database is created/connected to when the action server starts
+# The profile database is created/connected to when an action first uses it
 # It is populated the first time `ActionSessionStart.run()` is called .
 
 PROFILE_DB_NAME = os.environ.get("PROFILE_DB_NAME", "profile")
 PROFILE_DB_URL = os.environ.get("PROFILE_DB_URL", f"sqlite:///{PROFILE_DB_NAME}.db")
-ENGINE = sa.create_engine(PROFILE_DB_URL)
-create_database(ENGINE, PROFILE_DB_NAME)
+# Connection pool of the engine, shared by the sessions of concurrent conversations
+PROFILE_DB_POOL_SIZE = int(os.environ.get("PROFILE_DB_POOL_SIZE", 5))
+PROFILE_DB_MAX_OVERFLOW = int(os.environ.get("PROFILE_DB_MAX_OVERFLOW", 10))
+PROFILE_DB_POOL_PRE_PING = os.environ.get("PROFILE_DB_POOL_PRE_PING", "true") == "true"
+PROFILE_DB_POOL_RECYCLE = int(os.environ.get("PROFILE_DB_POOL_RECYCLE", 3600))
+# Number of threads the blocking database calls are offloaded to, so they do not
+# stall the event loop of the action server. Use 0 to run them on the event loop.
+PROFILE_DB_MAX_WORKERS = int(
+    os.environ.get("PROFILE_DB_MAX_WORKERS", PROFILE_DB_POOL_SIZE)
+)
+# With SQLite, use the write-ahead log & other `SQLITE_PRAGMAS`, and run all writes
+# on one thread
+PROFILE_DB_SQLITE_PRODUCTION = (
+    os.environ.get("PROFILE_DB_SQLITE_PRODUCTION", "false") == "true"
+)
+# Read replicas of the database, as comma separated URLs. Reads are routed to them,
+# except for a conversation that wrote in the last `PROFILE_DB_STICKY_SECONDS`.
+PROFILE_DB_REPLICA_URLS = [
+    url for url in os.environ.get("PROFILE_DB_REPLICA_URLS", "").split(",") if url
+]
+PROFILE_DB_STICKY_SECONDS = float(os.environ.get("PROFILE_DB_STICKY_SECONDS", 5))
+
+# How the sample values of a new session are added: "eager", "lazy" or "background"
+PROFILE_DB_POPULATION = os.environ.get("PROFILE_DB_POPULATION", "eager")
+# Number of profiles generated ahead of time, new sessions claim one of them
+PROFILE_DB_PREGENERATED_PROFILES = int(
+    os.environ.get("PROFILE_DB_PREGENERATED_PROFILES", 0)
+)
+# Cache of reference data (recipients, credit cards, vendors) per session
+PROFILE_DB_CACHE_SIZE = int(os.environ.get("PROFILE_DB_CACHE_SIZE", 1024))
+PROFILE_DB_CACHE_TTL = float(os.environ.get("PROFILE_DB_CACHE_TTL", 300))
+# "columnar" answers transaction searches from in-memory columns of each account
+PROFILE_DB_LEDGER_ENGINE = os.environ.get("PROFILE_DB_LEDGER_ENGINE", "sql")
+# Partition the transactions table by month (PostgreSQL only)
+PROFILE_DB_PARTITION_TRANSACTIONS = (
+    os.environ.get("PROFILE_DB_PARTITION_TRANSACTIONS", "false") == "true"
+)
+# Session profiles inactive for longer than the TTL (in seconds) are deleted in
+# batches by a background sweeper. Use 0 to keep all profiles.
+PROFILE_DB_PROFILE_TTL = float(os.environ.get("PROFILE_DB_PROFILE_TTL", 0))
+# Idempotency keys of transfers & payments, and the saved results of their actions,
+# are deleted by the same sweeper after this many seconds. Use 0 to keep them all.
+PROFILE_DB_IDEMPOTENCY_TTL = float(os.environ.get("PROFILE_DB_IDEMPOTENCY_TTL", 86400))
+PROFILE_DB_SWEEP_BATCH_SIZE = int(os.environ.get("PROFILE_DB_SWEEP_BATCH_SIZE", 100))
+PROFILE_DB_SWEEP_INTERVAL = float(os.environ.get("PROFILE_DB_SWEEP_INTERVAL", 3600))
+PROFILE_DB_SWEEP_PAUSE = float(os.environ.get("PROFILE_DB_SWEEP_PAUSE", 1))
+# Seconds during which transfers are queued to be added in one commit. Use 0 to
+# commit every transfer on its own.
+PROFILE_DB_GROUP_COMMIT_INTERVAL = float(
+    os.environ.get("PROFILE_DB_GROUP_COMMIT_INTERVAL", 0)
+)
+
+# More databases to shard the sessions over, as comma separated URLs. The database of
+# `PROFILE_DB_URL` is the first shard. Read replicas & group commit are not used
+# with shards.
+PROFILE_DB_SHARD_URLS = [
+    url for url in os.environ.get("PROFILE_DB_SHARD_URLS", "").split(",") if url
+]
+PROFILE_DB_OPTIONS = dict(
+    population=PROFILE_DB_POPULATION,
+    pregenerated_profiles=PROFILE_DB_PREGENERATED_PROFILES,
+    cache_size=PROFILE_DB_CACHE_SIZE,
+    cache_ttl=PROFILE_DB_CACHE_TTL,
+    ledger_engine=PROFILE_DB_LEDGER_ENGINE,
+    partition_transactions=PROFILE_DB_PARTITION_TRANSACTIONS,
+    profile_ttl=PROFILE_DB_PROFILE_TTL,
+    idempotency_ttl=PROFILE_DB_IDEMPOTENCY_TTL,
+    sweep_batch_size=PROFILE_DB_SWEEP_BATCH_SIZE,
+)
+
+
+def create_engine(url: Text) -> Engine:
+    return create_database_engine(
+        url,
+        pool_size=PROFILE_DB_POOL_SIZE,
+        max_overflow=PROFILE_DB_MAX_OVERFLOW,
+        pool_pre_ping=PROFILE_DB_POOL_PRE_PING,
+        pool_recycle=PROFILE_DB_POOL_RECYCLE,
+        sqlite_pragmas=SQLITE_PRAGMAS if PROFILE_DB_SQLITE_PRODUCTION else None,
+    )
+
+
+def create_profile_db() -> AsyncProfileDB:
+    """Connect to the profile database, with an engine & pool for this process"""
+    engine = create_engine(PROFILE_DB_URL)
+    create_database(engine, PROFILE_DB_NAME)
+    group_commit_interval = PROFILE_DB_GROUP_COMMIT_INTERVAL
+    if PROFILE_DB_SHARD_URLS:
+        engines = [engine] + [create_engine(url) for url in PROFILE_DB_SHARD_URLS]
+        sync_profile_db = ShardedProfileDB(
+            [ProfileDB(engine, **PROFILE_DB_OPTIONS) for engine in engines]
+        )
+        group_commit_interval = 0
+    else:
+        engines = [engine]
+        sync_profile_db = ProfileDB(
+            engine,
+            replica_engines=[create_engine(url) for url in PROFILE_DB_REPLICA_URLS],
+            sticky_seconds=PROFILE_DB_STICKY_SECONDS,
+            **PROFILE_DB_OPTIONS,
+        )
+    return AsyncProfileDB(
+        sync_profile_db,
+        max_workers=PROFILE_DB_MAX_WORKERS,
+        sweep_interval=PROFILE_DB_SWEEP_INTERVAL,
+        sweep_pause=PROFILE_DB_SWEEP_PAUSE,
+        group_commit_interval=group_commit_interval,
+        single_writer=PROFILE_DB_SQLITE_PRODUCTION
+        and all(engine.dialect.name == "sqlite" for engine in engines),
+    )
+
 
-profile_db = ProfileDB(ENGINE)
+# Created on first use in each process, so that the workers of the pre-fork action
+# server (`actions.prefork`) do not share the connections of one engine
+profile_db = ProcessLocal(create_profile_db)
 
 NEXT_FORM_NAME = {
     "pay_cc": "cc_payment_form",
@@ -56,18 +173,80 @@ FORM_DESCRIPTION = {
 }
 
 
-class ActionPayCC(Action):
+class IdempotentAction(Action, metaclass=abc.ABCMeta):
+    """Action that is executed once per triggering event.
+    Rasa retries a call of the action server that timed out with the same tracker, so
+    the `sender_id`, the action name, the timestamp of the latest event and the slots
+    identify one execution. The events & responses of the first execution are saved,
+    and a retry returns them without running `run_once` again. `run_once` gets the
+    idempotency key, to apply the transfer or payment it makes only once too.
+    """
+
+    async def run(
+        self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any],
+    ) -> List[Dict]:
+        """Executes the action, or returns the result of its first execution"""
+        idempotency_key = self.idempotency_key(tracker)
+        if idempotency_key is None:
+            return await self.run_once(dispatcher, tracker, domain, None)
+
+        result = await profile_db.get_idempotent_result(
+            tracker.sender_id, idempotency_key
+        )
+        if result is None:
+            first_message = len(dispatcher.messages)
+            events = await self.run_once(dispatcher, tracker, domain, idempotency_key)
+            result = {"events": events, "messages": dispatcher.messages[first_message:]}
+            await profile_db.save_idempotent_result(
+                tracker.sender_id, idempotency_key, result
+            )
+        else:
+            logger.info(f"Returning the saved result of {idempotency_key}")
+            dispatcher.messages.extend(result["messages"])
+        return result["events"]
+
+    @abc.abstractmethod
+    async def run_once(
+        self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict[Text, Any],
+        idempotency_key: Optional[Text],
+    ) -> List[Dict]:
+        """Executes the action"""
+
+    def idempotency_key(self, tracker: Tracker) -> Optional[Text]:
+        """Get the key of this execution, `None` when the tracker has no events"""
+        timestamps = [
+            event["timestamp"] for event in tracker.events if event.get("timestamp")
+        ]
+        if not timestamps:
+            return None
+        # the slots tell apart executions on trackers with the same latest event
+        slots = json.dumps(tracker.current_slot_values(), sort_keys=True, default=str)
+        slots_digest = hashlib.sha256(slots.encode()).hexdigest()[:16]
+        key = f"{tracker.sender_id}:{self.name()}:{timestamps[-1]}:{slots_digest}"
+        if len(key) > 255:
+            key = hashlib.sha256(key.encode()).hexdigest()
+        return key
+
+
+class ActionPayCC(IdempotentAction):
     """Pay credit card."""
 
     def name(self) -> Text:
         """Unique identifier of the action"""
         return "action_pay_cc"
 
-    async def run(
+    async def run_once(
         self,
         dispatcher: CollectingDispatcher,
         tracker: Tracker,
         domain: Dict[Text, Any],
+        idempotency_key: Optional[Text],
     ) -> List[Dict]:
         """Executes the action"""
 
@@ -91,8 +270,8 @@ class ActionPayCC(Action):
             credit_card = tracker.get_slot("credit_card")
             amount_of_money = float(tracker.get_slot("amount-of-money"))
             amount_transferred = float(tracker.get_slot("amount_transferred"))
-            profile_db.pay_off_credit_card(
-                tracker.sender_id, credit_card, amount_of_money
+            await profile_db.pay_off_credit_card(
+                tracker.sender_id, credit_card, amount_of_money, idempotency_key
             )
 
             dispatcher.utter_message(response="utter_cc_pay_scheduled")
@@ -111,13 +290,13 @@ class ValidatePayCCForm(CustomFormValidationAction):
         """Unique identifier of the action"""
         return "validate_cc_payment_form"
 
-    def amount_from_balance(
+    async def amount_from_balance(
         self, dispatcher, tracker, credit_card_name, balance_type
     ) -> Dict[Text, Any]:
-        amount_balance = profile_db.get_credit_card_balance(
+        amount_balance = await profile_db.get_credit_card_balance(
             tracker.sender_id, credit_card_name, balance_type
         )
-        account_balance = profile_db.get_account_balance(tracker.sender_id)
+        account_balance = await profile_db.get_account_balance(tracker.sender_id)
         if account_balance < float(amount_balance):
             dispatcher.utter_message(response="utter_insufficient_funds")
             return {"amount-of-money": None}
@@ -137,12 +316,12 @@ class ValidatePayCCForm(CustomFormValidationAction):
         if not value:
             return {"amount-of-money": None}
 
-        account_balance = profile_db.get_account_balance(tracker.sender_id)
+        account_balance = await profile_db.get_account_balance(tracker.sender_id)
         # check if user asked to pay the full or the minimum balance
         if type(value) is str:
             credit_card_name = tracker.get_slot("credit_card")
             if credit_card_name:
-                credit_card = profile_db.get_credit_card(
+                credit_card = await profile_db.get_credit_card(
                     tracker.sender_id, credit_card_name
                 )
             else:
@@ -155,7 +334,7 @@ class ValidatePayCCForm(CustomFormValidationAction):
                         f"I see you'd like to pay the {balance_type}."
                     )
                     return {"amount-of-money": balance_type}
-                slots_to_set = self.amount_from_balance(
+                slots_to_set = await self.amount_from_balance(
                     dispatcher, tracker, credit_card_name, balance_type
                 )
                 if float(slots_to_set.get("amount-of-money")) == 0:
@@ -169,19 +348,12 @@ class ValidatePayCCForm(CustomFormValidationAction):
                     }
                 return slots_to_set
 
-        try:
-            entity = get_entity_details(
-                tracker, "amount-of-money"
-            ) or get_entity_details(tracker, "number")
-            amount_currency = parse_duckling_currency(entity)
-            if not amount_currency:
-                raise TypeError
+        amount_currency = normalize_entities(tracker).money
+        if amount_currency:
             if account_balance < float(amount_currency.get("amount-of-money")):
                 dispatcher.utter_message(response="utter_insufficient_funds")
                 return {"amount-of-money": None}
-            return amount_currency
-        except (TypeError, AttributeError):
-            pass
+            return dict(amount_currency)
 
         dispatcher.utter_message(response="utter_no_payment_amount")
         return {"amount-of-money": None}
@@ -194,13 +366,15 @@ class ValidatePayCCForm(CustomFormValidationAction):
         domain: Dict[Text, Any],
     ) -> Dict[Text, Any]:
         """Validates value of 'credit_card' slot"""
-        if value and value.lower() in profile_db.list_credit_cards(tracker.sender_id):
+        credit_card_index = await profile_db.get_credit_card_index(tracker.sender_id)
+        credit_card_name = credit_card_index.resolve(value)
+        if credit_card_name:
             amount = tracker.get_slot("amount-of-money")
-            credit_card_slot = {"credit_card": value.title()}
+            credit_card_slot = {"credit_card": credit_card_name.title()}
             balance_types = profile_db.list_balance_types()
             if amount and amount.lower() in balance_types:
-                updated_amount = self.amount_from_balance(
-                    dispatcher, tracker, value.lower(), amount
+                updated_amount = await self.amount_from_balance(
+                    dispatcher, tracker, credit_card_name, amount
                 )
                 if float(updated_amount.get("amount-of-money")) == 0:
                     dispatcher.utter_message(
@@ -211,7 +385,9 @@ class ValidatePayCCForm(CustomFormValidationAction):
                         "credit_card": None,
                         "payment_amount_type": None,
                     }
-                account_balance = profile_db.get_account_balance(tracker.sender_id)
+                account_balance = await profile_db.get_account_balance(
+                    tracker.sender_id
+                )
                 if account_balance < float(updated_amount.get("amount-of-money")):
                     dispatcher.utter_message(
                         response="utter_insufficient_funds_specific", **updated_amount
@@ -232,8 +408,8 @@ class ValidatePayCCForm(CustomFormValidationAction):
     ) -> Dict[Text, Any]:
         """Explains 'credit_card' slot"""
         dispatcher.utter_message("You have the following credits cards:")
-        for credit_card in profile_db.list_credit_cards(tracker.sender_id):
-            current_balance = profile_db.get_credit_card_balance(
+        for credit_card in await profile_db.list_credit_cards(tracker.sender_id):
+            current_balance = await profile_db.get_credit_card_balance(
                 tracker.sender_id, credit_card
             )
             dispatcher.utter_message(
@@ -253,12 +429,11 @@ class ValidatePayCCForm(CustomFormValidationAction):
         domain: Dict[Text, Any],
     ) -> Dict[Text, Any]:
         """Validates value of 'time' slot"""
-        timeentity = get_entity_details(tracker, "time")
-        parsedtime = timeentity and parse_duckling_time(timeentity)
+        parsedtime = normalize_entities(tracker).time
         if not parsedtime:
             dispatcher.utter_message(response="utter_no_transactdate")
             return {"time": None}
-        return parsedtime
+        return dict(parsedtime)
 
     async def validate_zz_confirm_form(
         self,
@@ -309,24 +484,16 @@ class ActionTransactionSearch(Action):
             vendor_name = f" at {vendor.title()}" if vendor else ""
             start_time = parser.isoparse(tracker.get_slot("start_time"))
             end_time = parser.isoparse(tracker.get_slot("end_time"))
-            transactions = profile_db.search_transactions(
+            summary = await profile_db.search_transactions_summary(
                 tracker.sender_id,
                 start_time=start_time,
                 end_time=end_time,
                 deposit=deposit,
                 vendor=vendor,
             )
-
-            aliased_transactions = transactions.subquery()
-            total = profile_db.session.query(
-                sa.func.sum(aliased_transactions.c.amount)
-            )[0][0]
-            if not total:
-                total = 0
-            numtransacts = transactions.count()
             slotvars = {
-                "total": f"{total:.2f}",
-                "numtransacts": numtransacts,
+                "total": f"{summary['total']:.2f}",
+                "numtransacts": summary["count"],
                 "start_time_formatted": tracker.get_slot("start_time_formatted"),
                 "end_time_formatted": tracker.get_slot("end_time_formatted"),
                 "vendor_name": vendor_name,
@@ -388,8 +555,9 @@ class ValidateTransactionSearchForm(CustomFormValidationAction):
         domain: Dict[Text, Any],
     ) -> Dict[Text, Any]:
         """Validates value of 'vendor_name' slot"""
-        if value and value.lower() in profile_db.list_vendors():
-            return {"vendor_name": value}
+        vendor_name = (await profile_db.get_vendor_index()).resolve(value)
+        if vendor_name:
+            return {"vendor_name": vendor_name}
 
         dispatcher.utter_message(response="utter_no_vendor_name")
         return {"vendor_name": None}
@@ -402,24 +570,27 @@ class ValidateTransactionSearchForm(CustomFormValidationAction):
         domain: Dict[Text, Any],
     ) -> Dict[Text, Any]:
         """Validates value of 'time' slot"""
-        timeentity = get_entity_details(tracker, "time")
-        parsedinterval = timeentity and parse_duckling_time_as_interval(timeentity)
+        parsedinterval = normalize_entities(tracker).time_interval
         if not parsedinterval:
             dispatcher.utter_message(response="utter_no_transactdate")
             return {"time": None}
 
-        return parsedinterval
+        return dict(parsedinterval)
 
 
-class ActionTransferMoney(Action):
+class ActionTransferMoney(IdempotentAction):
     """Transfers Money."""
 
     def name(self) -> Text:
         """Unique identifier of the action"""
         return "action_transfer_money"
 
-    async def run(
-        self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict
+    async def run_once(
+        self,
+        dispatcher: CollectingDispatcher,
+        tracker: Tracker,
+        domain: Dict,
+        idempotency_key: Optional[Text],
     ) -> List[EventType]:
         """Executes the action"""
         slots = {
@@ -432,18 +603,11 @@ class ActionTransferMoney(Action):
 
         if tracker.get_slot("zz_confirm_form") == "yes":
             amount_of_money = float(tracker.get_slot("amount-of-money"))
-            from_account_number = profile_db.get_account_number(
-                profile_db.get_account_from_session_id(tracker.sender_id)
-            )
-            to_account_number = profile_db.get_account_number(
-                profile_db.get_recipient_from_name(
-                    tracker.sender_id, tracker.get_slot("PERSON")
-                )
-            )
-            profile_db.transact(
-                from_account_number,
-                to_account_number,
+            await profile_db.transfer_money(
+                tracker.sender_id,
+                tracker.get_slot("PERSON"),
                 amount_of_money,
+                idempotency_key,
             )
 
             dispatcher.utter_message(response="utter_transfer_complete")
@@ -476,17 +640,12 @@ class ValidateTransferMoneyForm(CustomFormValidationAction):
         if isinstance(value, list):
             value = value[0]
 
-        name = value.lower() if value else None
-        known_recipients = profile_db.list_known_recipients(tracker.sender_id)
-        first_names = [name.split()[0] for name in known_recipients]
-        if name is not None and name in known_recipients:
+        # a nickname, or the first name of one
+        recipient_index = await profile_db.get_recipient_index(tracker.sender_id)
+        name = recipient_index.resolve(value)
+        if name:
             return {"PERSON": name.title()}
 
-        if name in first_names:
-            index = first_names.index(name)
-            fullname = known_recipients[index]
-            return {"PERSON": fullname.title()}
-
         dispatcher.utter_message(response="utter_unknown_recipient", PERSON=value)
         return {"PERSON": None}
 
@@ -498,7 +657,7 @@ class ValidateTransferMoneyForm(CustomFormValidationAction):
         domain: Dict[Text, Any],
     ) -> Dict[Text, Any]:
         """Explains 'PERSON' slot"""
-        recipients = profile_db.list_known_recipients(tracker.sender_id)
+        recipients = await profile_db.list_known_recipients(tracker.sender_id)
         formatted_recipients = "\n" + "\n".join(
             [f"- {recipient.title()}" for recipient in recipients]
         )
@@ -516,21 +675,15 @@ class ValidateTransferMoneyForm(CustomFormValidationAction):
         domain: Dict[Text, Any],
     ) -> Dict[Text, Any]:
         """Validates value of 'amount-of-money' slot"""
-        account_balance = profile_db.get_account_balance(tracker.sender_id)
-        try:
-            entity = get_entity_details(
-                tracker, "amount-of-money"
-            ) or get_entity_details(tracker, "number")
-            amount_currency = parse_duckling_currency(entity)
-            if not amount_currency:
-                raise TypeError
-            if account_balance < float(amount_currency.get("amount-of-money")):
-                dispatcher.utter_message(response="utter_insufficient_funds")
-                return {"amount-of-money": None}
-            return amount_currency
-        except (TypeError, AttributeError):
+        account_balance = await profile_db.get_account_balance(tracker.sender_id)
+        amount_currency = normalize_entities(tracker).money
+        if not amount_currency:
             dispatcher.utter_message(response="utter_no_payment_amount")
             return {"amount-of-money": None}
+        if account_balance < float(amount_currency.get("amount-of-money")):
+            dispatcher.utter_message(response="utter_insufficient_funds")
+            return {"amount-of-money": None}
+        return dict(amount_currency)
 
     async def validate_zz_confirm_form(
         self,
@@ -562,10 +715,10 @@ class ActionShowBalance(Action):
         if account_type == "credit":
             # show credit card balance
             credit_card = tracker.get_slot("credit_card")
-            available_cards = profile_db.list_credit_cards(tracker.sender_id)
+            available_cards = await profile_db.list_credit_cards(tracker.sender_id)
 
             if credit_card and credit_card.lower() in available_cards:
-                current_balance = profile_db.get_credit_card_balance(
+                current_balance = await profile_db.get_credit_card_balance(
                     tracker.sender_id, credit_card
                 )
                 dispatcher.utter_message(
@@ -576,8 +729,10 @@ class ActionShowBalance(Action):
                     },
                 )
             else:
-                for credit_card in profile_db.list_credit_cards(tracker.sender_id):
-                    current_balance = profile_db.get_credit_card_balance(
+                for credit_card in await profile_db.list_credit_cards(
+                    tracker.sender_id
+                ):
+                    current_balance = await profile_db.get_credit_card_balance(
                         tracker.sender_id, credit_card
                     )
                     dispatcher.utter_message(
@@ -589,7 +744,7 @@ class ActionShowBalance(Action):
                     )
         else:
             # show bank account balance
-            account_balance = profile_db.get_account_balance(tracker.sender_id)
+            account_balance = await profile_db.get_account_balance(tracker.sender_id)
             amount = tracker.get_slot("amount_transferred")
             if amount:
                 amount = float(tracker.get_slot("amount_transferred"))
@@ -629,7 +784,7 @@ class ActionShowRecipients(Action):
         self, dispatcher: CollectingDispatcher, tracker: Tracker, domain: Dict
     ) -> List[EventType]:
         """Executes the custom action"""
-        recipients = profile_db.list_known_recipients(tracker.sender_id)
+        recipients = await profile_db.list_known_recipients(tracker.sender_id)
         formatted_recipients = "\n" + "\n".join(
             [f"- {recipient.title()}" for recipient in recipients]
         )
@@ -715,8 +870,8 @@ class ActionSessionStart(Action):
         events.extend(self._slot_set_events_from_tracker(tracker))
 
         # create a mock profile by populating database with values specific to tracker.sender_id
-        profile_db.populate_profile_db(tracker.sender_id)
-        currency = profile_db.get_currency(tracker.sender_id)
+        await profile_db.populate_profile_db(tracker.sender_id)
+        currency = await profile_db.get_currency(tracker.sender_id)
 
         # initialize slots from mock profile
         events.append(SlotSet("currency", currency))
@@ -0,0 +1,72 @@
+"""In-process cache for reference data of the profile database."""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Text
+
+
+class TTLCache:
+    """Thread-safe read-through cache with least-recently-used eviction.
+    Entries expire `ttl` seconds after they were loaded, which bounds how long a value
+    changed by another action server process can be served.
+    Keys are tuples that start with a group, usually a `session_id`, so all entries of
+    a group can be invalidated together.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 300.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_load(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """Get the value of `key`, calling `load` to get it when it is not cached"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and entry[0] > now:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+
+        # load outside of the lock, a concurrent miss at worst loads the value twice
+        value = load()
+        if self.max_size <= 0:
+            return value
+        with self.lock:
+            self.entries[key] = (now + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+        return value
+
+    def __contains__(self, key: Hashable) -> bool:
+        """Check whether `key` is cached and not expired, without loading it"""
+        with self.lock:
+            entry = self.entries.get(key)
+            return entry is not None and entry[0] > time.monotonic()
+
+    def invalidate(self, group: Hashable):
+        """Remove all entries whose key starts with `group`"""
+        with self.lock:
+            for key in [key for key in self.entries if key[0] == group]:
+                del self.entries[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> Dict[Text, int]:
+        """Get the hit/miss counters and the current size of the cache"""
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "size": len(self.entries),
+            }
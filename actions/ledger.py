@@ -0,0 +1,220 @@
+"""Columnar in-memory ledger for transaction searches.
+
+The transactions of an account are loaded once into array-backed columns, sorted by
+time: timestamps as int64 microseconds, amounts as float64 and the account numbers of
+the counterparties. A search is then a `searchsorted` on the time axis plus a mask on
+the counterparty, instead of a query over the transactions table.
+
+`ProfileDB` writes new transactions through to the loaded columns. Transactions made
+by other action server processes are only seen once the columns expire after `ttl`
+seconds, the same as the reference data in `actions.cache.TTLCache`.
+"""
+import threading
+import time
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Text, Tuple
+
+import numpy as np
+
+DIRECTIONS = ["outgoing", "incoming"]
+
+
+def to_microseconds(timestamp: datetime) -> int:
+    """Get a naive timestamp as microseconds since the epoch.
+    Timezones are dropped, the same way SQLite compares the stored timestamps.
+    """
+    return int(np.datetime64(timestamp.replace(tzinfo=None), "us").astype(np.int64))
+
+
+class LedgerColumns:
+    """The transactions of one account in one direction, sorted by timestamp.
+    The arrays are never changed in place, `append` replaces all of them at once, so
+    a search can read them without a lock.
+    """
+
+    def __init__(
+        self,
+        timestamps: np.ndarray,
+        amounts: np.ndarray,
+        counterparties: np.ndarray,
+    ):
+        self.arrays = (timestamps, amounts, counterparties)
+
+    @classmethod
+    def from_rows(cls, rows: Iterable[Tuple[datetime, float, Text]]) -> "LedgerColumns":
+        """Build the columns from `(timestamp, amount, counterparty)` rows"""
+        rows = sorted(rows, key=lambda row: row[0])
+        return cls(
+            np.array([to_microseconds(row[0]) for row in rows], dtype=np.int64),
+            np.array([row[1] for row in rows], dtype=np.float64),
+            np.array([row[2] for row in rows], dtype=object),
+        )
+
+    def append(self, timestamp: datetime, amount: float, counterparty: Text):
+        """Add a transaction, keeping the columns sorted by timestamp"""
+        timestamps, amounts, counterparties = self.arrays
+        microseconds = to_microseconds(timestamp)
+        position = np.searchsorted(timestamps, microseconds, side="right")
+        self.arrays = (
+            np.insert(timestamps, position, microseconds),
+            np.insert(amounts, position, amount),
+            np.insert(counterparties, position, counterparty),
+        )
+
+    def summarize(
+        self,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        counterparty: Optional[Text] = None,
+    ) -> Dict[Text, Any]:
+        """Get the `count`, `total`, `min` and `max` of the amounts between
+        `start_time` and `end_time`, both inclusive, optionally with one counterparty.
+        """
+        timestamps, amounts, counterparties = self.arrays
+        first = 0
+        last = len(timestamps)
+        if start_time:
+            first = np.searchsorted(timestamps, to_microseconds(start_time), "left")
+        if end_time:
+            last = np.searchsorted(timestamps, to_microseconds(end_time), "right")
+        amounts = amounts[first:last]
+        if counterparty is not None:
+            amounts = amounts[counterparties[first:last] == counterparty]
+        if not len(amounts):
+            return {"count": 0, "total": 0, "min": None, "max": None}
+        return {
+            "count": int(len(amounts)),
+            "total": float(amounts.sum()),
+            "min": float(amounts.min()),
+            "max": float(amounts.max()),
+        }
+
+
+class ColumnarLedger:
+    """Thread-safe store of the `LedgerColumns` of recently searched accounts.
+    `load(account_number)` gets the `(from_account_number, to_account_number, amount,
+    timestamp)` rows of all transactions to or from the account. At most
+    `max_accounts` accounts are kept, least recently used ones are evicted first.
+    """
+
+    def __init__(
+        self,
+        load: Callable[[Text], Iterable[Tuple[Text, Text, float, datetime]]],
+        max_accounts: int = 1024,
+        ttl: float = 300.0,
+    ):
+        self.load = load
+        self.max_accounts = max_accounts
+        self.ttl = ttl
+        self.accounts = OrderedDict()
+        # a load that overlaps a write of its account is not kept, as it may or may
+        # not contain the written transaction. Only accounts that are being loaded
+        # or written are counted, so these stay as small as the number of threads.
+        self.loading = Counter()
+        self.writing = Counter()
+        self.stale = set()
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def writing_to(self, *account_numbers: Text) -> Iterator[None]:
+        """Context of a database transaction that writes to the transactions of
+        `account_numbers`, from before its commit until after it is `append`ed.
+        """
+        self.mark_written(account_numbers, 1)
+        try:
+            yield
+        finally:
+            self.mark_written(account_numbers, -1)
+
+    def mark_written(self, account_numbers: Iterable[Text], change: int):
+        with self.lock:
+            for account_number in account_numbers:
+                self.writing[account_number] += change
+                if not self.writing[account_number]:
+                    del self.writing[account_number]
+                if account_number in self.loading:
+                    self.stale.add(account_number)
+
+    def get_columns(self, account_number: Text) -> Dict[Text, LedgerColumns]:
+        """Get the outgoing and incoming columns of an account, loading them if needed"""
+        now = time.monotonic()
+        with self.lock:
+            entry = self.accounts.get(account_number)
+            if entry is not None and entry[0] > now:
+                self.accounts.move_to_end(account_number)
+                return entry[1]
+            self.loading[account_number] += 1
+
+        try:
+            rows = {direction: [] for direction in DIRECTIONS}
+            for from_account_number, to_account_number, amount, timestamp in self.load(
+                account_number
+            ):
+                if from_account_number == account_number:
+                    rows["outgoing"].append((timestamp, amount, to_account_number))
+                if to_account_number == account_number:
+                    rows["incoming"].append((timestamp, amount, from_account_number))
+            columns = {
+                direction: LedgerColumns.from_rows(rows[direction])
+                for direction in DIRECTIONS
+            }
+        finally:
+            with self.lock:
+                stale = account_number in self.stale or account_number in self.writing
+                self.loading[account_number] -= 1
+                if not self.loading[account_number]:
+                    del self.loading[account_number]
+                    self.stale.discard(account_number)
+
+        with self.lock:
+            if not stale and self.max_accounts > 0:
+                self.accounts[account_number] = (now + self.ttl, columns)
+                self.accounts.move_to_end(account_number)
+                while len(self.accounts) > self.max_accounts:
+                    self.accounts.popitem(last=False)
+        return columns
+
+    def append(
+        self,
+        from_account_number: Text,
+        to_account_number: Text,
+        amount: float,
+        timestamp: datetime,
+    ):
+        """Write a committed transaction through to the columns of both accounts,
+        within the `writing_to()` context of its database transaction
+        """
+        with self.lock:
+            for account_number, direction, counterparty in [
+                (from_account_number, "outgoing", to_account_number),
+                (to_account_number, "incoming", from_account_number),
+            ]:
+                entry = self.accounts.get(account_number)
+                if entry is not None:
+                    entry[1][direction].append(timestamp, amount, counterparty)
+
+    def summarize(
+        self,
+        account_number: Text,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        deposit: bool = False,
+        counterparty_account_number: Optional[Text] = None,
+    ) -> Dict[Text, Any]:
+        """Summarize the spend (or with `deposit`, earnings) transactions of an
+        account, the same way as `ProfileDB.search_transactions_summary`
+        """
+        columns = self.get_columns(account_number)
+        return columns["incoming" if deposit else "outgoing"].summarize(
+            start_time, end_time, counterparty_account_number
+        )
+
+    def invalidate(self, account_number: Optional[Text] = None):
+        """Drop the columns of an account, or of all accounts"""
+        with self.lock:
+            if account_number is None:
+                self.accounts.clear()
+            else:
+                self.accounts.pop(account_number, None)
@@ -0,0 +1,199 @@
+"""Versioned schema migrations of the profile database.
+
+`ProfileDB.create_tables()` creates missing tables from the current models, which does
+not change tables that already exist. Changes to existing tables are therefore added
+here as numbered migrations, which `migrate()` applies in order and records in the
+`schema_version` table.
+
+Migrations must be safe to run on a database that was just created from the current
+models, so they check what already exists before changing anything.
+"""
+import logging
+from datetime import datetime
+from typing import Callable, List, Text, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.engine.base import Connection, Engine
+
+logger = logging.getLogger(__name__)
+
+metadata = sa.MetaData()
+
+schema_version = sa.Table(
+    "schema_version",
+    metadata,
+    sa.Column("version", sa.Integer, primary_key=True),
+    sa.Column("description", sa.String(255)),
+    sa.Column("applied_at", sa.DateTime),
+)
+
+
+def add_index(
+    connection: Connection, table_name: Text, index_name: Text, columns: List[Text]
+):
+    """Create an index, unless an index with that name already exists"""
+    existing = [
+        index["name"] for index in sa.inspect(connection).get_indexes(table_name)
+    ]
+    if index_name in existing:
+        return
+    table = sa.Table(table_name, sa.MetaData(), autoload_with=connection)
+    sa.Index(index_name, *[table.c[column] for column in columns]).create(connection)
+
+
+def add_column(connection: Connection, table_name: Text, column: sa.Column):
+    """Add a column, unless a column with that name already exists"""
+    existing = [
+        column["name"] for column in sa.inspect(connection).get_columns(table_name)
+    ]
+    if column.name in existing:
+        return
+    column_ddl = sa.schema.CreateColumn(column).compile(dialect=connection.dialect)
+    connection.execute(f"ALTER TABLE {table_name} ADD COLUMN {column_ddl}")
+
+
+def add_profile_indexes(connection: Connection):
+    add_index(connection, "account", "ix_account_session_id", ["session_id"])
+    add_index(connection, "creditcards", "ix_creditcards_account_id", ["account_id"])
+    add_index(
+        connection,
+        "recipient_relationships",
+        "ix_recipient_relationships_account_id",
+        ["account_id"],
+    )
+    add_index(
+        connection,
+        "transactions",
+        "ix_transactions_from_account_number_timestamp",
+        ["from_account_number", "timestamp"],
+    )
+    add_index(
+        connection,
+        "transactions",
+        "ix_transactions_to_account_number_timestamp",
+        ["to_account_number", "timestamp"],
+    )
+
+
+def add_account_profile_populated(connection: Connection):
+    add_column(
+        connection,
+        "account",
+        sa.Column(
+            "profile_populated",
+            sa.Boolean(create_constraint=False),
+            nullable=False,
+            server_default="1",
+        ),
+    )
+
+
+def backfill_transaction_rollups(connection: Connection):
+    """Build the rollups of the transactions that were made before the rollups table
+    existed. The table itself is created by `ProfileDB.create_tables()`.
+    """
+    from actions import rollups
+
+    transactions = sa.Table("transactions", sa.MetaData(), autoload_with=connection)
+    transaction_rollups = sa.Table(
+        "transaction_rollups", sa.MetaData(), autoload_with=connection
+    )
+    connection.execute(transaction_rollups.delete())
+    rows = rollups.aggregate(
+        dict(row)
+        for row in connection.execute(
+            sa.select(
+                [
+                    transactions.c.from_account_number,
+                    transactions.c.to_account_number,
+                    transactions.c.amount,
+                    transactions.c.timestamp,
+                ]
+            )
+        )
+    )
+    if rows:
+        connection.execute(transaction_rollups.insert(), rows)
+
+
+def add_account_last_active_at(connection: Connection):
+    add_column(connection, "account", sa.Column("last_active_at", sa.DateTime))
+    add_index(connection, "account", "ix_account_last_active_at", ["last_active_at"])
+    # existing session accounts expire as if they were active now, the general
+    # and pre-generated accounts never expire
+    general_prefixes = ["recipient_", "vendor_", "depositor_", "pool_"]
+    account = sa.table("account", sa.column("session_id"), sa.column("last_active_at"))
+    connection.execute(
+        account.update()
+        .where(account.c.last_active_at.is_(None))
+        .where(
+            sa.and_(
+                *[
+                    sa.not_(account.c.session_id.startswith(prefix, autoescape=True))
+                    for prefix in general_prefixes
+                ]
+            )
+        )
+        .values(last_active_at=datetime.utcnow())
+    )
+
+
+def add_idempotency_key_result(connection: Connection):
+    add_column(connection, "idempotency_keys", sa.Column("result", sa.Text))
+
+
+def add_idempotency_key_created_at_index(connection: Connection):
+    add_index(
+        connection,
+        "idempotency_keys",
+        "ix_idempotency_keys_created_at",
+        ["created_at"],
+    )
+
+
+MIGRATIONS: List[Tuple[int, Text, Callable[[Connection], None]]] = [
+    (1, "add indexes to the profile tables", add_profile_indexes),
+    (2, "add account.profile_populated", add_account_profile_populated),
+    (3, "backfill transaction_rollups", backfill_transaction_rollups),
+    (4, "add account.last_active_at", add_account_last_active_at),
+    (5, "add idempotency_keys.result", add_idempotency_key_result),
+    (6, "index idempotency_keys.created_at", add_idempotency_key_created_at_index),
+]
+
+
+def get_schema_version(engine: Engine) -> int:
+    """Get the version of the last migration applied to the database"""
+    schema_version.create(engine, checkfirst=True)
+    with engine.connect() as connection:
+        version = connection.execute(
+            sa.select([sa.func.max(schema_version.c.version)])
+        ).scalar()
+    return version or 0
+
+
+def migrate(engine: Engine) -> List[int]:
+    """Apply the migrations that are newer than the schema version of the database.
+    Each migration runs in its own transaction together with its version record.
+    Returns the versions that were applied.
+    """
+    applied = []
+    current_version = get_schema_version(engine)
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        logger.info(f"Migrating profile database to version {version}: {description}")
+        try:
+            with engine.begin() as connection:
+                migration(connection)
+                connection.execute(
+                    schema_version.insert().values(
+                        version=version,
+                        description=description,
+                        applied_at=datetime.now(),
+                    )
+                )
+        except sa.exc.IntegrityError:
+            # another action server applied this migration at the same time
+            logger.debug(f"Migration {version} was already applied")
+        applied.append(version)
+    return applied
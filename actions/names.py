@@ -0,0 +1,114 @@
+"""Resolution of the names users refer to: recipients, vendors & credit cards.
+
+A `NameIndex` is a trie of normalized names and their aliases, e.g. the first names
+of recipients. An exact lookup walks the trie in O(len(query)). A fuzzy lookup walks
+it with one row of the edit distance table per trie node, and skips the branches whose
+row is already past the allowed number of typos, so "starbuks" resolves to
+"starbucks" without comparing the query with every name.
+"""
+from typing import Dict, Iterable, List, Optional, Set, Text, Tuple
+
+# Key of the name that ends at a trie node, no character is empty
+END = ""
+
+
+def normalize(name: Text) -> Text:
+    return " ".join(name.lower().split())
+
+
+def max_typos(query: Text) -> int:
+    """Number of typos allowed in a query, none for short ones like "bob" """
+    if len(query) <= 3:
+        return 0
+    if len(query) <= 7:
+        return 1
+    return 2
+
+
+class NameIndex:
+    def __init__(
+        self, names: Iterable[Text], aliases: Iterable[Tuple[Text, Text]] = ()
+    ):
+        """Index `names`, and `(alias, name)` pairs that resolve to a name.
+        When names or aliases collide, the first one added is kept.
+        """
+        self.root: Dict[Text, dict] = {}
+        for name in names:
+            self.add(name, name)
+        for alias, name in aliases:
+            self.add(alias, name)
+
+    def add(self, key: Text, name: Text):
+        node = self.root
+        for char in normalize(key):
+            node = node.setdefault(char, {})
+        node.setdefault(END, name)
+
+    def exact(self, query: Text) -> Optional[Text]:
+        node = self.root
+        for char in normalize(query):
+            node = node.get(char)
+            if node is None:
+                return None
+        return node.get(END)
+
+    def fuzzy(self, query: Text, max_distance: int) -> List[Tuple[int, Text]]:
+        """Get the `(distance, name)` of all keys within `max_distance` edits.
+        An edit is an inserted, deleted or replaced character, or two swapped ones.
+        """
+        query = normalize(query)
+        matches = []
+
+        def walk(
+            node: dict,
+            char: Text,
+            previous_row: List[int],
+            previous_char: Optional[Text] = None,
+            row_before: Optional[List[int]] = None,
+        ):
+            row = [previous_row[0] + 1]
+            for i, query_char in enumerate(query, start=1):
+                distance = min(
+                    row[i - 1] + 1,
+                    previous_row[i] + 1,
+                    previous_row[i - 1] + (query_char != char),
+                )
+                if (
+                    row_before is not None
+                    and i > 1
+                    and query_char == previous_char
+                    and query[i - 2] == char
+                ):
+                    # swapped neighbours, e.g. "tagret"
+                    distance = min(distance, row_before[i - 2] + 1)
+                row.append(distance)
+            if END in node and row[-1] <= max_distance:
+                matches.append((row[-1], node[END]))
+            if min(row) <= max_distance:
+                for child_char, child in node.items():
+                    if child_char != END:
+                        walk(child, child_char, row, char, previous_row)
+
+        first_row = list(range(len(query) + 1))
+        for char, child in self.root.items():
+            if char != END:
+                walk(child, char, first_row)
+        return matches
+
+    def resolve(self, query: Optional[Text]) -> Optional[Text]:
+        """Get the name `query` refers to, allowing for typos. Returns `None` when
+        no name is close enough, or several names are equally close.
+        """
+        if not query or not normalize(query):
+            return None
+        name = self.exact(query)
+        if name is not None:
+            return name
+        matches = self.fuzzy(query, max_typos(normalize(query)))
+        if not matches:
+            return None
+        best = min(distance for distance, _ in matches)
+        names: Set[Text] = {name for distance, name in matches if distance == best}
+        if len(names) == 1:
+            return names.pop()
+        return None
@@ -1,51 +1,93 @@
+import functools
+from collections import OrderedDict
+from datetime import datetime
 from dateutil import relativedelta, parser
-from typing import Dict, Text, Any, Optional
+from typing import Callable, Dict, List, NamedTuple, Text, Any, Optional, Tuple
 from rasa_sdk import Tracker
 
 
+# Number of parsed timestamps & intervals kept. The same Duckling values are parsed
+# for the interval and again to format its ends, and recur over the turns of a form.
+TIME_CACHE_SIZE = 1024
+
+GRAIN_FORMATS = {
+    "second": "%I:%M:%S%p, %A %b %d, %Y",
+    "day": "%A %b %d, %Y",
+    "week": "%A %b %d, %Y",
+    "month": "%b %Y",
+    "year": "%Y",
+}
+DEFAULT_FORMAT = "%I:%M%p, %A %b %d, %Y"
+
+
+class TimeValue(NamedTuple):
+    """A Duckling timestamp, parsed once, with its ISO string & formatted text"""
+
+    isotime: Text
+    parsed: datetime
+    formatted: Text
+
+
+class TimeInterval(NamedTuple):
+    start: TimeValue
+    end: TimeValue
+    grain: Optional[Text]
+
+    def as_dict(self) -> Dict[Text, Any]:
+        """Get the interval as the slot values of a transaction search"""
+        return {
+            "start_time": self.start.isotime,
+            "start_time_formatted": self.start.formatted,
+            "end_time": self.end.isotime,
+            "end_time_formatted": self.end.formatted,
+            "grain": self.grain,
+        }
+
+
+@functools.lru_cache(maxsize=TIME_CACHE_SIZE)
+def parse_isotime(isotime: Text, grain: Optional[Text] = None) -> TimeValue:
+    parsed = parser.isoparse(isotime)
+    return TimeValue(
+        isotime, parsed, parsed.strftime(GRAIN_FORMATS.get(grain, DEFAULT_FORMAT))
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def grain_delta(grain: Text) -> relativedelta.relativedelta:
+    return relativedelta.relativedelta(**{f"{grain}s": 1})
+
+
+@functools.lru_cache(maxsize=TIME_CACHE_SIZE)
+def parse_interval(
+    start: Optional[Text], end: Optional[Text], grain: Optional[Text]
+) -> TimeInterval:
+    """Get the interval from `start` to `end`. When only one of them is given, the
+    interval is one `grain` long.
+    """
+    if start and not end:
+        parsedstart = parse_isotime(start, grain)
+        end = (parsedstart.parsed + grain_delta(grain)).isoformat()
+        return TimeInterval(parsedstart, parse_isotime(end, grain), grain)
+    if end and not start:
+        parsedend = parse_isotime(end, grain)
+        start = (parsedend.parsed - grain_delta(grain)).isoformat()
+        return TimeInterval(parse_isotime(start, grain), parsedend, grain)
+    return TimeInterval(parse_isotime(start, grain), parse_isotime(end, grain), grain)
+
+
 def close_interval_duckling_time(
     timeinfo: Dict[Text, Any]
 ) -> Optional[Dict[Text, Any]]:
     grain = timeinfo.get("to", timeinfo.get("from", {})).get("grain")
     start = timeinfo.get("from", {}).get("value")
     end = timeinfo.get("to", {}).get("value")
-    if (start or end) and not (start and end):
-        deltaargs = {f"{grain}s": 1}
-        delta = relativedelta.relativedelta(**deltaargs)
-        if start:
-            parsedstart = parser.isoparse(start)
-            parsedend = parsedstart + delta
-            end = parsedend.isoformat()
-        elif end:
-            parsedend = parser.isoparse(end)
-            parsedstart = parsedend - delta
-            start = parsedstart.isoformat()
-    return {
-        "start_time": start,
-        "start_time_formatted": format_isotime_by_grain(start, grain),
-        "end_time": end,
-        "end_time_formatted": format_isotime_by_grain(end, grain),
-        "grain": grain,
-    }
+    return parse_interval(start, end, grain).as_dict()
 
 
 def make_interval_from_value_duckling_time(
     timeinfo: Dict[Text, Any]
 ) -> Dict[Text, Any]:
-    grain = timeinfo.get("grain")
-    start = timeinfo.get("value")
-    parsedstart = parser.isoparse(start)
-    deltaargs = {f"{grain}s": 1}
-    delta = relativedelta.relativedelta(**deltaargs)
-    parsedend = parsedstart + delta
-    end = parsedend.isoformat()
-    return {
-        "start_time": start,
-        "start_time_formatted": format_isotime_by_grain(start, grain),
-        "end_time": end,
-        "end_time_formatted": format_isotime_by_grain(end, grain),
-        "grain": grain,
-    }
+    return parse_interval(timeinfo.get("value"), None, timeinfo.get("grain")).as_dict()
 
 
 def parse_duckling_time_as_interval(
@@ -59,17 +101,7 @@ def parse_duckling_time_as_interval(
 
 
 def format_isotime_by_grain(isotime, grain=None):
-    value = parser.isoparse(isotime)
-    grain_format = {
-        "second": "%I:%M:%S%p, %A %b %d, %Y",
-        "day": "%A %b %d, %Y",
-        "week": "%A %b %d, %Y",
-        "month": "%b %Y",
-        "year": "%Y",
-    }
-    timeformat = grain_format.get(grain, "%I:%M%p, %A %b %d, %Y")
-    time_formatted = value.strftime(timeformat)
-    return time_formatted
+    return parse_isotime(isotime, grain).formatted
 
 
 def parse_duckling_time(timeentity: Dict[Text, Any]) -> Optional[Dict[Text, Any]]:
@@ -91,10 +123,7 @@ def parse_duckling_time(timeentity: Dict[Text, Any]) -> Optional[Dict[Text, Any]
 def get_entity_details(
     tracker: Tracker, entity_type: Text
 ) -> Optional[Dict[Text, Any]]:
-    all_entities = tracker.latest_message.get("entities", [])
-    entities = [e for e in all_entities if e.get("entity") == entity_type]
-    if entities:
-        return entities[0]
+    return normalize_entities(tracker).first(entity_type)
 
 
 def parse_duckling_currency(entity: Dict[Text, Any]) -> Optional[Dict[Text, Any]]:
@@ -105,3 +134,79 @@ def parse_duckling_currency(entity: Dict[Text, Any]) -> Optional[Dict[Text, Any]
     elif entity.get("entity") == "number":
         amount = entity.get("value")
         return {"amount-of-money": f"{amount:.2f}", "currency": "$"}
+
+
+# Number of messages whose normalized entities are kept, a few per concurrent turn
+ENTITIES_CACHE_SIZE = 256
+
+
+class MessageEntities(NamedTuple):
+    """The entities of a message indexed by type, with the values the forms use
+    parsed once. The parsed values are shared by every validator of the turn and must
+    not be changed.
+    """
+
+    by_type: Dict[Text, List[Dict[Text, Any]]]
+    # `parse_duckling_currency` of the amount of money, or else of the number
+    money: Optional[Dict[Text, Any]]
+    number: Optional[float]
+    # `parse_duckling_time` & `parse_duckling_time_as_interval` of the time
+    time: Optional[Dict[Text, Any]]
+    time_interval: Optional[Dict[Text, Any]]
+    person: Optional[Text]
+
+    def first(self, entity_type: Text) -> Optional[Dict[Text, Any]]:
+        entities = self.by_type.get(entity_type)
+        if entities:
+            return entities[0]
+
+
+def parse_or_none(parse: Callable, entity: Optional[Dict[Text, Any]]) -> Any:
+    if entity is None:
+        return None
+    try:
+        return parse(entity)
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def index_entities(entities: List[Dict[Text, Any]]) -> MessageEntities:
+    """Index and parse the entities of a message in one pass"""
+    by_type = {}
+    for entity in entities:
+        by_type.setdefault(entity.get("entity"), []).append(entity)
+    first = {entity_type: typed[0] for entity_type, typed in by_type.items()}
+    number = first.get("number", {}).get("value")
+    return MessageEntities(
+        by_type=by_type,
+        money=parse_or_none(
+            parse_duckling_currency, first.get("amount-of-money") or first.get("number")
+        ),
+        number=float(number) if isinstance(number, (int, float)) else None,
+        time=parse_or_none(parse_duckling_time, first.get("time")),
+        time_interval=parse_or_none(parse_duckling_time_as_interval, first.get("time")),
+        person=first.get("PERSON", {}).get("value"),
+    )
+
+
+# `id()` of a latest message -> (the message, its entities). Keeping the message
+# makes sure its `id()` is not reused by another one while it is cached.
+_message_entities: "OrderedDict[int, Tuple[Dict[Text, Any], MessageEntities]]" = (
+    OrderedDict()
+)
+
+
+def normalize_entities(tracker: Tracker) -> MessageEntities:
+    """Get the indexed & parsed entities of the latest message, once per turn.
+    All validations of a form get the same tracker, and so share the result.
+    """
+    message = tracker.latest_message
+    cached = _message_entities.get(id(message))
+    if cached is not None and cached[0] is message:
+        _message_entities.move_to_end(id(message))
+        return cached[1]
+    entities = index_entities(message.get("entities", []))
+    _message_entities[id(message)] = (message, entities)
+    while len(_message_entities) > ENTITIES_CACHE_SIZE:
+        _message_entities.popitem(last=False)
+    return entities
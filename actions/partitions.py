@@ -0,0 +1,235 @@
+"""Time-partitioned storage of the transactions table.
+
+On PostgreSQL (11 or newer), `create_partitioned_transactions()` creates the
+`transactions` table partitioned by range of `timestamp`, with one partition per month
+and a default partition for anything outside of them. Searches with a `start_time` or
+`end_time` then only scan the partitions of their window, and
+`drop_transactions_before()` drops whole partitions instead of deleting rows. In both
+cases the net amount of the removed transactions of each account is first added to
+its row in `opening_balances`, so the ledger balance of an account stays the same.
+
+SQLite has no table partitioning, there the transactions stay in one table and
+`drop_transactions_before()` deletes the old rows.
+"""
+import logging
+import re
+from datetime import datetime
+from typing import List, Optional, Text, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.engine.base import Connection, Engine
+
+from actions import rollups
+
+logger = logging.getLogger(__name__)
+
+TABLE_NAME = "transactions"
+DEFAULT_PARTITION_NAME = f"{TABLE_NAME}_default"
+PARTITION_NAME_FORMAT = f"{TABLE_NAME}_y%Ym%m"
+PARTITION_NAME_PATTERN = re.compile(rf"^{TABLE_NAME}_y(\d{{4}})m(\d{{2}})$")
+
+metadata = sa.MetaData()
+
+# Same columns as `actions.profile_db.Transaction`. A partitioned table needs the
+# partition key in its primary key. The indexes of the model are added by the first
+# schema migration, which runs right after the table is created.
+partitioned_transactions = sa.Table(
+    TABLE_NAME,
+    metadata,
+    sa.Column("id", sa.Integer, primary_key=True, autoincrement=True),
+    sa.Column("timestamp", sa.DateTime, primary_key=True),
+    sa.Column("amount", sa.REAL),
+    sa.Column("from_account_number", sa.String(14)),
+    sa.Column("to_account_number", sa.String(14)),
+    postgresql_partition_by="RANGE (timestamp)",
+)
+
+
+def supports_partitioning(engine: Engine) -> bool:
+    return engine.dialect.name == "postgresql"
+
+
+def is_partitioned(connection: Connection) -> bool:
+    """Check whether the transactions table is a partitioned table"""
+    if connection.dialect.name != "postgresql":
+        return False
+    return bool(
+        connection.execute(
+            sa.text(
+                "SELECT 1 FROM pg_partitioned_table p "
+                "JOIN pg_class c ON c.oid = p.partrelid "
+                "WHERE c.relname = :table_name AND pg_table_is_visible(c.oid)"
+            ),
+            table_name=TABLE_NAME,
+        ).scalar()
+    )
+
+
+def months(start: datetime, end: datetime) -> List[datetime]:
+    """Get the starts of the months from the one of `start` up to the one of `end`"""
+    month = rollups.truncate(start, "month")
+    starts = []
+    while month <= end:
+        starts.append(month)
+        month = rollups.next_period(month, "month")
+    return starts
+
+
+def create_partitioned_transactions(
+    engine: Engine, start: datetime, end: datetime
+) -> bool:
+    """Create the transactions table partitioned by month, with partitions for the
+    months from `start` to `end`. Does nothing when the database does not support
+    partitioning or the table already exists.
+    Returns whether the table was created.
+    """
+    if not supports_partitioning(engine):
+        logger.warning(
+            f"Partitioning of {TABLE_NAME} is not supported on "
+            f"{engine.dialect.name}, using a single table"
+        )
+        return False
+    with engine.begin() as connection:
+        if engine.dialect.has_table(connection, TABLE_NAME):
+            if not is_partitioned(connection):
+                logger.warning(
+                    f"{TABLE_NAME} already exists as a regular table, "
+                    f"it is not converted to a partitioned table"
+                )
+            return False
+        partitioned_transactions.create(connection)
+        connection.execute(
+            f"CREATE TABLE {DEFAULT_PARTITION_NAME} PARTITION OF {TABLE_NAME} DEFAULT"
+        )
+    add_partitions(engine, start, end)
+    return True
+
+
+def list_partitions(connection: Connection) -> List[Tuple[Text, datetime]]:
+    """Get the names and months of the monthly partitions, oldest first"""
+    names = connection.execute(
+        sa.text(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent "
+            "WHERE p.relname = :table_name AND pg_table_is_visible(p.oid)"
+        ),
+        table_name=TABLE_NAME,
+    ).fetchall()
+    partitions = []
+    for (name,) in names:
+        match = PARTITION_NAME_PATTERN.match(name)
+        if match:
+            partitions.append((name, datetime(int(match[1]), int(match[2]), 1)))
+    return sorted(partitions, key=lambda partition: partition[1])
+
+
+def add_partitions(engine: Engine, start: datetime, end: datetime) -> List[Text]:
+    """Create the missing monthly partitions from the month of `start` to the one of
+    `end`. Returns the names of the created partitions.
+    """
+    created = []
+    with engine.connect() as connection:
+        if not is_partitioned(connection):
+            return created
+        existing = {name for name, _ in list_partitions(connection)}
+        for month in months(start, end):
+            name = month.strftime(PARTITION_NAME_FORMAT)
+            if name in existing:
+                continue
+            try:
+                with connection.begin():
+                    connection.execute(
+                        sa.text(
+                            f"CREATE TABLE {name} PARTITION OF {TABLE_NAME} "
+                            f"FOR VALUES FROM (:start) TO (:end)"
+                        ).bindparams(
+                            start=month, end=rollups.next_period(month, "month")
+                        )
+                    )
+                created.append(name)
+            except sa.exc.DBAPIError as e:
+                # e.g. rows of this month are already in the default partition
+                logger.warning(f"Could not create partition {name}: {e}")
+    return created
+
+
+def add_to_opening_balances(connection: Connection, cutoff: datetime):
+    """Add the net amount of the transactions before `cutoff` to the opening balance
+    of each of their accounts
+    """
+    amounts = connection.execute(
+        sa.text(
+            "SELECT account_number, SUM(amount) FROM ("
+            f"SELECT to_account_number AS account_number, amount FROM {TABLE_NAME} "
+            "WHERE timestamp < :cutoff UNION ALL "
+            f"SELECT from_account_number, -amount FROM {TABLE_NAME} "
+            "WHERE timestamp < :cutoff) AS removed GROUP BY account_number"
+        ),
+        cutoff=cutoff,
+    ).fetchall()
+    if not amounts:
+        return
+    existing = {
+        account_number
+        for account_number, in connection.execute(
+            "SELECT account_number FROM opening_balances"
+        )
+    }
+    updates = [
+        {"account_number": account_number, "amount": amount}
+        for account_number, amount in amounts
+        if account_number in existing
+    ]
+    inserts = [
+        {"account_number": account_number, "amount": amount}
+        for account_number, amount in amounts
+        if account_number not in existing
+    ]
+    if updates:
+        connection.execute(
+            sa.text(
+                "UPDATE opening_balances SET balance = balance + :amount "
+                "WHERE account_number = :account_number"
+            ),
+            updates,
+        )
+    if inserts:
+        connection.execute(
+            sa.text(
+                "INSERT INTO opening_balances (account_number, balance) "
+                "VALUES (:account_number, :amount)"
+            ),
+            inserts,
+        )
+
+
+def drop_transactions_before(engine: Engine, cutoff: datetime) -> Optional[int]:
+    """Remove the transactions before the month of `cutoff`, and their rollups.
+    On a partitioned table this detaches and drops the monthly partitions, otherwise
+    it deletes the rows. Materialized account balances are kept as they are.
+    Returns the number of deleted rows, or `None` when partitions were dropped.
+    """
+    cutoff = rollups.truncate(cutoff, "month")
+    with engine.begin() as connection:
+        add_to_opening_balances(connection, cutoff)
+        connection.execute(
+            sa.text("DELETE FROM transaction_rollups WHERE period_start < :cutoff"),
+            cutoff=cutoff,
+        )
+        if not is_partitioned(connection):
+            return connection.execute(
+                sa.text(f"DELETE FROM {TABLE_NAME} WHERE timestamp < :cutoff"),
+                cutoff=cutoff,
+            ).rowcount
+        for name, month in list_partitions(connection):
+            if month >= cutoff:
+                break
+            logger.info(f"Dropping partition {name}")
+            connection.execute(f"ALTER TABLE {TABLE_NAME} DETACH PARTITION {name}")
+            connection.execute(f"DROP TABLE {name}")
+        connection.execute(
+            sa.text(f"DELETE FROM {DEFAULT_PARTITION_NAME} WHERE timestamp < :cutoff"),
+            cutoff=cutoff,
+        )
+    return None
@@ -0,0 +1,236 @@
+"""Pre-fork multi-process mode of the action server.
+
+    python -m actions.prefork --workers 4 --port 5055
+
+binds the port once and forks the workers, which import the actions and all accept
+the connections of the shared socket. Each worker connects to the profile database on
+its first request (see `ProcessLocal`), so the workers share nothing but the database
+and every core of the node can run actions.
+
+The supervisor restarts workers that exit. On SIGHUP it starts a new generation of
+workers, and then stops the old ones gracefully: they stop accepting connections and
+finish the requests in flight within `--graceful-timeout` seconds. Connections that
+arrive in between wait in the backlog of the shared socket, so a restart drops none.
+The supervisor itself never imports the actions, so the workers of a restart run the
+current code. SIGTERM & SIGINT stop all workers gracefully.
+"""
+import argparse
+import asyncio
+import inspect
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Optional, Set, Text
+
+from rasa_sdk import endpoint
+from rasa_sdk.executor import ActionExecutor
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PORT = 5055
+# Seconds between checks of the supervisor for signals & exited workers
+POLL_INTERVAL = 0.2
+
+
+class ProcessLocal:
+    """Proxy to an object that is created on first use, once per process.
+    A process forked after the object was created creates its own, instead of
+    sharing e.g. the connections of a database engine with its parent.
+    """
+
+    def __init__(self, factory: Callable[[], Any]):
+        self.factory = factory
+        self.instance = None
+        self.pid: Optional[int] = None
+
+    def get(self) -> Any:
+        if self.pid != os.getpid():
+            self.instance = self.factory()
+            self.pid = os.getpid()
+        return self.instance
+
+    def __getattr__(self, name: Text) -> Any:
+        return getattr(self.get(), name)
+
+
+def create_app(actions_package: Text):
+    # rasa-sdk 3.1 takes the package of the actions, newer versions an executor
+    if "action_executor" not in inspect.signature(endpoint.create_app).parameters:
+        return endpoint.create_app(actions_package)
+    executor = ActionExecutor()
+    executor.register_package(actions_package)
+    return endpoint.create_app(executor)
+
+
+def check_actions(actions_package: Text) -> bool:
+    """Check that the actions import, in a child process that leaves the modules of
+    the supervisor as they are
+    """
+    code = (
+        "import sys; from rasa_sdk.executor import ActionExecutor; "
+        "ActionExecutor().register_package(sys.argv[1])"
+    )
+    return subprocess.run([sys.executable, "-c", code, actions_package]).returncode == 0
+
+
+def serve(sock: socket.socket, actions_package: Text, graceful_timeout: float):
+    """Serve the actions on the shared socket until SIGTERM"""
+    app = create_app(actions_package)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = loop.run_until_complete(
+        app.create_server(sock=sock, return_asyncio_server=True)
+    )
+    loop.add_signal_handler(signal.SIGTERM, loop.stop)
+    loop.run_until_complete(server.startup())
+    loop.run_until_complete(server.before_start())
+    loop.run_until_complete(server.after_start())
+    logger.info(f"Worker {os.getpid()} is serving")
+    loop.run_forever()
+
+    loop.run_until_complete(server.before_stop())
+    server.close()
+    deadline = time.monotonic() + graceful_timeout
+    while server.connections and time.monotonic() < deadline:
+        for connection in list(server.connections):
+            connection.close_if_idle()
+        loop.run_until_complete(asyncio.sleep(0.1))
+    for connection in list(server.connections):
+        connection.close()
+    loop.run_until_complete(server.after_stop())
+    logger.info(f"Worker {os.getpid()} stopped")
+
+
+class Supervisor:
+    def __init__(
+        self,
+        sock: socket.socket,
+        workers: int,
+        actions_package: Text,
+        graceful_timeout: float,
+    ):
+        self.sock = sock
+        self.number_of_workers = workers
+        self.actions_package = actions_package
+        self.graceful_timeout = graceful_timeout
+        self.workers: Set[int] = set()
+        # workers of a previous generation that are stopping
+        self.retiring: Set[int] = set()
+        self.stopping = False
+        self.restart_requested = False
+
+    def spawn(self):
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            return
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            serve(self.sock, self.actions_package, self.graceful_timeout)
+        except Exception:
+            logger.exception(f"Worker {os.getpid()} failed")
+            exit_code = 1
+        finally:
+            logging.shutdown()
+            os._exit(exit_code)
+
+    def restart(self):
+        """Replace all workers by a new generation"""
+        self.restart_requested = False
+        if not check_actions(self.actions_package):
+            logger.error("The actions fail to import, keeping the current workers")
+            return
+        logger.info("Restarting the workers")
+        old_workers = self.workers
+        self.workers = set()
+        for _ in range(self.number_of_workers):
+            self.spawn()
+        self.retiring |= old_workers
+        for pid in old_workers:
+            os.kill(pid, signal.SIGTERM)
+
+    def stop(self, *args: Any):
+        if not self.stopping:
+            logger.info("Stopping the workers")
+            self.stopping = True
+            for pid in self.workers | self.retiring:
+                os.kill(pid, signal.SIGTERM)
+
+    def request_restart(self, *args: Any):
+        self.restart_requested = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        signal.signal(signal.SIGHUP, self.request_restart)
+        for _ in range(self.number_of_workers):
+            self.spawn()
+
+        while self.workers or self.retiring:
+            if self.restart_requested and not self.stopping:
+                self.restart()
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if not pid:
+                time.sleep(POLL_INTERVAL)
+                continue
+            self.retiring.discard(pid)
+            if pid in self.workers:
+                self.workers.remove(pid)
+                if not self.stopping:
+                    logger.warning(
+                        f"Worker {pid} exited with status {status}, restarting it"
+                    )
+                    self.spawn()
+
+
+def create_socket(host: Text, port: int, backlog: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def main(args: Optional[list] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--actions", default="actions", help="package of the actions")
+    parser.add_argument("--host", default=os.environ.get("SANIC_HOST", "0.0.0.0"))
+    parser.add_argument("-p", "--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=int(os.environ.get("ACTION_SERVER_WORKERS", os.cpu_count() or 1)),
+        help="number of worker processes, by default one per core",
+    )
+    parser.add_argument("--backlog", type=int, default=1024)
+    parser.add_argument(
+        "--graceful-timeout",
+        type=float,
+        default=30.0,
+        help="seconds a stopping worker gets to finish its requests",
+    )
+    args = parser.parse_args(args)
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s [%(process)d] %(levelname)s %(message)s"
+    )
+
+    sys.path.insert(0, os.getcwd())
+    if not check_actions(args.actions):
+        sys.exit(f"Failed to import the actions of {args.actions}")
+    sock = create_socket(args.host, args.port, args.backlog)
+    logger.info(
+        f"Action endpoint is up and running on http://{args.host}:{args.port} "
+        f"with {args.workers} workers"
+    )
+    Supervisor(sock, args.workers, args.actions, args.graceful_timeout).run()
+
+
+if __name__ == "__main__":
+    main()
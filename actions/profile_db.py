@@ -1,16 +1,40 @@
 import os
+import asyncio
+import functools
+import inspect
+import json
+from contextlib import contextmanager, nullcontext
+from concurrent.futures import ThreadPoolExecutor
 import sqlalchemy as sa
-from sqlalchemy import Column, Integer, String, DateTime, REAL
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import Column, Integer, String, DateTime, REAL, Boolean, Index
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session, scoped_session, sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.engine.base import Engine
-from typing import Dict, Text, List, Union, Optional
+from actions.cache import TTLCache
+from actions.names import NameIndex
+from actions.migrations import migrate
+from actions import partitions, rollups
+from actions.ledger import ColumnarLedger
+from actions.routing import (
+    ReplicaRouter,
+    RoutingSession,
+    set_session_id,
+    takes_session_id,
+)
+from typing import Any, Callable, Dict, Iterator, Text, List, Tuple, Union, Optional
 
-from random import choice, randrange, sample, randint
-from numpy import arange
+import threading
+import time
+import uuid
+from collections import Counter
+import numpy as np
 from datetime import datetime, timedelta
+import logging
 import pytz
 
+logger = logging.getLogger(__name__)
+
 utc = pytz.UTC
 
 GENERAL_ACCOUNTS = {
@@ -28,6 +52,51 @@ GENERAL_ACCOUNTS = {
     "depositor": ["interest", "employer"],
 }
 
+# How `populate_profile_db` adds the sample values of a new session:
+# "eager": all of them, before it returns
+# "lazy": only the account, the rest is added when a query first needs it
+# "background": like "lazy", but `AsyncProfileDB` also adds the rest in the background
+POPULATION_MODES = ["eager", "lazy", "background"]
+
+# `Account.session_id` prefix of pre-generated profiles that are not claimed yet
+PREGENERATED_PROFILE_PREFIX = "pool_"
+# Key of the PostgreSQL advisory lock that serializes refills of the profile pool
+PROFILE_POOL_LOCK_KEY = 0x706F6F6C
+
+# "sql" answers transaction searches from the database, "columnar" from the
+# in-memory columns of `actions.ledger.ColumnarLedger`
+LEDGER_ENGINES = ["sql", "columnar"]
+
+# Date of the first random transaction of a profile
+TRANSACTIONS_START_DATE = datetime(2019, 1, 1)
+# Monthly partitions of the transactions table created ahead of the current month
+PARTITION_MONTHS_AHEAD = 12
+# A session in use refreshes its `Account.last_active_at` at most this many times per
+# `profile_ttl`, so it does not expire while its account id is cached
+TOUCHES_PER_PROFILE_TTL = 10
+
+# Settings of SQLite connections for concurrent conversations: readers do not block
+# the writer and vice versa with the write-ahead log, which only needs to be synced
+# at checkpoints with synchronous=NORMAL. A writer waits up to `busy_timeout`
+# milliseconds for the lock of another one instead of failing right away.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "mmap_size": 256 * 1024 * 1024,
+    "busy_timeout": 5000,
+}
+
+# Formats of the periods that transactions are grouped by, per SQL dialect
+TIME_BUCKET_FORMATS = {
+    "sqlite": {"day": "%Y-%m-%d", "week": "%Y-%W", "month": "%Y-%m", "year": "%Y"},
+    "postgresql": {
+        "day": "YYYY-MM-DD",
+        "week": "IYYY-IW",
+        "month": "YYYY-MM",
+        "year": "YYYY",
+    },
+}
+
 ACCOUNT_NUMBER_LENGTH = 12
 CREDIT_CARD_NUMBER_LENGTH = 14
 
@@ -41,13 +110,21 @@ class Account(Base):
     when it is equal to `tracker.sender_id`.
     Since `id` autoincrements, it is used to generate unique account numbers by
     adding leading zeros to it.
+    `profile_populated` is `False` while the recipients, credit cards and transactions
+    of a session account have not been added yet, see `ProfileDB.materialize_profile`.
+    `last_active_at` is when a conversation session last used a session account,
+    and stays empty for the general and pre-generated accounts, which never expire.
     """
 
     __tablename__ = "account"
     id = Column(Integer, primary_key=True)
-    session_id = Column(String(255))
+    session_id = Column(String(255), index=True)
     account_holder_name = Column(String(255))
     currency = Column(String(255))
+    profile_populated = Column(
+        Boolean, nullable=False, default=True, server_default="1"
+    )
+    last_active_at = Column(DateTime, index=True)
 
 
 class CreditCard(Base):
@@ -58,13 +135,25 @@ class CreditCard(Base):
     credit_card_name = Column(String(255))
     minimum_balance = Column(REAL)
     current_balance = Column(REAL)
-    account_id = Column(Integer)
+    account_id = Column(Integer, index=True)
 
 
 class Transaction(Base):
     """Transactions table. `to/from_acount_number` are `Account.id`s with leading zeros"""
 
     __tablename__ = "transactions"
+    __table_args__ = (
+        Index(
+            "ix_transactions_from_account_number_timestamp",
+            "from_account_number",
+            "timestamp",
+        ),
+        Index(
+            "ix_transactions_to_account_number_timestamp",
+            "to_account_number",
+            "timestamp",
+        ),
+    )
     id = Column(Integer, primary_key=True)
     timestamp = Column(DateTime)
     amount = Column(REAL)
@@ -77,11 +166,73 @@ class RecipientRelationship(Base):
 
     __tablename__ = "recipient_relationships"
     id = Column(Integer, primary_key=True)
-    account_id = Column(Integer)
+    account_id = Column(Integer, index=True)
     recipient_account_id = Column(Integer)
     recipient_nickname = Column(String(255))
 
 
+class TransactionRollup(Base):
+    """Aggregates of the transactions between two accounts, per day and per month.
+    `grain` is "day" or "month", and `period_start` is the start of that day or month.
+    Kept in sync with the transactions table by `ProfileDB.transact()`, see
+    `actions/rollups.py`.
+    """
+
+    __tablename__ = "transaction_rollups"
+    __table_args__ = (
+        Index(
+            "ix_transaction_rollups_to_account_number_grain_period_start",
+            "to_account_number",
+            "grain",
+            "period_start",
+        ),
+    )
+    from_account_number = Column(String(14), primary_key=True)
+    to_account_number = Column(String(14), primary_key=True)
+    grain = Column(String(5), primary_key=True)
+    period_start = Column(DateTime, primary_key=True)
+    count = Column(Integer)
+    total = Column(REAL)
+    min_amount = Column(REAL)
+    max_amount = Column(REAL)
+
+
+class AccountBalance(Base):
+    """Materialized balance of a bank or credit card account.
+    `account_number` is a `Transaction.to/from_account_number`. The balance is kept in
+    sync with the transactions table by `ProfileDB.transact()`, and can be checked
+    against it with `ProfileDB.reconcile_balances()`.
+    """
+
+    __tablename__ = "account_balances"
+    account_number = Column(String(14), primary_key=True)
+    balance = Column(REAL)
+
+
+class OpeningBalance(Base):
+    """Net amount of the transactions of an account that were removed by
+    `ProfileDB.drop_transactions_before()`, which the ledger balance starts from.
+    """
+
+    __tablename__ = "opening_balances"
+    account_number = Column(String(14), primary_key=True)
+    balance = Column(REAL)
+
+
+class IdempotencyKey(Base):
+    """Keys of the transfers & payments that were applied.
+    A request that is retried with the same key is applied only once.
+    `result` is the JSON encoded result of the action that used the key, which is
+    returned again when the action is retried. Keys older than the `idempotency_ttl`
+    of `ProfileDB` are deleted, see `ProfileDB.delete_expired_idempotency_keys`.
+    """
+
+    __tablename__ = "idempotency_keys"
+    key = Column(String(255), primary_key=True)
+    created_at = Column(DateTime, index=True)
+    result = Column(sa.Text)
+
+
 def create_database(database_engine: Engine, database_name: Text):
     """Try to connect to the database. Create it if it does not exist"""
     try:
@@ -95,20 +246,157 @@ def create_database(database_engine: Engine, database_name: Text):
         conn.close()
 
 
+def create_database_engine(
+    database_url: Text,
+    pool_size: int = 5,
+    max_overflow: int = 10,
+    pool_pre_ping: bool = True,
+    pool_recycle: int = 3600,
+    sqlite_pragmas: Optional[Dict[Text, Any]] = None,
+) -> Engine:
+    """Create the engine with a connection pool sized for concurrent conversations.
+    SQLite does not use a `QueuePool`, so `pool_size` & `max_overflow` only apply to
+    client/server databases. Instead, every new SQLite connection is configured with
+    `sqlite_pragmas`, e.g. `SQLITE_PRAGMAS`.
+    """
+    pool_kwargs = {"pool_pre_ping": pool_pre_ping, "pool_recycle": pool_recycle}
+    if sa.engine.url.make_url(database_url).get_backend_name() != "sqlite":
+        pool_kwargs.update(pool_size=pool_size, max_overflow=max_overflow)
+        return sa.create_engine(database_url, **pool_kwargs)
+
+    engine = sa.create_engine(database_url, **pool_kwargs)
+    if sqlite_pragmas:
+
+        @sa.event.listens_for(engine, "connect")
+        def set_sqlite_pragmas(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            for name, value in sqlite_pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+            cursor.close()
+
+    return engine
+
+
 class ProfileDB:
-    def __init__(self, db_engine: Engine):
+    def __init__(
+        self,
+        db_engine: Engine,
+        seed: Optional[int] = None,
+        population: Text = "eager",
+        pregenerated_profiles: int = 0,
+        cache_size: int = 1024,
+        cache_ttl: float = 300.0,
+        ledger_engine: Text = "sql",
+        partition_transactions: bool = False,
+        profile_ttl: Optional[float] = None,
+        idempotency_ttl: Optional[float] = None,
+        sweep_batch_size: int = 100,
+        replica_engines: Optional[List[Engine]] = None,
+        sticky_seconds: float = 5.0,
+    ):
+        if population not in POPULATION_MODES:
+            raise ValueError(
+                f"Unknown population mode '{population}', use one of {POPULATION_MODES}"
+            )
+        if ledger_engine not in LEDGER_ENGINES:
+            raise ValueError(
+                f"Unknown ledger engine '{ledger_engine}', use one of {LEDGER_ENGINES}"
+            )
+        self.population = population
+        self.partition_transactions = partition_transactions
+        # session profiles inactive for longer than `profile_ttl` seconds are deleted
+        self.profile_ttl = profile_ttl
+        # idempotency keys older than `idempotency_ttl` seconds are deleted
+        self.idempotency_ttl = idempotency_ttl
+        self.sweep_batch_size = sweep_batch_size
+        self.sweep_metrics = Counter()
+        self.sweep_lock = threading.Lock()
+        self.pregenerated_profiles = pregenerated_profiles
+        # reference data that hardly changes during a session, keyed by session_id
+        self.cache = TTLCache(max_size=cache_size, ttl=cache_ttl)
+        # sessions whose `last_active_at` was refreshed recently, with their account id
+        self.touches = None
+        if profile_ttl is not None:
+            self.touches = TTLCache(
+                max_size=cache_size, ttl=profile_ttl / TOUCHES_PER_PROFILE_TTL
+            )
+        self.ledger = None
+        if ledger_engine == "columnar":
+            self.ledger = ColumnarLedger(
+                self.load_ledger, max_accounts=cache_size, ttl=cache_ttl
+            )
         self.engine = db_engine
+        # reads go to the replicas, see `actions/routing.py`
+        self.router = ReplicaRouter(db_engine, replica_engines or [], sticky_seconds)
         self.create_tables()
         self.session = self.get_session()
+        self.seed_sequence = np.random.SeedSequence(seed)
+        self.seed_lock = threading.Lock()
 
-    def get_session(self) -> Session:
-        return sessionmaker(bind=self.engine, autoflush=True)()
+    def get_session(self) -> scoped_session:
+        """Get a thread-local session registry.
+        Every thread works in its own session, `session_scope()` ends it.
+        """
+        return scoped_session(
+            sessionmaker(
+                class_=RoutingSession,
+                router=self.router,
+                autoflush=True,
+                expire_on_commit=False,
+            )
+        )
+
+    @contextmanager
+    def session_scope(self, session_id: Optional[Text] = None) -> Iterator[Session]:
+        """Run a unit of work in a fresh session of the current thread.
+        Commits when the block succeeds, rolls back when it fails, and returns the
+        connection to the pool in both cases. The work of a conversation session
+        passes its `session_id`, to read its own writes, see `actions/routing.py`.
+        """
+        try:
+            session = self.session()
+            if session_id is not None:
+                set_session_id(session, session_id)
+            yield session
+            self.session.commit()
+        except Exception:
+            self.session.rollback()
+            raise
+        finally:
+            self.session.remove()
 
     def create_tables(self):
+        if self.partition_transactions:
+            self.add_transaction_partitions()
         CreditCard.__table__.create(self.engine, checkfirst=True)
         Transaction.__table__.create(self.engine, checkfirst=True)
         RecipientRelationship.__table__.create(self.engine, checkfirst=True)
         Account.__table__.create(self.engine, checkfirst=True)
+        AccountBalance.__table__.create(self.engine, checkfirst=True)
+        OpeningBalance.__table__.create(self.engine, checkfirst=True)
+        TransactionRollup.__table__.create(self.engine, checkfirst=True)
+        IdempotencyKey.__table__.create(self.engine, checkfirst=True)
+        migrate(self.engine)
+
+    def add_transaction_partitions(self):
+        """Create the transactions table partitioned by month, or add the monthly
+        partitions up to `PARTITION_MONTHS_AHEAD` months from now to it.
+        See `actions/partitions.py`.
+        """
+        end = datetime.utcnow() + timedelta(days=31 * PARTITION_MONTHS_AHEAD)
+        if not partitions.create_partitioned_transactions(
+            self.engine, TRANSACTIONS_START_DATE, end
+        ):
+            partitions.add_partitions(self.engine, TRANSACTIONS_START_DATE, end)
+
+    def drop_transactions_before(self, cutoff: datetime) -> Optional[int]:
+        """Remove the transactions and rollups before the month of `cutoff`.
+        Their net amount per account is added to its opening balance.
+        """
+        deleted = partitions.drop_transactions_before(self.engine, cutoff)
+        if self.ledger:
+            self.ledger.invalidate()
+        return deleted
 
     def get_account(self, id: int):
         """Get an `Account` object based on an `Account.id`"""
@@ -116,21 +404,83 @@ class ProfileDB:
 
     def get_account_from_session_id(self, session_id: Text):
         """Get an `Account` object based on a `Account.session_id`"""
-        # if the action server restarts in the middle of a conversation, the db will need to be repopulated outside of an action_session_start
-        if not self.check_session_id_exists(session_id):
-            self.populate_profile_db(session_id)
-        account = (
+        account = self.get_account(self.get_account_id_from_session_id(session_id))
+        if account is None:
+            # the cached account was deleted, look it up again
+            self.cache.invalidate(session_id)
+            account = self.get_account(self.get_account_id_from_session_id(session_id))
+        return account
+
+    def get_account_id_from_session_id(self, session_id: Text) -> int:
+        """Get the `Account.id` of a `session_id`.
+        The ids are cached, so resolving the account of a session costs no query once
+        it is known. With a `profile_ttl`, the session is also marked as active, at
+        most `TOUCHES_PER_PROFILE_TTL` times per TTL.
+        Unless `is_account_cached()`, this writes: the profile and balance of the
+        session are added when they are missing.
+        """
+
+        def load():
+            account = self.query_account_from_session_id(session_id)
+            if account is None:
+                # if the action server restarts in the middle of a conversation, the db will need to be repopulated outside of an action_session_start
+                self.populate_profile_db(session_id)
+                account = self.query_account_from_session_id(session_id)
+            if not account.profile_populated:
+                self.materialize_profile(session_id)
+            self.materialize_missing_balance(self.get_account_number(account))
+            return account.id
+
+        def touch():
+            account_id = self.cache.get_or_load((session_id, "account_id"), load)
+            if self.touch_account(account_id):
+                return account_id
+            # the profile expired and was deleted, possibly by another process
+            self.cache.invalidate(session_id)
+            return self.cache.get_or_load((session_id, "account_id"), load)
+
+        if self.touches is None:
+            return self.cache.get_or_load((session_id, "account_id"), load)
+        return self.touches.get_or_load((session_id,), touch)
+
+    def mark_session_written(self, session_id: Text):
+        """Let a conversation session read its own write that was committed outside of
+        its `session_scope()`, e.g. in a group commit, see `actions/routing.py`
+        """
+        self.router.make_sticky(session_id)
+
+    def is_account_cached(self, session_id: Text) -> bool:
+        """Check whether `get_account_id_from_session_id()` resolves the account of a
+        session from the cache, without writing to the database
+        """
+        if self.touches is None:
+            return (session_id, "account_id") in self.cache
+        return (session_id,) in self.touches
+
+    def get_account_number_from_session_id(self, session_id: Text) -> Text:
+        """Get the account number of a `session_id`"""
+        return self.format_account_number(
+            self.get_account_id_from_session_id(session_id)
+        )
+
+    def query_account_from_session_id(self, session_id: Text) -> Optional[Account]:
+        """Query the `Account` of a `session_id`, without populating or caching it"""
+        return (
             self.session.query(Account).filter(Account.session_id == session_id).first()
         )
-        return account
 
     @staticmethod
-    def get_account_number(account: Union[CreditCard, Account]):
+    def format_account_number(account_id: int, length: int = ACCOUNT_NUMBER_LENGTH):
+        """Format an `Account.id` or `CreditCard.id` as an account number"""
+        return f"%0.{length}d" % account_id
+
+    @classmethod
+    def get_account_number(cls, account: Union[CreditCard, Account]):
         """Get a bank or credit card account number by adding the appropriate number of leading zeros to an `Account.id`"""
         if type(account) is CreditCard:
-            return f"%0.{CREDIT_CARD_NUMBER_LENGTH}d" % account.id
+            return cls.format_account_number(account.id, CREDIT_CARD_NUMBER_LENGTH)
         else:
-            return f"%0.{ACCOUNT_NUMBER_LENGTH}d" % account.id
+            return cls.format_account_number(account.id)
 
     def get_account_from_number(self, account_number: Text):
         """Get a bank or credit card account based on an account number"""
@@ -151,10 +501,10 @@ class ProfileDB:
         """Get a recipient based on the nickname.
         Take the first one if there are multiple that match.
         """
-        account = self.get_account_from_session_id(session_id)
+        account_id = self.get_account_id_from_session_id(session_id)
         recipient = (
             self.session.query(RecipientRelationship)
-            .filter(RecipientRelationship.account_id == account.id)
+            .filter(RecipientRelationship.account_id == account_id)
             .filter(RecipientRelationship.recipient_nickname == recipient_name.lower())
             .first()
         )
@@ -163,15 +513,33 @@ class ProfileDB:
 
     def list_known_recipients(self, session_id: Text):
         """List recipient nicknames available to an account holder"""
-        recipients = (
-            self.session.query(RecipientRelationship.recipient_nickname)
-            .filter(
-                RecipientRelationship.account_id
-                == self.get_account_from_session_id(session_id).id
+
+        def load():
+            recipients = (
+                self.session.query(RecipientRelationship.recipient_nickname)
+                .filter(
+                    RecipientRelationship.account_id
+                    == self.get_account_id_from_session_id(session_id)
+                )
+                .all()
             )
-            .all()
-        )
-        return [recipient.recipient_nickname for recipient in recipients]
+            return [recipient.recipient_nickname for recipient in recipients]
+
+        return list(self.cache.get_or_load((session_id, "recipients"), load))
+
+    def get_recipient_index(self, session_id: Text) -> NameIndex:
+        """Get the index of the recipient nicknames of an account, which also resolves
+        their first names. Built once and cached with the recipients.
+        """
+
+        def load():
+            recipients = self.list_known_recipients(session_id)
+            return NameIndex(
+                recipients,
+                [(recipient.split()[0], recipient) for recipient in recipients],
+            )
+
+        return self.cache.get_or_load((session_id, "recipient_index"), load)
 
     def check_session_id_exists(self, session_id: Text):
         """Check if an account for `session_id` already exists"""
@@ -183,20 +551,103 @@ class ProfileDB:
 
     def get_account_balance(self, session_id: Text):
         """Get the account balance for an account"""
-        account_number = self.get_account_number(
-            self.get_account_from_session_id(session_id)
+        account_number = self.get_account_number_from_session_id(session_id)
+        balance = (
+            self.session.query(AccountBalance.balance)
+            .filter(AccountBalance.account_number == account_number)
+            .scalar()
         )
-        spent = float(
+        if balance is None:
+            # not materialized yet, see `materialize_missing_balance()`
+            balance = self.get_ledger_balance(account_number)
+        return balance
+
+    def get_ledger_balance(self, account_number: Text):
+        """Get the balance of an account by summing all of its transactions"""
+        opening = (
+            self.session.query(OpeningBalance.balance)
+            .filter(OpeningBalance.account_number == account_number)
+            .scalar()
+        )
+        spent = (
             self.session.query(sa.func.sum(Transaction.amount))
             .filter(Transaction.from_account_number == account_number)
-            .all()[0][0]
+            .scalar()
         )
-        earned = float(
+        earned = (
             self.session.query(sa.func.sum(Transaction.amount))
             .filter(Transaction.to_account_number == account_number)
-            .all()[0][0]
+            .scalar()
+        )
+        return float(opening or 0) + float(earned or 0) - float(spent or 0)
+
+    def materialize_balance(self, account_number: Text):
+        """Store the balance of an account, as summed from its transactions"""
+        balance = self.get_ledger_balance(account_number)
+        self.session.add(AccountBalance(account_number=account_number, balance=balance))
+        return balance
+
+    def materialize_missing_balance(self, account_number: Text):
+        """Store the balance of an account created before balances were materialized"""
+        exists = (
+            self.session.query(AccountBalance.account_number)
+            .filter(AccountBalance.account_number == account_number)
+            .first()
         )
-        return earned - spent
+        if exists:
+            return
+        self.materialize_balance(account_number)
+        try:
+            self.session.commit()
+        except sa.exc.IntegrityError:
+            # materialized concurrently by another session
+            self.session.rollback()
+
+    def update_balance(self, account_number: Text, amount: float):
+        """Add `amount` to the materialized balance of an account.
+        Accounts without a materialized balance are left alone, their balance is
+        summed from the transactions when their session account is resolved.
+        """
+        self.session.query(AccountBalance).filter(
+            AccountBalance.account_number == account_number
+        ).update(
+            {AccountBalance.balance: AccountBalance.balance + amount},
+            synchronize_session=False,
+        )
+
+    def reconcile_balances(self, fix: bool = False) -> Dict[Text, Dict[Text, float]]:
+        """Check the materialized balances against the transactions table.
+        Returns the accounts whose balances differ, set `fix` to overwrite them with
+        the balance summed from the transactions.
+        """
+        ledger = dict(
+            self.session.query(OpeningBalance.account_number, OpeningBalance.balance)
+        )
+        for column, sign in [
+            (Transaction.to_account_number, 1),
+            (Transaction.from_account_number, -1),
+        ]:
+            for account_number, total in self.session.query(
+                column, sa.func.sum(Transaction.amount)
+            ).group_by(column):
+                ledger[account_number] = ledger.get(account_number, 0) + sign * total
+
+        mismatches = {}
+        for balance in self.session.query(AccountBalance):
+            ledger_balance = ledger.get(balance.account_number, 0)
+            if abs(balance.balance - ledger_balance) >= 0.005:
+                mismatches[balance.account_number] = {
+                    "balance": balance.balance,
+                    "ledger_balance": ledger_balance,
+                }
+                if fix:
+                    balance.balance = ledger_balance
+        if mismatches:
+            logger.warning(
+                f"{len(mismatches)} materialized balances differ from the ledger"
+            )
+        self.session.commit()
+        return mismatches
 
     def get_currency(self, session_id: Text):
         """Get the currency for an account"""
@@ -218,52 +669,291 @@ class ProfileDB:
         Looks for spend transactions by default, set `deposit` to `True` to search earnings.
         Looks for transactions with anybody by default, set `vendor` to search by vendor
         """
-        account = self.get_account_from_session_id(session_id)
-        account_number = self.get_account_number(account)
-        if deposit:
-            transactions = self.session.query(Transaction).filter(
-                Transaction.to_account_number == account_number
+        return self.session.query(Transaction).filter(
+            *self.transaction_search_criteria(
+                session_id, start_time, end_time, deposit, vendor
             )
+        )
+
+    def transaction_search_criteria(
+        self,
+        session_id: Text,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        deposit: bool = False,
+        vendor: Optional[Text] = None,
+    ) -> List[Any]:
+        """Get the filter criteria on `Transaction` of `search_transactions`"""
+        criteria = self.counterparty_criteria(Transaction, session_id, deposit, vendor)
+        # compare naive timestamps, as stored, so partitions are pruned when planning
+        if start_time:
+            criteria.append(Transaction.timestamp >= start_time.replace(tzinfo=None))
+        if end_time:
+            criteria.append(Transaction.timestamp <= end_time.replace(tzinfo=None))
+        return criteria
+
+    def counterparty_criteria(
+        self,
+        model: Union[Transaction, TransactionRollup],
+        session_id: Text,
+        deposit: bool = False,
+        vendor: Optional[Text] = None,
+    ) -> List[Any]:
+        """Get the filter criteria on the account numbers of `search_transactions`"""
+        account_number = self.get_account_number_from_session_id(session_id)
+        if deposit:
+            return [model.to_account_number == account_number]
         elif vendor:
+            return [
+                model.from_account_number == account_number,
+                model.to_account_number == self.get_vendor_account_number(vendor),
+            ]
+        return [model.from_account_number == account_number]
+
+    def get_vendor_account_number(self, vendor: Text) -> Text:
+        """Get the account number of a vendor, vendors never change so it is cached"""
+
+        def load():
             to_account = (
                 self.session.query(Account.id)
                 .filter(Account.session_id.startswith("vendor_"))
                 .filter(Account.account_holder_name == vendor.lower())
                 .first()
             )
-            to_account_number = self.get_account_number(to_account)
-            transactions = (
-                self.session.query(Transaction)
-                .filter(Transaction.from_account_number == account_number)
-                .filter(Transaction.to_account_number == to_account_number)
+            return self.get_account_number(to_account)
+
+        return self.cache.get_or_load((None, "vendor", vendor.lower()), load)
+
+    def search_transactions_summary(
+        self,
+        session_id: Text,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        deposit: bool = False,
+        vendor: Optional[Text] = None,
+        grain: Optional[Text] = None,
+    ) -> Dict[Text, Any]:
+        """Summarize the transactions found by `search_transactions` in one query.
+        Returns the `count`, `total`, `min` and `max` of the amounts. Set `grain`
+        (day, week, month or year) to also get them per period, in `breakdown`.
+        """
+        if not grain and self.ledger:
+            return self.ledger.summarize(
+                self.get_account_number_from_session_id(session_id),
+                start_time,
+                end_time,
+                deposit,
+                None
+                if deposit or not vendor
+                else self.get_vendor_account_number(vendor),
             )
-        else:
-            transactions = self.session.query(Transaction).filter(
-                Transaction.from_account_number == account_number
+        if not grain:
+            return self.summarize_from_rollups(
+                session_id, start_time, end_time, deposit, vendor
             )
-        if start_time:
-            transactions = transactions.filter(Transaction.timestamp >= start_time)
-        if end_time:
-            transactions = transactions.filter(Transaction.timestamp <= end_time)
 
-        return transactions
+        criteria = self.transaction_search_criteria(
+            session_id, start_time, end_time, deposit, vendor
+        )
+        aggregates = [
+            sa.func.count(Transaction.id),
+            sa.func.sum(Transaction.amount),
+            sa.func.min(Transaction.amount),
+            sa.func.max(Transaction.amount),
+        ]
 
-    def list_credit_cards(self, session_id: Text):
-        """List valid credit cards for an acccount"""
-        account = self.get_account_from_session_id(session_id)
-        cards = (
-            self.session.query(CreditCard)
-            .filter(CreditCard.account_id == account.id)
+        period = self.time_bucket(Transaction.timestamp, grain).label("period")
+        breakdown = [
+            {
+                "period": row.period,
+                "count": row[1],
+                "total": row[2],
+                "min": row[3],
+                "max": row[4],
+            }
+            for row in self.session.query(period, *aggregates)
+            .filter(*criteria)
+            .group_by(period)
+            .order_by(period)
+        ]
+        return {
+            "count": sum(bucket["count"] for bucket in breakdown),
+            "total": sum(bucket["total"] for bucket in breakdown),
+            "min": min((bucket["min"] for bucket in breakdown), default=None),
+            "max": max((bucket["max"] for bucket in breakdown), default=None),
+            "breakdown": breakdown,
+        }
+
+    def writing_to_ledger(self, *account_numbers: Text):
+        """Context of a database transaction that writes to the transactions of
+        `account_numbers`, see `ColumnarLedger.writing_to()`"""
+        if self.ledger:
+            return self.ledger.writing_to(*account_numbers)
+        return nullcontext()
+
+    def load_ledger(self, account_number: Text) -> List[Tuple]:
+        """Get the transactions to or from an account for the columnar ledger"""
+        return (
+            self.session.query(
+                Transaction.from_account_number,
+                Transaction.to_account_number,
+                Transaction.amount,
+                Transaction.timestamp,
+            )
+            .filter(
+                sa.or_(
+                    Transaction.from_account_number == account_number,
+                    Transaction.to_account_number == account_number,
+                )
+            )
             .all()
         )
-        return [card.credit_card_name for card in cards]
+
+    def summarize_from_rollups(
+        self,
+        session_id: Text,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        deposit: bool = False,
+        vendor: Optional[Text] = None,
+    ) -> Dict[Text, Any]:
+        """Get the `count`, `total`, `min` and `max` of `search_transactions_summary`
+        from the whole days and months in the rollups table, and the transactions in
+        the partial days at the edges of the range, in one query.
+        """
+        # timestamps are stored naive, the same way SQLite compares them
+        start = start_time and start_time.replace(tzinfo=None)
+        end = end_time and end_time.replace(tzinfo=None) + timedelta(microseconds=1)
+        periods, edges = rollups.split_range(start, end)
+
+        selects = []
+        if periods:
+            selects.append(
+                sa.select(
+                    [
+                        sa.func.sum(TransactionRollup.count).label("count"),
+                        sa.func.sum(TransactionRollup.total).label("total"),
+                        sa.func.min(TransactionRollup.min_amount).label("min"),
+                        sa.func.max(TransactionRollup.max_amount).label("max"),
+                    ]
+                ).where(
+                    sa.and_(
+                        *self.counterparty_criteria(
+                            TransactionRollup, session_id, deposit, vendor
+                        ),
+                        sa.or_(
+                            *[
+                                self.range_criteria(
+                                    TransactionRollup.period_start,
+                                    period_start,
+                                    period_end,
+                                    TransactionRollup.grain == grain,
+                                )
+                                for grain, period_start, period_end in periods
+                            ]
+                        ),
+                    )
+                )
+            )
+        if edges:
+            selects.append(
+                sa.select(
+                    [
+                        sa.func.count(Transaction.id).label("count"),
+                        sa.func.sum(Transaction.amount).label("total"),
+                        sa.func.min(Transaction.amount).label("min"),
+                        sa.func.max(Transaction.amount).label("max"),
+                    ]
+                ).where(
+                    sa.and_(
+                        *self.counterparty_criteria(
+                            Transaction, session_id, deposit, vendor
+                        ),
+                        sa.or_(
+                            *[
+                                self.range_criteria(
+                                    Transaction.timestamp, edge_start, edge_end
+                                )
+                                for edge_start, edge_end in edges
+                            ]
+                        ),
+                    )
+                )
+            )
+        parts = sa.union_all(*selects).alias("parts")
+        count, total, minimum, maximum = self.session.execute(
+            sa.select(
+                [
+                    sa.func.sum(parts.c.count),
+                    sa.func.sum(parts.c.total),
+                    sa.func.min(parts.c.min),
+                    sa.func.max(parts.c.max),
+                ]
+            )
+        ).first()
+        return {
+            "count": count or 0,
+            "total": total or 0,
+            "min": minimum,
+            "max": maximum,
+        }
+
+    @staticmethod
+    def range_criteria(
+        column: Column,
+        start: Optional[datetime],
+        end: Optional[datetime],
+        *criteria: Any,
+    ):
+        """Criteria for `start <= column < end`, where `None` leaves a side open"""
+        criteria = list(criteria)
+        if start:
+            criteria.append(column >= start)
+        if end:
+            criteria.append(column < end)
+        return sa.and_(sa.true(), *criteria)
+
+    def time_bucket(self, column: Column, grain: Text):
+        """SQL expression that formats a timestamp as the period of `grain` it is in"""
+        dialect = self.engine.dialect.name
+        formats = TIME_BUCKET_FORMATS.get(dialect)
+        if formats is None:
+            raise NotImplementedError(
+                f"Grouping transactions by period is not supported for {dialect}"
+            )
+        if grain not in formats:
+            raise ValueError(
+                f"Unknown grain '{grain}', use one of {list(formats.keys())}"
+            )
+        if dialect == "sqlite":
+            return sa.func.strftime(formats[grain], column)
+        return sa.func.to_char(column, formats[grain])
+
+    def list_credit_cards(self, session_id: Text):
+        """List valid credit cards for an acccount.
+        Only the card names are cached, the balances change with every payment.
+        """
+
+        def load():
+            cards = (
+                self.session.query(CreditCard.credit_card_name)
+                .filter(
+                    CreditCard.account_id
+                    == self.get_account_id_from_session_id(session_id)
+                )
+                .order_by(CreditCard.id)
+                .all()
+            )
+            return [card.credit_card_name for card in cards]
+
+        return list(self.cache.get_or_load((session_id, "credit_cards"), load))
 
     def get_credit_card(self, session_id: Text, credit_card_name: Text):
         """Get a `CreditCard` object based on the card's name and the `session_id`"""
-        account = self.get_account_from_session_id(session_id)
+        account_id = self.get_account_id_from_session_id(session_id)
         return (
             self.session.query(CreditCard)
-            .filter(CreditCard.account_id == account.id)
+            .filter(CreditCard.account_id == account_id)
             .filter(CreditCard.credit_card_name == credit_card_name.lower())
             .first()
         )
@@ -276,8 +966,21 @@ class ProfileDB:
     ):
         """Get the balance for a credit card based on its name and the balance type"""
         balance_type = "_".join(balance_type.split())
-        card = self.get_credit_card(session_id, credit_card_name)
-        return getattr(card, balance_type)
+        return (
+            self.session.query(getattr(CreditCard, balance_type))
+            .filter(
+                CreditCard.account_id == self.get_account_id_from_session_id(session_id)
+            )
+            .filter(CreditCard.credit_card_name == credit_card_name.lower())
+            .scalar()
+        )
+
+    def get_credit_card_index(self, session_id: Text) -> NameIndex:
+        """Get the index of the credit card names of an account"""
+        return self.cache.get_or_load(
+            (session_id, "credit_card_index"),
+            lambda: NameIndex(self.list_credit_cards(session_id)),
+        )
 
     @staticmethod
     def list_balance_types():
@@ -290,58 +993,201 @@ class ProfileDB:
 
     def list_vendors(self):
         """List valid vendors"""
-        vendors = (
-            self.session.query(Account.account_holder_name)
-            .filter(Account.session_id.startswith("vendor_"))
-            .all()
+
+        def load():
+            vendors = (
+                self.session.query(Account.account_holder_name)
+                .filter(Account.session_id.startswith("vendor_"))
+                .all()
+            )
+            return [vendor.account_holder_name for vendor in vendors]
+
+        return list(self.cache.get_or_load((None, "vendors"), load))
+
+    def get_vendor_index(self) -> NameIndex:
+        """Get the index of the vendor names"""
+        return self.cache.get_or_load(
+            (None, "vendor_index"), lambda: NameIndex(self.list_vendors())
         )
-        return [vendor.account_holder_name for vendor in vendors]
 
     def pay_off_credit_card(
-        self, session_id: Text, credit_card_name: Text, amount: float
-    ):
-        """Do a transaction to move the specified amount from an account to a credit card"""
-        account = self.get_account_from_session_id(session_id)
-        account_number = self.get_account_number(account)
-        credit_card = (
-            self.session.query(CreditCard)
-            .filter(CreditCard.account_id == account.id)
+        self,
+        session_id: Text,
+        credit_card_name: Text,
+        amount: float,
+        idempotency_key: Optional[Text] = None,
+    ) -> bool:
+        """Do a transaction to move the specified amount from an account to a credit card.
+        The transaction, the account balances and the card balances are updated in one
+        database transaction, with `UPDATE`s relative to the current values, so
+        concurrent payments do not overwrite each other.
+        Returns `False` when a payment with the same `idempotency_key` was applied.
+        """
+        account_number = self.get_account_number_from_session_id(session_id)
+        credit_card_id = (
+            self.session.query(CreditCard.id)
+            .filter(
+                CreditCard.account_id == self.get_account_id_from_session_id(session_id)
+            )
             .filter(CreditCard.credit_card_name == credit_card_name.lower())
-            .first()
+            .scalar()
         )
-        self.transact(
-            account_number,
-            self.get_account_number(credit_card),
-            amount,
+        credit_card_number = self.format_account_number(
+            credit_card_id, CREDIT_CARD_NUMBER_LENGTH
         )
-        credit_card.current_balance -= amount
-        if amount < credit_card.minimum_balance:
-            credit_card.minimum_balance -= amount
-        else:
-            credit_card.minimum_balance = 0
+        with self.writing_to_ledger(account_number, credit_card_number):
+            if not self.claim_idempotency_key(idempotency_key):
+                return False
+            timestamp = self.add_transaction(account_number, credit_card_number, amount)
+            self.session.query(CreditCard).filter(
+                CreditCard.id == credit_card_id
+            ).update(
+                {
+                    CreditCard.current_balance: CreditCard.current_balance - amount,
+                    CreditCard.minimum_balance: sa.case(
+                        [
+                            (
+                                CreditCard.minimum_balance > amount,
+                                CreditCard.minimum_balance - amount,
+                            )
+                        ],
+                        else_=0,
+                    ),
+                },
+                synchronize_session=False,
+            )
+            self.session.commit()
+            if self.ledger:
+                self.ledger.append(
+                    account_number, credit_card_number, amount, timestamp
+                )
+        return True
+
+    def get_idempotent_result(
+        self, session_id: Text, idempotency_key: Text
+    ) -> Optional[Any]:
+        """Get the result saved for `idempotency_key` of a conversation session"""
+        result = (
+            self.session.query(IdempotencyKey.result)
+            .filter(IdempotencyKey.key == idempotency_key)
+            .scalar()
+        )
+        return None if result is None else json.loads(result)
+
+    def save_idempotent_result(
+        self, session_id: Text, idempotency_key: Text, result: Any
+    ):
+        """Save the JSON serializable result of the request with `idempotency_key`
+        of a conversation session
+        """
+        values = {IdempotencyKey.result: json.dumps(result)}
+        updated = (
+            self.session.query(IdempotencyKey)
+            .filter(IdempotencyKey.key == idempotency_key)
+            .update(values, synchronize_session=False)
+        )
+        if not updated:
+            try:
+                self.session.execute(
+                    IdempotencyKey.__table__.insert().values(
+                        key=idempotency_key,
+                        created_at=datetime.utcnow(),
+                        result=values[IdempotencyKey.result],
+                    )
+                )
+            except sa.exc.IntegrityError:
+                # a concurrent retry saved the same result
+                self.session.rollback()
+                return
         self.session.commit()
 
-    def add_session_account(self, session_id: Text, name: Optional[Text] = ""):
+    def transfer_money(
+        self,
+        session_id: Text,
+        recipient_name: Text,
+        amount: float,
+        idempotency_key: Optional[Text] = None,
+    ) -> bool:
+        """Transfer the specified amount from an account to one of its recipients.
+        Returns `False` when a transfer with the same `idempotency_key` was applied.
+        """
+        return self.transact(
+            self.get_account_number_from_session_id(session_id),
+            self.get_account_number(
+                self.get_recipient_from_name(session_id, recipient_name)
+            ),
+            amount,
+            idempotency_key,
+        )
+
+    def claim_idempotency_key(self, idempotency_key: Optional[Text]) -> bool:
+        """Record `idempotency_key` in the current database transaction.
+        Returns `False`, after rolling back, when the key was recorded before.
+        A concurrent claim of the same key waits until this transaction ends.
+        """
+        if idempotency_key is None:
+            return True
+        try:
+            self.session.execute(
+                IdempotencyKey.__table__.insert().values(
+                    key=idempotency_key, created_at=datetime.utcnow()
+                )
+            )
+        except sa.exc.IntegrityError:
+            self.session.rollback()
+            logger.debug(f"Idempotency key {idempotency_key} was already applied")
+            return False
+        return True
+
+    def add_session_account(
+        self,
+        session_id: Text,
+        name: Optional[Text] = "",
+        profile_populated: bool = True,
+        last_active_at: Optional[datetime] = None,
+    ):
         """Add a new account for a new session_id. Assumes no such account exists yet."""
         self.session.add(
-            Account(session_id=session_id, account_holder_name=name, currency="$")
+            Account(
+                session_id=session_id,
+                account_holder_name=name,
+                currency="$",
+                profile_populated=profile_populated,
+                last_active_at=last_active_at,
+            )
         )
 
+    def random_generator(self) -> np.random.Generator:
+        """Get an independent random generator for generating sample values.
+        The generators are spawned from the `seed` of the `ProfileDB`, so the
+        generated profiles are reproducible when it is set.
+        """
+        with self.seed_lock:
+            return np.random.default_rng(self.seed_sequence.spawn(1)[0])
+
     def add_credit_cards(self, session_id: Text):
         """Populate the creditcard table for a given session_id"""
+        rng = self.random_generator()
         credit_card_names = ["iron bank", "credit all", "emblem", "justice bank"]
-        credit_cards = [
-            CreditCard(
-                credit_card_name=cardname,
-                minimum_balance=choice([20, 30, 40]),
-                current_balance=choice(
-                    [round(amount, 2) for amount in list(arange(20, 500, 0.01))]
-                ),
-                account_id=self.get_account_from_session_id(session_id).id,
-            )
-            for cardname in credit_card_names
-        ]
-        self.session.add_all(credit_cards)
+        minimum_balances = rng.choice([20, 30, 40], size=len(credit_card_names))
+        current_balances = rng.integers(2000, 50000, size=len(credit_card_names)) / 100
+        account_id = self.query_account_from_session_id(session_id).id
+        self.session.execute(
+            CreditCard.__table__.insert(),
+            [
+                {
+                    "credit_card_name": cardname,
+                    "minimum_balance": minimum_balance,
+                    "current_balance": current_balance,
+                    "account_id": account_id,
+                }
+                for cardname, minimum_balance, current_balance in zip(
+                    credit_card_names,
+                    minimum_balances.tolist(),
+                    current_balances.tolist(),
+                )
+            ],
+        )
 
     def check_general_accounts_populated(
         self, general_account_names: Dict[Text, List[Text]]
@@ -376,27 +1222,70 @@ class ProfileDB:
 
     def add_recipients(self, session_id: Text):
         """Populate recipients table"""
-        account = self.get_account_from_session_id(session_id)
+        rng = self.random_generator()
+        account = self.query_account_from_session_id(session_id)
         recipients = (
             self.session.query(Account.account_holder_name, Account.id)
             .filter(Account.session_id.startswith("recipient_"))
             .all()
         )
-        session_recipients = sample(recipients, choice(list(range(3, len(recipients)))))
-        relationships = [
-            RecipientRelationship(
-                account_id=account.id,
-                recipient_account_id=recipient.id,
-                recipient_nickname=recipient.account_holder_name,
+        number_of_recipients = rng.integers(3, len(recipients))
+        session_recipients = [
+            recipients[index]
+            for index in rng.choice(
+                len(recipients), size=number_of_recipients, replace=False
             )
-            for recipient in session_recipients
         ]
-        self.session.add_all(relationships)
+        self.session.execute(
+            RecipientRelationship.__table__.insert(),
+            [
+                {
+                    "account_id": account.id,
+                    "recipient_account_id": recipient.id,
+                    "recipient_nickname": recipient.account_holder_name,
+                }
+                for recipient in session_recipients
+            ],
+        )
+
+    @staticmethod
+    def random_transactions(
+        rng: np.random.Generator,
+        from_account_number: Text,
+        to_account_number: Text,
+        min_cents: int,
+        max_cents: int,
+        size: int,
+        start_date: datetime,
+        number_of_days: int,
+    ) -> List[Dict[Text, Any]]:
+        """Draw `size` transactions of distinct amounts in [`min_cents`, `max_cents`)
+        on random days in the `number_of_days` after `start_date`.
+        """
+        amounts = (
+            min_cents + rng.choice(max_cents - min_cents, size, replace=False)
+        ) / 100
+        dates = np.datetime64(start_date, "us") + rng.integers(
+            number_of_days, size=size
+        ).astype("timedelta64[D]")
+        return [
+            {
+                "from_account_number": from_account_number,
+                "to_account_number": to_account_number,
+                "amount": amount,
+                "timestamp": date,
+            }
+            for amount, date in zip(amounts.tolist(), dates.tolist())
+        ]
 
     def add_transactions(self, session_id: Text):
-        """Populate transactions table for a session ID with random transactions"""
+        """Populate transactions table for a session ID with random transactions.
+        The amounts & dates are drawn with vectorized calls, and inserted in one
+        `executemany`.
+        """
+        rng = self.random_generator()
         account_number = self.get_account_number(
-            self.get_account_from_session_id(session_id)
+            self.query_account_from_session_id(session_id)
         )
         vendors = (
             self.session.query(Account)
@@ -409,88 +1298,733 @@ class ProfileDB:
             .all()
         )
 
-        start_date = utc.localize(datetime(2019, 1, 1))
-        end_date = utc.localize(datetime.now())
-        number_of_days = (end_date - start_date).days
+        # timestamps are stored as naive UTC datetimes
+        start_date = TRANSACTIONS_START_DATE
+        number_of_days = (datetime.utcnow() - start_date).days
 
+        transactions = []
         for vendor in vendors:
-            rand_spend_amounts = sample(
-                [round(amount, 2) for amount in list(arange(5, 50, 0.01))],
-                number_of_days // 2,
-            )
-
-            rand_dates = [
-                (start_date + timedelta(days=randrange(number_of_days)))
-                for x in range(0, len(rand_spend_amounts))
-            ]
-
-            spend_transactions = [
-                Transaction(
-                    from_account_number=account_number,
-                    to_account_number=self.get_account_number(vendor),
-                    amount=amount,
-                    timestamp=date,
+            transactions.extend(
+                self.random_transactions(
+                    rng,
+                    account_number,
+                    self.get_account_number(vendor),
+                    500,
+                    5000,
+                    number_of_days // 2,
+                    start_date,
+                    number_of_days,
                 )
-                for amount, date in zip(rand_spend_amounts, rand_dates)
-            ]
-
-            self.session.add_all(spend_transactions)
+            )
 
         for depositor in depositors:
             if depositor.account_holder_name == "interest":
-                rand_deposit_amounts = sample(
-                    [round(amount, 2) for amount in list(arange(5, 20, 0.01))],
-                    number_of_days // 30,
-                )
+                min_cents, max_cents, size = 500, 2000, number_of_days // 30
             else:
-                rand_deposit_amounts = sample(
-                    [round(amount, 2) for amount in list(arange(1000, 2000, 0.01))],
-                    number_of_days // 14,
-                )
-
-            rand_dates = [
-                (start_date + timedelta(days=randrange(number_of_days)))
-                for x in range(0, len(rand_deposit_amounts))
-            ]
-
-            deposit_transactions = [
-                Transaction(
-                    from_account_number=self.get_account_number(depositor),
-                    to_account_number=account_number,
-                    amount=amount,
-                    timestamp=date,
+                min_cents, max_cents, size = 100000, 200000, number_of_days // 14
+            transactions.extend(
+                self.random_transactions(
+                    rng,
+                    self.get_account_number(depositor),
+                    account_number,
+                    min_cents,
+                    max_cents,
+                    size,
+                    start_date,
+                    number_of_days,
                 )
-                for amount, date in zip(rand_deposit_amounts, rand_dates)
-            ]
+            )
 
-            self.session.add_all(deposit_transactions)
+        self.session.execute(Transaction.__table__.insert(), transactions)
+        self.session.execute(
+            TransactionRollup.__table__.insert(), rollups.aggregate(transactions)
+        )
 
     def populate_profile_db(self, session_id: Text):
         """Initialize the database for a conversation session.
         Will populate all tables with sample values.
         If general accounts have already been populated, it will only
         add account-holder-specific values to tables.
+        Unless the population mode is "eager", only the account is added here, see
+        `materialize_profile`.
+        """
+        if not self.check_general_accounts_populated(GENERAL_ACCOUNTS):
+            self.add_general_accounts(GENERAL_ACCOUNTS)
+        if not self.touch_session(session_id):
+            if self.claim_pregenerated_profile(session_id):
+                return
+            self.add_session_account(
+                session_id, profile_populated=False, last_active_at=datetime.utcnow()
+            )
+            if self.population == "eager":
+                self.materialize_profile(session_id)
+
+        self.session.commit()
+
+    def touch_session(self, session_id: Text) -> bool:
+        """Record that a conversation session started for `session_id`.
+        Returns `False` when there is no account for it yet.
+        """
+        return bool(
+            self.session.query(Account)
+            .filter(Account.session_id == session_id)
+            .update(
+                {Account.last_active_at: datetime.utcnow()}, synchronize_session=False
+            )
+        )
+
+    def touch_account(self, account_id: int) -> bool:
+        """Record that the session account `account_id` is in use.
+        Returns `False` when the account does not exist anymore.
+        """
+        updated = (
+            self.session.query(Account)
+            .filter(Account.id == account_id)
+            .update(
+                {Account.last_active_at: datetime.utcnow()}, synchronize_session=False
+            )
+        )
+        self.session.commit()
+        return bool(updated)
+
+    def delete_expired_profiles(self) -> Dict[Text, Any]:
+        """Delete one batch of at most `sweep_batch_size` session profiles that were
+        inactive for longer than `profile_ttl` seconds, with their credit cards,
+        recipients, transactions, rollups and balances, in one transaction.
+        Returns the number of deleted rows per table, and `profiles` deleted.
+        """
+        started = time.monotonic()
+        cutoff = datetime.utcnow() - timedelta(seconds=self.profile_ttl)
+        expired = (
+            self.session.query(Account.id, Account.session_id)
+            .filter(Account.last_active_at < cutoff)
+            .order_by(Account.last_active_at)
+            .limit(self.sweep_batch_size)
+            # a session that starts meanwhile waits, and then gets a new profile
+            .with_for_update(skip_locked=True)
+            .all()
+        )
+        metrics = Counter(profiles=len(expired))
+        if not expired:
+            return metrics
+
+        account_ids = [account.id for account in expired]
+        account_numbers = [self.format_account_number(id) for id in account_ids]
+        account_numbers.extend(
+            self.format_account_number(credit_card_id, CREDIT_CARD_NUMBER_LENGTH)
+            for credit_card_id, in self.session.query(CreditCard.id).filter(
+                CreditCard.account_id.in_(account_ids)
+            )
+        )
+        deletes = [
+            ("credit_cards", CreditCard, CreditCard.account_id.in_(account_ids)),
+            (
+                "recipients",
+                RecipientRelationship,
+                RecipientRelationship.account_id.in_(account_ids),
+            ),
+            (
+                "transactions",
+                Transaction,
+                Transaction.from_account_number.in_(account_numbers),
+            ),
+            (
+                "transactions",
+                Transaction,
+                Transaction.to_account_number.in_(account_numbers),
+            ),
+            (
+                "rollups",
+                TransactionRollup,
+                TransactionRollup.from_account_number.in_(account_numbers),
+            ),
+            (
+                "rollups",
+                TransactionRollup,
+                TransactionRollup.to_account_number.in_(account_numbers),
+            ),
+            (
+                "balances",
+                AccountBalance,
+                AccountBalance.account_number.in_(account_numbers),
+            ),
+            (
+                "opening_balances",
+                OpeningBalance,
+                OpeningBalance.account_number.in_(account_numbers),
+            ),
+            ("accounts", Account, Account.id.in_(account_ids)),
+        ]
+        for name, model, criterion in deletes:
+            metrics[name] += (
+                self.session.query(model)
+                .filter(criterion)
+                .delete(synchronize_session=False)
+            )
+        self.session.commit()
+
+        for account in expired:
+            self.cache.invalidate(account.session_id)
+            self.touches.invalidate(account.session_id)
+        if self.ledger:
+            self.ledger.invalidate()
+        metrics["seconds"] = time.monotonic() - started
+        with self.sweep_lock:
+            self.sweep_metrics.update(metrics)
+            self.sweep_metrics["batches"] += 1
+        logger.info(f"Deleted expired profiles: {dict(metrics)}")
+        return metrics
+
+    def delete_expired_idempotency_keys(self) -> int:
+        """Delete one batch of at most `sweep_batch_size` idempotency keys, with their
+        saved results, that are older than `idempotency_ttl` seconds. A retry of their
+        request after that is applied again. Returns the number of deleted keys.
+        """
+        cutoff = datetime.utcnow() - timedelta(seconds=self.idempotency_ttl)
+        expired = (
+            self.session.query(IdempotencyKey.key)
+            .filter(IdempotencyKey.created_at < cutoff)
+            .limit(self.sweep_batch_size)
+        )
+        deleted = (
+            self.session.query(IdempotencyKey)
+            .filter(IdempotencyKey.key.in_(expired.subquery()))
+            .delete(synchronize_session=False)
+        )
+        self.session.commit()
+        with self.sweep_lock:
+            self.sweep_metrics["idempotency_keys"] += deleted
+        return deleted
+
+    def count_pregenerated_profiles(self) -> int:
+        """Count the pre-generated profiles that are not claimed yet"""
+        return (
+            self.session.query(Account)
+            .filter(
+                Account.session_id.startswith(
+                    PREGENERATED_PROFILE_PREFIX, autoescape=True
+                )
+            )
+            .count()
+        )
+
+    def refill_profile_pool(self, max_profiles: Optional[int] = None) -> int:
+        """Pre-generate profiles until there are `pregenerated_profiles` unclaimed ones.
+        Adds at most `max_profiles` profiles, and returns how many were added.
+        Concurrent refills, e.g. by other action server processes, are serialized,
+        so together they do not add more profiles than are missing.
         """
+        missing = self.pregenerated_profiles - self.count_pregenerated_profiles()
+        if max_profiles is not None:
+            missing = min(missing, max_profiles)
+        if missing <= 0:
+            return 0
         if not self.check_general_accounts_populated(GENERAL_ACCOUNTS):
             self.add_general_accounts(GENERAL_ACCOUNTS)
-        if not self.check_session_id_exists(session_id):
-            self.add_session_account(session_id)
+        added = 0
+        for _ in range(missing):
+            pool_session_id = f"{PREGENERATED_PROFILE_PREFIX}{uuid.uuid4().hex}"
+            self.add_session_account(pool_session_id, profile_populated=False)
+            self.session.flush()
+            self.lock_profile_pool()
+            # count again in the transaction that adds the profile, as a concurrent
+            # refill may have filled the pool since it was counted
+            if self.count_pregenerated_profiles() > self.pregenerated_profiles:
+                self.session.rollback()
+                break
+            self.materialize_profile(pool_session_id)
+            added += 1
+        return added
+
+    def lock_profile_pool(self):
+        """Wait for concurrent refills of the profile pool to commit, and hold off new
+        ones until the current transaction ends. On SQLite, the transaction holds the
+        database lock from its first write on anyway.
+        """
+        if self.engine.dialect.name == "postgresql":
+            self.session.execute(
+                sa.select([sa.func.pg_advisory_xact_lock(PROFILE_POOL_LOCK_KEY)])
+            )
+
+    def claim_pregenerated_profile(self, session_id: Text) -> bool:
+        """Assign a pre-generated profile to `session_id` by updating its `session_id`.
+        Returns `False` when the pool is empty.
+        """
+        if not self.pregenerated_profiles:
+            return False
+        candidates = (
+            self.session.query(Account.id, Account.session_id)
+            .filter(
+                Account.session_id.startswith(
+                    PREGENERATED_PROFILE_PREFIX, autoescape=True
+                )
+            )
+            .limit(5)
+            .all()
+        )
+        for candidate in candidates:
+            # another conversation may claim the same profile concurrently
+            claimed = (
+                self.session.query(Account)
+                .filter(Account.id == candidate.id)
+                .filter(Account.session_id == candidate.session_id)
+                .update(
+                    {
+                        Account.session_id: session_id,
+                        Account.last_active_at: datetime.utcnow(),
+                    },
+                    synchronize_session=False,
+                )
+            )
+            if claimed:
+                self.session.commit()
+                return True
+        return False
+
+    def materialize_profile(self, session_id: Text):
+        """Add the recipients, credit cards and transactions of a session account.
+        The account is claimed by setting `profile_populated` first, so a profile is
+        only materialized once when the background worker and a query race for it.
+        """
+        self.session.flush()
+        claimed = (
+            self.session.query(Account)
+            .filter(Account.session_id == session_id)
+            .filter(Account.profile_populated == sa.false())
+            .update({Account.profile_populated: True}, synchronize_session="evaluate")
+        )
+        if claimed:
             self.add_recipients(session_id)
             self.add_transactions(session_id)
             self.add_credit_cards(session_id)
-
+            self.session.flush()
+            self.materialize_balance(
+                self.get_account_number(self.query_account_from_session_id(session_id))
+            )
         self.session.commit()
 
     def transact(
+        self,
+        from_account_number: Text,
+        to_account_number: Text,
+        amount: float,
+        idempotency_key: Optional[Text] = None,
+    ) -> bool:
+        """Add a transation to the transaction table, and update the balances and
+        rollups of both accounts, in one database transaction.
+        Returns `False` when a transaction with the same `idempotency_key` was added.
+        """
+        with self.writing_to_ledger(from_account_number, to_account_number):
+            if not self.claim_idempotency_key(idempotency_key):
+                return False
+            timestamp = self.add_transaction(
+                from_account_number, to_account_number, amount
+            )
+            self.session.commit()
+            if self.ledger:
+                self.ledger.append(
+                    from_account_number, to_account_number, amount, timestamp
+                )
+        return True
+
+    def transact_many(
+        self, transfers: List[Tuple[Text, Text, float, Optional[Text]]]
+    ) -> List[bool]:
+        """Add many `(from_account_number, to_account_number, amount, idempotency_key)`
+        transactions in one database transaction, with one commit, see `transact()`.
+        Returns for each transaction whether it was added.
+        When a concurrent request claims one of the keys meanwhile, the transactions
+        are added one by one instead.
+        """
+        keys = [key for *_, key in transfers if key is not None]
+        claimed = set()
+        if keys:
+            claimed.update(
+                key
+                for key, in self.session.query(IdempotencyKey.key).filter(
+                    IdempotencyKey.key.in_(keys)
+                )
+            )
+        timestamp = datetime.now()
+        added = []
+        rows = []
+        for from_account_number, to_account_number, amount, key in transfers:
+            if key is not None and key in claimed:
+                added.append(False)
+                continue
+            if key is not None:
+                claimed.add(key)
+            added.append(True)
+            rows.append(
+                {
+                    "from_account_number": from_account_number,
+                    "to_account_number": to_account_number,
+                    "amount": amount,
+                    "timestamp": timestamp,
+                    "key": key,
+                }
+            )
+        if not rows:
+            return added
+
+        account_numbers = {row["from_account_number"] for row in rows}
+        account_numbers.update(row["to_account_number"] for row in rows)
+        with self.writing_to_ledger(*account_numbers):
+            try:
+                new_keys = [
+                    {"key": row["key"], "created_at": datetime.utcnow()}
+                    for row in rows
+                    if row["key"] is not None
+                ]
+                if new_keys:
+                    self.session.execute(IdempotencyKey.__table__.insert(), new_keys)
+                self.session.execute(Transaction.__table__.insert(), rows)
+                balance_changes = Counter()
+                for row in rows:
+                    balance_changes[row["from_account_number"]] -= row["amount"]
+                    balance_changes[row["to_account_number"]] += row["amount"]
+                    self.add_to_rollups(
+                        row["from_account_number"],
+                        row["to_account_number"],
+                        row["amount"],
+                        timestamp,
+                    )
+                for account_number, amount in balance_changes.items():
+                    self.update_balance(account_number, amount)
+                self.session.commit()
+            except sa.exc.IntegrityError:
+                self.session.rollback()
+                logger.debug("Idempotency key claimed concurrently, adding one by one")
+                return [self.transact(*transfer) for transfer in transfers]
+
+            if self.ledger:
+                for row in rows:
+                    self.ledger.append(
+                        row["from_account_number"],
+                        row["to_account_number"],
+                        row["amount"],
+                        timestamp,
+                    )
+        return added
+
+    def add_transaction(
         self, from_account_number: Text, to_account_number: Text, amount: float
-    ):
-        """Add a transation to the transaction table"""
+    ) -> datetime:
+        """Add a transaction and update the balances and rollups of both accounts,
+        without committing. Returns the timestamp of the transaction.
+        """
         timestamp = datetime.now()
-        transaction = Transaction(
-            from_account_number=from_account_number,
-            to_account_number=to_account_number,
-            amount=amount,
-            timestamp=timestamp,
+        self.session.execute(
+            Transaction.__table__.insert().values(
+                from_account_number=from_account_number,
+                to_account_number=to_account_number,
+                amount=amount,
+                timestamp=timestamp,
+            )
         )
-        self.session.add(transaction)
-        self.session.commit()
+        self.update_balance(from_account_number, -amount)
+        self.update_balance(to_account_number, amount)
+        self.add_to_rollups(from_account_number, to_account_number, amount, timestamp)
+        return timestamp
+
+    def add_to_rollups(
+        self,
+        from_account_number: Text,
+        to_account_number: Text,
+        amount: float,
+        timestamp: datetime,
+    ):
+        """Add a transaction to its day and month rollups. A rollup is updated in
+        place, or inserted by the first transaction of its period; when a concurrent
+        transaction inserts it first, the insert is skipped and the update retried."""
+        for grain in rollups.ROLLUP_GRAINS:
+            period_start = rollups.truncate(timestamp, grain)
+            key = dict(
+                from_account_number=from_account_number,
+                to_account_number=to_account_number,
+                grain=grain,
+                period_start=period_start,
+            )
+            if self.update_rollup(key, amount):
+                continue
+            inserted = self.session.execute(
+                self.insert_ignoring_conflicts(TransactionRollup.__table__).values(
+                    count=1, total=amount, min_amount=amount, max_amount=amount, **key
+                )
+            ).rowcount
+            if not inserted:
+                self.update_rollup(key, amount)
+
+    def update_rollup(self, key: Dict[Text, Any], amount: float) -> int:
+        """Add a transaction amount to the rollup with primary `key`, if it exists"""
+        return (
+            self.session.query(TransactionRollup)
+            .filter_by(**key)
+            .update(
+                {
+                    TransactionRollup.count: TransactionRollup.count + 1,
+                    TransactionRollup.total: TransactionRollup.total + amount,
+                    TransactionRollup.min_amount: sa.case(
+                        [(TransactionRollup.min_amount > amount, amount)],
+                        else_=TransactionRollup.min_amount,
+                    ),
+                    TransactionRollup.max_amount: sa.case(
+                        [(TransactionRollup.max_amount < amount, amount)],
+                        else_=TransactionRollup.max_amount,
+                    ),
+                },
+                synchronize_session=False,
+            )
+        )
+
+    def insert_ignoring_conflicts(self, table: sa.Table) -> sa.sql.Insert:
+        """INSERT into `table` that skips rows whose primary key exists, instead of
+        failing the transaction with a unique violation"""
+        if self.engine.dialect.name == "postgresql":
+            return postgresql.insert(table).on_conflict_do_nothing()
+        return table.insert().prefix_with("OR IGNORE", dialect="sqlite")
+
+
+class AsyncProfileDB:
+    """Awaitable facade over a `ProfileDB`: each of its methods becomes a coroutine that
+    runs in a thread pool as its own unit of work (see `ProfileDB.session_scope()`),
+    so a slow query does not stall the event loop of the action server.
+    """
+
+    # pure helpers that never touch the database, they are not offloaded
+    INLINE_METHODS = ["get_account_number", "list_balance_types"]
+    # methods that write to the database, they run on the single writer thread when
+    # there is one. Reads first resolve the account of their session there, when
+    # that may add its profile, see `run()`.
+    WRITE_METHODS = [
+        "populate_profile_db",
+        "materialize_profile",
+        "refill_profile_pool",
+        "touch_session",
+        "delete_expired_profiles",
+        "delete_expired_idempotency_keys",
+        "transact",
+        "transact_many",
+        "transfer_money",
+        "pay_off_credit_card",
+        "save_idempotent_result",
+        "reconcile_balances",
+        "drop_transactions_before",
+    ]
+
+    def __init__(
+        self,
+        profile_db: ProfileDB,
+        max_workers: int = 1,
+        sweep_interval: float = 3600.0,
+        sweep_pause: float = 1.0,
+        group_commit_interval: float = 0.0,
+        single_writer: bool = False,
+    ):
+        self.profile_db = profile_db
+        # bounds the number of concurrent database calls, with 0 they run inline
+        self.executor = None
+        if max_workers > 0:
+            self.executor = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix="profile_db"
+            )
+        # the `WRITE_METHODS` run one at a time on this thread, while reads run in
+        # parallel in the pool, since SQLite only allows one writer at a time
+        self.writer = None
+        if single_writer and self.executor is not None:
+            self.writer = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix="profile_db_writer"
+            )
+        self.background_tasks = set()
+        self.refilling_profile_pool = False
+        self.sweep_interval = sweep_interval
+        self.sweep_pause = sweep_pause
+        self.sweeping = False
+        # seconds during which transactions are queued to be added in one commit
+        self.group_commit_interval = group_commit_interval
+        self.pending_transactions = []
+
+    async def run(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a blocking `func` without stalling the event loop"""
+        call = functools.partial(self.run_in_session_scope, func, *args, **kwargs)
+        executor = self.executor_for(func)
+        if executor is None:
+            return call()
+        loop = asyncio.get_event_loop()
+        session_id = self.get_session_id(func, *args, **kwargs)
+        if (
+            executor is not self.writer
+            and self.writer is not None
+            and session_id is not None
+            and not self.profile_db.is_account_cached(session_id)
+        ):
+            # so that the read runs on a reader thread without writing
+            await loop.run_in_executor(
+                self.writer,
+                self.run_in_session_scope,
+                self.profile_db.get_account_id_from_session_id,
+                session_id,
+            )
+        return await loop.run_in_executor(executor, call)
+
+    def executor_for(self, func: Callable[..., Any]) -> Optional[ThreadPoolExecutor]:
+        """Get the executor to run `func` in, `None` to run it inline"""
+        if self.writer is not None and func.__name__ in self.WRITE_METHODS:
+            return self.writer
+        return self.executor
+
+    async def populate_profile_db(self, session_id: Text):
+        """Initialize the database for a conversation session.
+        Materializes the profile in the background with the "background" population
+        mode, and starts the refill of the profile pool and the sweeper as needed.
+        """
+        await self.run(self.profile_db.populate_profile_db, session_id)
+        if self.profile_db.population == "background":
+            # when this fails, the next query that needs the profile materializes it
+            self.run_in_background(self.profile_db.materialize_profile, session_id)
+        if self.profile_db.pregenerated_profiles and not self.refilling_profile_pool:
+            self.run_in_background(self.refill_profile_pool)
+        if (
+            self.profile_db.profile_ttl or self.profile_db.idempotency_ttl
+        ) and not self.sweeping:
+            self.run_in_background(self.sweep_expired_profiles)
+
+    async def refill_profile_pool(self):
+        """Refill the pool of pre-generated profiles, one profile per call"""
+        self.refilling_profile_pool = True
+        try:
+            while await self.run(self.profile_db.refill_profile_pool, 1):
+                pass
+        finally:
+            self.refilling_profile_pool = False
+
+    async def sweep_expired_profiles(self):
+        """Delete expired profiles & idempotency keys until the action server stops,
+        every `sweep_interval` seconds, with `sweep_pause` seconds between batches
+        """
+        self.sweeping = True
+        try:
+            while True:
+                while await self.sweep_batch():
+                    await asyncio.sleep(self.sweep_pause)
+                await asyncio.sleep(self.sweep_interval)
+        finally:
+            self.sweeping = False
+
+    async def sweep_batch(self) -> bool:
+        """Delete one batch of expired rows, returns whether more may be left"""
+        batch_size = self.profile_db.sweep_batch_size
+        more = False
+        if self.profile_db.profile_ttl:
+            deleted = await self.run(self.profile_db.delete_expired_profiles)
+            more = deleted["profiles"] >= batch_size
+        if self.profile_db.idempotency_ttl:
+            deleted = await self.run(self.profile_db.delete_expired_idempotency_keys)
+            more = more or deleted >= batch_size
+        return more
+
+    async def transact(
+        self,
+        from_account_number: Text,
+        to_account_number: Text,
+        amount: float,
+        idempotency_key: Optional[Text] = None,
+    ) -> bool:
+        """Add a transaction, see `ProfileDB.transact()`. With a
+        `group_commit_interval`, returns once the commit of its batch is done.
+        """
+        transfer = (from_account_number, to_account_number, amount, idempotency_key)
+        if not self.group_commit_interval:
+            return await self.run(self.profile_db.transact, *transfer)
+        added = asyncio.get_event_loop().create_future()
+        if not self.pending_transactions:
+            self.run_in_background(self.commit_pending_transactions)
+        self.pending_transactions.append((transfer, added))
+        return await added
+
+    async def transfer_money(
+        self,
+        session_id: Text,
+        recipient_name: Text,
+        amount: float,
+        idempotency_key: Optional[Text] = None,
+    ) -> bool:
+        """Transfer money to a recipient, see `ProfileDB.transfer_money()`"""
+        if not self.group_commit_interval:
+            return await self.run(
+                self.profile_db.transfer_money,
+                session_id,
+                recipient_name,
+                amount,
+                idempotency_key,
+            )
+        added = await self.transact(
+            await self.get_account_number_from_session_id(session_id),
+            self.get_account_number(
+                await self.get_recipient_from_name(session_id, recipient_name)
+            ),
+            amount,
+            idempotency_key,
+        )
+        # the batch was committed without the session_id of the sender
+        self.profile_db.mark_session_written(session_id)
+        return added
+
+    async def commit_pending_transactions(self):
+        """Add the transactions queued during `group_commit_interval` in one commit"""
+        await asyncio.sleep(self.group_commit_interval)
+        # transactions queued from now on go into the next batch
+        batch, self.pending_transactions = self.pending_transactions, []
+        try:
+            added = await self.run(
+                self.profile_db.transact_many, [transfer for transfer, _ in batch]
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        else:
+            for (_, future), transfer_added in zip(batch, added):
+                if not future.done():
+                    future.set_result(transfer_added)
+
+    def run_in_background(self, func: Callable[..., Any], *args: Any):
+        """Run `func` in a background task, which is not awaited"""
+        if asyncio.iscoroutinefunction(func):
+            task = asyncio.ensure_future(func(*args))
+        else:
+            task = asyncio.ensure_future(self.run(func, *args))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_task_done)
+
+    def background_task_done(self, task: asyncio.Future):
+        self.background_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.error("Background task failed", exc_info=task.exception())
+
+    def run_in_session_scope(
+        self, func: Callable[..., Any], *args: Any, **kwargs: Any
+    ) -> Any:
+        # the reads of a conversation session follow its writes, see `actions/routing.py`
+        with self.profile_db.session_scope(self.get_session_id(func, *args, **kwargs)):
+            return func(*args, **kwargs)
+
+    @staticmethod
+    def get_session_id(
+        func: Callable[..., Any], *args: Any, **kwargs: Any
+    ) -> Optional[Text]:
+        """Get the `session_id` argument of a call of `func`, if it takes one"""
+        if inspect.ismethod(func) and takes_session_id(func):
+            return args[0] if args else kwargs.get("session_id")
+        return None
+
+    def __getattr__(self, name: Text) -> Any:
+        attribute = getattr(self.profile_db, name)
+        if name in self.INLINE_METHODS or not inspect.ismethod(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        async def method(*args: Any, **kwargs: Any) -> Any:
+            return await self.run(attribute, *args, **kwargs)
+
+        return method
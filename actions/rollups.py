@@ -0,0 +1,106 @@
+"""Pre-aggregated transaction rollups.
+
+The transactions between two accounts are summed per day and per month in the
+`transaction_rollups` table. A time range is answered by the whole months and whole
+days it covers, plus the transactions in the partial days at its edges, so the number
+of rows read no longer grows with the length of the range.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Text, Tuple
+
+ROLLUP_GRAINS = ["day", "month"]
+
+
+def truncate(timestamp: datetime, grain: Text) -> datetime:
+    """Get the start of the day or month `timestamp` is in"""
+    if grain == "month":
+        return datetime(timestamp.year, timestamp.month, 1)
+    return datetime(timestamp.year, timestamp.month, timestamp.day)
+
+
+def next_period(period_start: datetime, grain: Text) -> datetime:
+    """Get the start of the day or month after the one starting at `period_start`"""
+    if grain == "month":
+        if period_start.month == 12:
+            return datetime(period_start.year + 1, 1, 1)
+        return datetime(period_start.year, period_start.month + 1, 1)
+    return period_start + timedelta(days=1)
+
+
+def ceil(timestamp: datetime, grain: Text) -> datetime:
+    """Get the first start of a day or month at or after `timestamp`"""
+    period_start = truncate(timestamp, grain)
+    if period_start == timestamp:
+        return period_start
+    return next_period(period_start, grain)
+
+
+def aggregate(transactions: Iterable[Dict[Text, Any]]) -> List[Dict[Text, Any]]:
+    """Aggregate transactions into rollup rows for every grain"""
+    rollups = defaultdict(lambda: {"count": 0, "total": 0.0})
+    for transaction in transactions:
+        for grain in ROLLUP_GRAINS:
+            rollup = rollups[
+                (
+                    transaction["from_account_number"],
+                    transaction["to_account_number"],
+                    grain,
+                    truncate(transaction["timestamp"], grain),
+                )
+            ]
+            amount = transaction["amount"]
+            rollup["count"] += 1
+            rollup["total"] += amount
+            rollup["min_amount"] = min(rollup.get("min_amount", amount), amount)
+            rollup["max_amount"] = max(rollup.get("max_amount", amount), amount)
+    return [
+        {
+            "from_account_number": from_account_number,
+            "to_account_number": to_account_number,
+            "grain": grain,
+            "period_start": period_start,
+            **rollup,
+        }
+        for (
+            from_account_number,
+            to_account_number,
+            grain,
+            period_start,
+        ), rollup in rollups.items()
+    ]
+
+
+def split_range(
+    start: Optional[datetime], end: Optional[datetime]
+) -> Tuple[
+    List[Tuple[Text, Optional[datetime], Optional[datetime]]],
+    List[Tuple[Optional[datetime], Optional[datetime]]],
+]:
+    """Split the half-open range [`start`, `end`) in whole periods and partial edges.
+    `None` leaves that side of the range open.
+    Returns the (grain, first period start, end) of the whole months and days, and the
+    (start, end) of the edges that have to be read from the transactions.
+    """
+    day_start = start and ceil(start, "day")
+    day_end = end and truncate(end, "day")
+    if day_start and day_end and day_start >= day_end:
+        return [], [(start, end)]
+
+    edges = []
+    if start and start < day_start:
+        edges.append((start, day_start))
+    if end and day_end < end:
+        edges.append((day_end, end))
+
+    month_start = day_start and ceil(day_start, "month")
+    month_end = day_end and truncate(day_end, "month")
+    if month_start and month_end and month_start >= month_end:
+        return [("day", day_start, day_end)], edges
+
+    periods = [("month", month_start, month_end)]
+    if day_start and day_start < month_start:
+        periods.append(("day", day_start, month_start))
+    if day_end and month_end < day_end:
+        periods.append(("day", month_end, day_end))
+    return periods, edges
@@ -0,0 +1,118 @@
+"""Routing of profile database queries to a primary and its read replicas.
+
+Writes, and everything else in a database transaction after its first write, go to
+the primary. Other reads go to one of the replicas, which is kept for the rest of the
+transaction. After a conversation session commits a write, its reads go to the
+primary for `sticky_seconds`, so it reads its own writes while the replicas catch up.
+The conversation session of a database session is set with `set_session_id()`, which
+`ProfileDB.session_scope()` does for the methods that take a `session_id`.
+"""
+import itertools
+import threading
+import time
+from typing import Any, Dict, List, Optional, Text
+
+import sqlalchemy as sa
+from sqlalchemy.engine.base import Engine
+from sqlalchemy.orm import Session
+
+# expired stickiness is dropped once more conversation sessions than this are sticky
+MAX_STICKY_SESSIONS = 10000
+
+
+class ReplicaRouter:
+    def __init__(
+        self, primary: Engine, replicas: List[Engine], sticky_seconds: float = 5.0
+    ):
+        self.primary = primary
+        self.replicas = replicas
+        self.sticky_seconds = sticky_seconds
+        self.next_replica = itertools.cycle(replicas)
+        self.sticky_until: Dict[Text, float] = {}
+        self.lock = threading.Lock()
+
+    def get_bind(self, session: Session, clause: Optional[Any] = None) -> Engine:
+        """Get the engine a statement of `session` is executed on"""
+        if not self.replicas:
+            return self.primary
+        if (
+            session._flushing
+            or isinstance(clause, sa.sql.expression.UpdateBase)
+            or getattr(clause, "_for_update_arg", None) is not None
+        ):
+            session.info["wrote"] = True
+            return self.primary
+        if session.info.get("wrote") or self.is_sticky(session.info.get("session_id")):
+            return self.primary
+        if "replica" not in session.info:
+            with self.lock:
+                session.info["replica"] = next(self.next_replica)
+        return session.info["replica"]
+
+    def is_sticky(self, session_id: Optional[Text]) -> bool:
+        """Check whether the reads of a conversation session go to the primary"""
+        if session_id is None:
+            return False
+        with self.lock:
+            sticky_until = self.sticky_until.get(session_id)
+            if sticky_until is None:
+                return False
+            if sticky_until > time.monotonic():
+                return True
+            del self.sticky_until[session_id]
+            return False
+
+    def make_sticky(self, session_id: Text):
+        """Send the reads of a conversation session to the primary for a while"""
+        now = time.monotonic()
+        with self.lock:
+            if len(self.sticky_until) > MAX_STICKY_SESSIONS:
+                self.sticky_until = {
+                    sticky_session_id: sticky_until
+                    for sticky_session_id, sticky_until in self.sticky_until.items()
+                    if sticky_until > now
+                }
+            self.sticky_until[session_id] = now + self.sticky_seconds
+
+    def after_commit(self, session: Session):
+        session_id = session.info.get("session_id")
+        if session.info.get("wrote") and session_id is not None:
+            self.make_sticky(session_id)
+
+    @staticmethod
+    def after_transaction_end(session: Session):
+        session.info.pop("wrote", None)
+        session.info.pop("replica", None)
+
+
+class RoutingSession(Session):
+    """Session that executes its statements on the engine chosen by a `ReplicaRouter`"""
+
+    def __init__(self, router: ReplicaRouter, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.router = router
+
+    def get_bind(self, mapper: Optional[Any] = None, clause: Optional[Any] = None):
+        return self.router.get_bind(self, clause)
+
+
+def set_session_id(session: Session, session_id: Text):
+    """Set the conversation session whose reads and writes `session` executes"""
+    session.info["session_id"] = session_id
+
+
+@sa.event.listens_for(RoutingSession, "after_commit")
+def after_commit(session: RoutingSession):
+    session.router.after_commit(session)
+
+
+@sa.event.listens_for(RoutingSession, "after_transaction_end")
+def after_transaction_end(session: RoutingSession, transaction: Any):
+    if transaction.parent is None:
+        session.router.after_transaction_end(session)
+
+
+def takes_session_id(method: Any) -> bool:
+    """Check whether the first argument of a method is a `session_id`"""
+    code = method.__func__.__code__
+    return code.co_argcount > 1 and code.co_varnames[1] == "session_id"
@@ -0,0 +1,187 @@
+"""Sharding of the profile database by conversation session.
+
+`ShardedProfileDB` spreads the conversation sessions over one `ProfileDB` per
+database, the shards. A `session_id` is assigned to a shard by rendezvous hashing of
+the shard names, so adding a shard only moves the sessions that hash to the new shard,
+about 1/N of them. The profile of a moved session is populated again on its new
+shard, so shards should be added before they are needed.
+
+The general accounts (vendors, recipients & depositors) are added to every shard in
+the same order, so their account numbers are the same on all shards. Account numbers
+of session accounts are only unique within a shard, across shards an account is
+addressed by its `session_id`.
+
+Money moves between shards in `transfer_between_sessions()` through a clearing
+account that exists on every shard, in two local transactions with idempotency keys:
+
+1. debit: the sender's account pays the clearing account, on the sender's shard
+2. credit: the clearing account pays the recipient's account, on the recipient's shard
+
+A transfer that fails after the debit leaves the amount in the clearing account.
+Retrying it with the same key skips the debit and applies the credit. If the credit
+can never be applied, `cancel_transfer_between_sessions()` blocks it, and refunds the
+debit if it was applied.
+"""
+import functools
+import hashlib
+import inspect
+import types
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Text
+
+from actions.profile_db import GENERAL_ACCOUNTS, ProfileDB
+from actions.routing import takes_session_id
+
+# Account number of the clearing account of transfers between shards. Account ids
+# start at 1, so it never belongs to an account.
+CLEARING_ACCOUNT_NUMBER = "0" * 12
+
+
+def shard_score(shard_name: Text, session_id: Text) -> int:
+    digest = hashlib.sha256(f"{shard_name}:{session_id}".encode()).digest()
+    return int.from_bytes(digest[:8], "big")
+
+
+class ShardedProfileDB:
+    """Routes the methods of `ProfileDB` that take a `session_id` to the shard of that
+    session. Methods without a `session_id` are about the general accounts, which
+    every shard has, and run on the first shard, except for the maintenance methods
+    defined here, which run on every shard.
+    """
+
+    def __init__(
+        self, shards: List[ProfileDB], shard_names: Optional[List[Text]] = None
+    ):
+        if not shards:
+            raise ValueError("A sharded profile database needs at least one shard")
+        self.shards = shards
+        self.shard_names = shard_names or [f"shard_{i}" for i in range(len(shards))]
+        for shard in shards:
+            with shard.session_scope():
+                if not shard.check_general_accounts_populated(GENERAL_ACCOUNTS):
+                    shard.add_general_accounts(GENERAL_ACCOUNTS)
+
+    def shard_for(self, session_id: Text) -> ProfileDB:
+        """Get the shard of a conversation session"""
+        scores = [shard_score(name, session_id) for name in self.shard_names]
+        return self.shards[scores.index(max(scores))]
+
+    @contextmanager
+    def session_scope(self, session_id: Optional[Text] = None) -> Iterator[None]:
+        """Run a unit of work in fresh sessions of all shards"""
+        with ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.session_scope(session_id))
+            yield
+
+    def __getattr__(self, name: Text) -> Any:
+        attribute = getattr(self.shards[0], name)
+        if not inspect.ismethod(attribute) or not takes_session_id(attribute):
+            return attribute
+
+        @functools.wraps(attribute)
+        def method(self, session_id: Text, *args: Any, **kwargs: Any) -> Any:
+            shard_method = getattr(self.shard_for(session_id), name)
+            return shard_method(session_id, *args, **kwargs)
+
+        # a bound method, like the methods of `ProfileDB`, for `AsyncProfileDB`
+        return types.MethodType(method, self)
+
+    def transact(self, *args: Any, **kwargs: Any):
+        raise NotImplementedError(
+            "Account numbers are only unique within a shard, "
+            "use transfer_money() or transfer_between_sessions()"
+        )
+
+    transact_many = transact
+
+    def transfer_between_sessions(
+        self,
+        from_session_id: Text,
+        to_session_id: Text,
+        amount: float,
+        idempotency_key: Text,
+    ) -> bool:
+        """Transfer money from the account of a conversation session to the account
+        of another one, which may be on another shard.
+        Returns `False` when the transfer with `idempotency_key` was complete before.
+        """
+        source = self.shard_for(from_session_id)
+        destination = self.shard_for(to_session_id)
+        from_account_number = source.get_account_number_from_session_id(from_session_id)
+        to_account_number = destination.get_account_number_from_session_id(
+            to_session_id
+        )
+        if source is destination:
+            return source.transact(
+                from_account_number, to_account_number, amount, idempotency_key
+            )
+        debited = source.transact(
+            from_account_number,
+            CLEARING_ACCOUNT_NUMBER,
+            amount,
+            f"{idempotency_key}:debit",
+        )
+        credited = destination.transact(
+            CLEARING_ACCOUNT_NUMBER,
+            to_account_number,
+            amount,
+            f"{idempotency_key}:credit",
+        )
+        return debited or credited
+
+    def cancel_transfer_between_sessions(
+        self,
+        from_session_id: Text,
+        to_session_id: Text,
+        amount: float,
+        idempotency_key: Text,
+    ) -> bool:
+        """Refund a transfer between shards whose credit was not applied, and make
+        sure it is never applied. Returns `False` when the credit was applied.
+        """
+        source = self.shard_for(from_session_id)
+        destination = self.shard_for(to_session_id)
+        if not destination.claim_idempotency_key(f"{idempotency_key}:credit"):
+            return False
+        destination.session.commit()
+        if source.claim_idempotency_key(f"{idempotency_key}:debit"):
+            # the debit was not applied either, and now never will be
+            source.session.commit()
+            return True
+        source.transact(
+            CLEARING_ACCOUNT_NUMBER,
+            source.get_account_number_from_session_id(from_session_id),
+            amount,
+            f"{idempotency_key}:refund",
+        )
+        return True
+
+    def refill_profile_pool(self, max_profiles: Optional[int] = None) -> int:
+        return sum(shard.refill_profile_pool(max_profiles) for shard in self.shards)
+
+    def count_pregenerated_profiles(self) -> int:
+        return sum(shard.count_pregenerated_profiles() for shard in self.shards)
+
+    def delete_expired_profiles(self) -> Dict[Text, Any]:
+        metrics = Counter()
+        for shard in self.shards:
+            metrics.update(shard.delete_expired_profiles())
+        return metrics
+
+    def delete_expired_idempotency_keys(self) -> int:
+        return sum(shard.delete_expired_idempotency_keys() for shard in self.shards)
+
+    def reconcile_balances(self, fix: bool = False) -> Dict[Text, Dict[Text, float]]:
+        """Reconcile the balances of every shard, keyed by shard name & account"""
+        return {
+            f"{name}:{account_number}": mismatch
+            for name, shard in zip(self.shard_names, self.shards)
+            for account_number, mismatch in shard.reconcile_balances(fix).items()
+        }
+
+    def drop_transactions_before(self, *args: Any, **kwargs: Any) -> List[Any]:
+        return [
+            shard.drop_transactions_before(*args, **kwargs) for shard in self.shards
+        ]
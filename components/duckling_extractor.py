@@ -0,0 +1,44 @@
+"""`DucklingEntityExtractor` that parses common phrases in process.
+
+Use it in `config.yml` in place of `DucklingEntityExtractor`, with the same options:
+
+    - name: components.duckling_extractor.LocalDucklingEntityExtractor
+      url: http://localhost:8000
+      dimensions: [amount-of-money, time, number]
+
+Messages that `components.local_duckling` covers, which includes every message without
+numbers or times, are parsed without a request to Duckling. The others are sent to
+the Duckling server at `url` as before.
+"""
+import logging
+from typing import Any, Dict, List, Text
+
+from rasa.engine.recipes.default_recipe import DefaultV1Recipe
+from rasa.nlu.extractors.duckling_entity_extractor import DucklingEntityExtractor
+
+from components import local_duckling
+
+logger = logging.getLogger(__name__)
+
+
+@DefaultV1Recipe.register(
+    DefaultV1Recipe.ComponentType.ENTITY_EXTRACTOR, is_trainable=False
+)
+class LocalDucklingEntityExtractor(DucklingEntityExtractor):
+    """Extracts the entities of common phrases in process, and of the other
+    messages with Duckling.
+    """
+
+    def _duckling_parse(self, text: Text, reference_time: int) -> List[Dict[Text, Any]]:
+        locale = self.component_config.get("locale")
+        if not locale or locale.lower().startswith("en"):
+            matches = local_duckling.parse(
+                text,
+                reference_time,
+                self.component_config.get("timezone"),
+                self.component_config.get("dimensions"),
+            )
+            if matches is not None:
+                return matches
+        logger.debug("The message needs Duckling")
+        return super()._duckling_parse(text, reference_time)
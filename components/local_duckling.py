@@ -0,0 +1,278 @@
+"""In-process extraction of Duckling's `amount-of-money`, `number` & `time` entities.
+
+Covers the common English phrases of the training data: amounts like "$50",
+"100 dollars" or "60 euros", plain numbers, "today", "last month", "this week",
+"the past two days", month names and weekdays. `parse()` returns the same match
+format as the `/parse` endpoint of Duckling, so Rasa converts them to entities with
+the same `additional_info`.
+
+When the text has digits or time words that none of the phrases cover, `parse()`
+returns `None` and the caller should ask Duckling instead. Resolution follows
+Duckling: weeks start on Monday, "last N weeks" ends at the start of the current
+week, and month names & weekdays resolve to their next occurrence.
+"""
+import re
+import time
+from datetime import datetime, tzinfo
+from typing import Any, Dict, List, Optional, Pattern, Text, Tuple
+
+from dateutil import relativedelta, tz
+
+GRAINS = ["day", "week", "month", "year"]
+
+NUMBER_WORDS = {
+    "one": 1,
+    "two": 2,
+    "three": 3,
+    "four": 4,
+    "five": 5,
+    "six": 6,
+    "seven": 7,
+    "eight": 8,
+    "nine": 9,
+    "ten": 10,
+    "eleven": 11,
+    "twelve": 12,
+}
+
+MONTHS = [
+    "january",
+    "february",
+    "march",
+    "april",
+    "may",
+    "june",
+    "july",
+    "august",
+    "september",
+    "october",
+    "november",
+    "december",
+]
+
+WEEKDAYS = [
+    "monday",
+    "tuesday",
+    "wednesday",
+    "thursday",
+    "friday",
+    "saturday",
+    "sunday",
+]
+
+CURRENCY_UNITS = {
+    "$": "$",
+    "dollar": "$",
+    "dollars": "$",
+    "buck": "$",
+    "bucks": "$",
+    "usd": "USD",
+    "€": "EUR",
+    "euro": "EUR",
+    "euros": "EUR",
+}
+
+_number = r"(?P<amount>\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)"
+_count = rf"(?P<count>\d+|{'|'.join(NUMBER_WORDS)})"
+_grain = rf"(?P<grain>{'|'.join(GRAINS)})"
+
+TIME_PATTERNS: List[Tuple[Text, Pattern]] = [
+    (
+        "last_n",
+        re.compile(rf"\b(?:the\s+)?(?:last|past)\s+{_count}\s+{_grain}s\b", re.I),
+    ),
+    (
+        "relative",
+        re.compile(
+            rf"\b(?:the\s+)?(?P<relation>this|last|past|next)\s+{_grain}\b(?!\s+of\b)",
+            re.I,
+        ),
+    ),
+    ("day", re.compile(r"\b(?P<day>today|tomorrow|yesterday)\b", re.I)),
+    (
+        "month",
+        re.compile(
+            rf"\b(?P<month>{'|'.join(MONTHS)})(?:\s+(?P<day>\d{{1,2}})(?:st|nd|rd|th)?)?\b",
+            re.I,
+        ),
+    ),
+    ("weekday", re.compile(rf"\b(?P<weekday>{'|'.join(WEEKDAYS)})\b", re.I)),
+]
+
+MAY_PREFIX = re.compile(r"\b(?:in|of|for|since|during|until|till)\s+$", re.I)
+
+MONEY_PATTERN = re.compile(
+    rf"(?P<prefix>(?:\$|€|\busd)\s?)?{_number}\b"
+    rf"(?:\s?(?P<suffix>dollars?|bucks?|usd|euros?)\b)?",
+    re.I,
+)
+
+# A plain number that may be a year, e.g. "in 2020", is left to Duckling's time rules
+YEAR_PATTERN = re.compile(r"(?:19|20)\d\d")
+YEAR_PREFIX = re.compile(r"\b(?:in|of|since|during)\s+$", re.I)
+
+# Whatever of these is left over after matching goes to Duckling
+UNCOVERED_PATTERN = re.compile(
+    r"\d|[£¥₹]|\b(?:"
+    rf"{'|'.join(NUMBER_WORDS)}|zero|thirteen|fifteen|twenty|thirty|forty|fifty|"
+    r"hundred|thousand|million|billion|dozen|half|cents?|pounds?|"
+    rf"{'|'.join(m for m in MONTHS if m != 'may')}|{'|'.join(WEEKDAYS)}|"
+    r"tonight|noon|midnight|morning|afternoon|evening|weekends?|quarter|"
+    r"hours?|minutes?|ago|since|until|till|before|after|"
+    rf"(?:this|last|past|next|previous|coming)\s+{_grain}s?"
+    r")\b",
+    re.I,
+)
+
+
+def to_duckling_time(value: datetime) -> Text:
+    """Format a time like Duckling, e.g. `2021-03-01T00:00:00.000-08:00`"""
+    return value.isoformat(timespec="milliseconds")
+
+
+def truncate(value: datetime, grain: Text) -> datetime:
+    """Get the start of the day, week (from Monday), month or year of a time"""
+    value = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if grain == "week":
+        return value - relativedelta.relativedelta(days=value.weekday())
+    if grain == "month":
+        return value.replace(day=1)
+    if grain == "year":
+        return value.replace(month=1, day=1)
+    return value
+
+
+def shift(value: datetime, grain: Text, count: int) -> datetime:
+    return value + relativedelta.relativedelta(**{f"{grain}s": count})
+
+
+def time_value(value: datetime, grain: Text) -> Dict[Text, Any]:
+    resolved = {"value": to_duckling_time(value), "grain": grain, "type": "value"}
+    return {**resolved, "values": [resolved]}
+
+
+def time_interval(start: datetime, end: datetime, grain: Text) -> Dict[Text, Any]:
+    resolved = {
+        "from": {"value": to_duckling_time(start), "grain": grain},
+        "to": {"value": to_duckling_time(end), "grain": grain},
+        "type": "interval",
+    }
+    return {**resolved, "values": [resolved]}
+
+
+def resolve_time(
+    kind: Text, match: "re.Match", now: datetime
+) -> Optional[Dict[Text, Any]]:
+    """Get the Duckling value of a matched time phrase"""
+    groups = {name: value.lower() for name, value in match.groupdict().items() if value}
+    if kind == "last_n":
+        count = groups["count"]
+        count = NUMBER_WORDS[count] if count in NUMBER_WORDS else int(count)
+        end = truncate(now, groups["grain"])
+        return time_interval(shift(end, groups["grain"], -count), end, groups["grain"])
+    if kind == "relative":
+        offset = {"this": 0, "last": -1, "past": -1, "next": 1}[groups["relation"]]
+        start = shift(truncate(now, groups["grain"]), groups["grain"], offset)
+        return time_value(start, groups["grain"])
+    if kind == "day":
+        offset = {"today": 0, "tomorrow": 1, "yesterday": -1}[groups["day"]]
+        return time_value(shift(truncate(now, "day"), "day", offset), "day")
+    if kind == "month":
+        if groups["month"] == "may" and "day" not in groups:
+            # "may" on its own is mostly the verb
+            if not MAY_PREFIX.search(match.string[: match.start()]):
+                return None
+        month = MONTHS.index(groups["month"]) + 1
+        if "day" not in groups:
+            start = truncate(now, "month").replace(month=month)
+            if start < truncate(now, "month"):
+                start = shift(start, "year", 1)
+            return time_value(start, "month")
+        try:
+            start = truncate(now, "day").replace(month=month, day=int(groups["day"]))
+        except ValueError:
+            return None
+        if start < truncate(now, "day"):
+            start = shift(start, "year", 1)
+        return time_value(start, "day")
+    if kind == "weekday":
+        days = (WEEKDAYS.index(groups["weekday"]) - now.weekday()) % 7
+        return time_value(shift(truncate(now, "day"), "day", days), "day")
+
+
+def to_number(amount: Text) -> Any:
+    number = float(amount.replace(",", ""))
+    return int(number) if number.is_integer() else number
+
+
+def make_match(
+    text: Text, start: int, end: int, dim: Text, value: Dict[Text, Any]
+) -> Dict[Text, Any]:
+    return {
+        "body": text[start:end],
+        "start": start,
+        "end": end,
+        "dim": dim,
+        "latent": False,
+        "value": value,
+    }
+
+
+def parse(
+    text: Text,
+    reference_time: Optional[int] = None,
+    timezone: Optional[Text] = None,
+    dimensions: Optional[List[Text]] = None,
+) -> Optional[List[Dict[Text, Any]]]:
+    """Parse `text` like Duckling's `/parse` endpoint, relative to `reference_time`
+    in milliseconds since the epoch (default now) in `timezone` (default UTC, like
+    Duckling). Returns `None` when Duckling is needed to parse the text.
+    """
+    zone: Optional[tzinfo] = tz.gettz(timezone) if timezone else tz.UTC
+    if zone is None:
+        return None
+    if reference_time is None:
+        reference_time = int(time.time() * 1000)
+    now = datetime.fromtimestamp(reference_time / 1000, zone)
+
+    matches = []
+    covered = list(text)
+
+    def claim(start: int, end: int) -> bool:
+        if any(c is None for c in covered[start:end]):
+            return False
+        covered[start:end] = [None] * (end - start)
+        return True
+
+    for kind, pattern in TIME_PATTERNS:
+        for match in pattern.finditer(text):
+            value = resolve_time(kind, match, now)
+            if value is not None and claim(match.start(), match.end()):
+                matches.append(
+                    make_match(text, match.start(), match.end(), "time", value)
+                )
+    for match in MONEY_PATTERN.finditer(text):
+        unit = (match["prefix"] or match["suffix"] or "").strip().lower()
+        if not unit and (
+            YEAR_PATTERN.fullmatch(match["amount"])
+            or YEAR_PREFIX.search(text[: match.start()])
+        ):
+            # the digits stay uncovered
+            continue
+        if not claim(match.start(), match.end()):
+            continue
+        amount = to_number(match["amount"])
+        if unit:
+            value = {"value": amount, "type": "value", "unit": CURRENCY_UNITS[unit]}
+            dim = "amount-of-money"
+        else:
+            value = {"value": amount, "type": "value"}
+            dim = "number"
+        matches.append(make_match(text, match.start(), match.end(), dim, value))
+
+    leftover = "".join(c if c is not None else " " for c in covered)
+    if UNCOVERED_PATTERN.search(leftover):
+        return None
+    if dimensions:
+        matches = [match for match in matches if match["dim"] in dimensions]
+    return sorted(matches, key=lambda match: match["start"])
@@ -0,0 +1,108 @@
+"""Benchmark of the throughput of the pre-fork action server by number of workers.
+
+For each number of workers in `WORKERS`, starts `python -m actions.prefork` on `PORT`,
+starts a session for `CONCURRENCY` conversations, and then runs `action_show_balance`
+for them from `CONCURRENCY` client threads for `SECONDS` seconds. Prints the requests
+per second and the median & 99th percentile latency of each run.
+
+Uses the same `PROFILE_DB_*` environment variables as the action server. The client
+threads run on the same node, so leave cores for them.
+"""
+import http.client
+import json
+import os
+import signal
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).parent.parent
+WORKERS = [int(w) for w in os.environ.get("WORKERS", "1,2,4").split(",")]
+PORT = int(os.environ.get("PORT", 5077))
+CONCURRENCY = int(os.environ.get("CONCURRENCY", 16))
+SECONDS = float(os.environ.get("SECONDS", 10))
+
+TRACKER = json.loads((ROOT / "tests" / "data" / "empty_tracker.json").read_text())
+
+
+def webhook(connection: http.client.HTTPConnection, action: str, sender_id: str):
+    body = json.dumps(
+        {
+            "next_action": action,
+            "sender_id": sender_id,
+            "tracker": {**TRACKER, "sender_id": sender_id},
+            "domain": {},
+        }
+    )
+    connection.request("POST", "/webhook", body, {"Content-Type": "application/json"})
+    response = connection.getresponse()
+    response.read()
+    if response.status != 200:
+        raise RuntimeError(f"{action} failed with status {response.status}")
+
+
+def wait_until_healthy(timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection("localhost", PORT, timeout=1)
+            connection.request("GET", "/health")
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.5)
+    raise RuntimeError("The action server did not start")
+
+
+def run_client(sender_id: str, stop_at: float, latencies: list):
+    connection = http.client.HTTPConnection("localhost", PORT, timeout=30)
+    webhook(connection, "action_session_start", sender_id)
+    while time.monotonic() < stop_at:
+        start = time.monotonic()
+        webhook(connection, "action_show_balance", sender_id)
+        latencies.append(time.monotonic() - start)
+
+
+def benchmark(workers: int):
+    server = subprocess.Popen(
+        [sys.executable, "-m", "actions.prefork", "--workers", str(workers)]
+        + ["--port", str(PORT)],
+        cwd=ROOT,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        wait_until_healthy()
+        latencies = []
+        stop_at = time.monotonic() + SECONDS
+        clients = [
+            threading.Thread(
+                target=run_client,
+                args=(f"benchmark_{workers}_{i}", stop_at, latencies),
+            )
+            for i in range(CONCURRENCY)
+        ]
+        for client in clients:
+            client.start()
+        for client in clients:
+            client.join()
+        latencies.sort()
+        print(
+            f"| {workers} | {len(latencies) / SECONDS:.0f} "
+            f"| {statistics.median(latencies) * 1000:.1f} "
+            f"| {latencies[int(len(latencies) * 0.99)] * 1000:.1f} |"
+        )
+    finally:
+        server.send_signal(signal.SIGTERM)
+        server.wait()
+
+
+print(f"{CONCURRENCY} concurrent conversations, {os.cpu_count()} cores\n")
+print("| workers | requests/s | median ms | p99 ms |")
+print("|---|---|---|---|")
+for workers in WORKERS:
+    benchmark(workers)
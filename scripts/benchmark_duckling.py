@@ -0,0 +1,71 @@
+"""Benchmark of the in-process Duckling parsing in `components.local_duckling`
+against the round trip to a Duckling server.
+
+Parses a mix of messages of the training data `NUMBER` times each. The Duckling server
+at `DUCKLING_URL` is only benchmarked when it is reachable, e.g. after
+`docker run -p 8000:8000 rasa/duckling`.
+"""
+import os
+import sys
+import time
+import timeit
+import urllib.error
+import urllib.parse
+import urllib.request
+from pathlib import Path
+
+sys.path.insert(1, str(Path(__file__).parent.parent))
+
+from components import local_duckling  # noqa: E402
+
+DUCKLING_URL = os.environ.get("DUCKLING_URL", "http://localhost:8000")
+TIMEZONE = os.environ.get("TIMEZONE", "America/Los_Angeles")
+NUMBER = int(os.environ.get("NUMBER", 100))
+
+MESSAGES = [
+    "I want to transfer $100 to Bob",
+    "Pay Karen 60 Euros",
+    "how much did i spend at starbucks last month?",
+    "how much was deposited in my account in the last two weeks?",
+    "I want to pay $500 on my emblem credit card on Sunday",
+    "Please schedule a payment towards my credit card for April 12th",
+    "what's my credit card balance?",
+    "thank you goodbye",
+]
+
+
+def duckling_parse(text: str) -> list:
+    payload = urllib.parse.urlencode(
+        {
+            "text": text,
+            "locale": "en_US",
+            "tz": TIMEZONE,
+            "reftime": int(time.time() * 1000),
+        }
+    ).encode()
+    with urllib.request.urlopen(f"{DUCKLING_URL}/parse", payload) as response:
+        return response.read()
+
+
+covered = sum(
+    local_duckling.parse(message, timezone=TIMEZONE) is not None for message in MESSAGES
+)
+print(f"{covered} of {len(MESSAGES)} messages are parsed in process")
+
+benchmarks = [
+    (
+        "in process",
+        lambda: [local_duckling.parse(m, timezone=TIMEZONE) for m in MESSAGES],
+    )
+]
+try:
+    duckling_parse("today")
+    benchmarks.append(
+        ("Duckling", lambda: [duckling_parse(message) for message in MESSAGES])
+    )
+except (urllib.error.URLError, ConnectionError) as e:
+    print(f"Duckling is not reachable at {DUCKLING_URL}: {e}")
+
+for name, parse in benchmarks:
+    seconds = timeit.timeit(parse, number=NUMBER)
+    print(f"{name:>10}: {seconds / NUMBER / len(MESSAGES) * 1e3:.3f} ms per message")
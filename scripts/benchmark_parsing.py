@@ -0,0 +1,94 @@
+"""Microbenchmark of the Duckling time parsing in `actions.parsing`.
+
+Compares the memoized parsing with the previous path, which parsed every ISO string
+again for the interval and for formatting each of its ends, on a mix of the time
+entities of a transaction search. Set `NUMBER` to change the number of parses.
+"""
+import os
+import sys
+import timeit
+from pathlib import Path
+
+from dateutil import parser, relativedelta
+
+sys.path.insert(1, str(Path(__file__).parent.parent))
+
+from actions import parsing  # noqa: E402
+
+NUMBER = int(os.environ.get("NUMBER", 100000))
+
+ENTITIES = [
+    {"additional_info": {"type": "value", "value": value, "grain": grain}}
+    for value, grain in [
+        ("2021-03-01T00:00:00.000-08:00", "month"),
+        ("2021-03-15T00:00:00.000-07:00", "day"),
+        ("2021-03-08T00:00:00.000-08:00", "week"),
+        ("2021-03-15T09:30:00.000-07:00", "minute"),
+    ]
+] + [
+    {
+        "additional_info": {
+            "type": "interval",
+            "from": {"value": "2021-01-01T00:00:00.000-08:00", "grain": "day"},
+            "to": {"value": "2021-03-01T00:00:00.000-08:00", "grain": "day"},
+        }
+    },
+    {
+        "additional_info": {
+            "type": "interval",
+            "from": {"value": "2021-02-01T00:00:00.000-08:00", "grain": "month"},
+        }
+    },
+]
+
+
+def format_isotime_by_grain(isotime, grain=None):
+    timeformat = parsing.GRAIN_FORMATS.get(grain, parsing.DEFAULT_FORMAT)
+    return parser.isoparse(isotime).strftime(timeformat)
+
+
+def parse_uncached(timeentity):
+    """The previous `parse_duckling_time_as_interval`"""
+    timeinfo = timeentity["additional_info"]
+    if timeinfo["type"] == "interval":
+        grain = timeinfo.get("to", timeinfo.get("from", {})).get("grain")
+        start = timeinfo.get("from", {}).get("value")
+        end = timeinfo.get("to", {}).get("value")
+    else:
+        grain = timeinfo.get("grain")
+        start = timeinfo.get("value")
+        end = None
+    if not (start and end):
+        delta = relativedelta.relativedelta(**{f"{grain}s": 1})
+        if start:
+            end = (parser.isoparse(start) + delta).isoformat()
+        else:
+            start = (parser.isoparse(end) - delta).isoformat()
+    return {
+        "start_time": start,
+        "start_time_formatted": format_isotime_by_grain(start, grain),
+        "end_time": end,
+        "end_time_formatted": format_isotime_by_grain(end, grain),
+        "grain": grain,
+    }
+
+
+def parse_memoized_cold(timeentity):
+    parsing.parse_interval.cache_clear()
+    parsing.parse_isotime.cache_clear()
+    return parsing.parse_duckling_time_as_interval(timeentity)
+
+
+for entity in ENTITIES:
+    assert parse_uncached(entity) == parsing.parse_duckling_time_as_interval(entity)
+
+print(f"{NUMBER} parses of {len(ENTITIES)} different time entities")
+for name, parse in [
+    ("uncached", parse_uncached),
+    ("memoized, cold cache", parse_memoized_cold),
+    ("memoized", parsing.parse_duckling_time_as_interval),
+]:
+    seconds = timeit.timeit(
+        lambda: [parse(entity) for entity in ENTITIES], number=NUMBER // len(ENTITIES)
+    )
+    print(f"{name:>22}: {seconds / NUMBER * 1e6:.2f} us per parse")
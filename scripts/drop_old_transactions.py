@@ -0,0 +1,27 @@
+"""Removes the transactions and rollups of the profile database before the month of
+`BEFORE` (an ISO date). Drops whole partitions when the transactions table is
+partitioned, see `actions/partitions.py`.
+
+Uses the same `PROFILE_DB_NAME` & `PROFILE_DB_URL` environment variables as the action
+server.
+"""
+import os
+import sys
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(1, str(Path(__file__).parent.parent))
+
+from actions.profile_db import create_database_engine, ProfileDB  # noqa: E402
+
+PROFILE_DB_NAME = os.environ.get("PROFILE_DB_NAME", "profile")
+PROFILE_DB_URL = os.environ.get("PROFILE_DB_URL", f"sqlite:///{PROFILE_DB_NAME}.db")
+BEFORE = datetime.fromisoformat(os.environ["BEFORE"])
+
+profile_db = ProfileDB(create_database_engine(PROFILE_DB_URL))
+deleted = profile_db.drop_transactions_before(BEFORE)
+
+if deleted is None:
+    print(f"--\nDropped the transaction partitions before {BEFORE:%Y-%m}")
+else:
+    print(f"--\nDeleted {deleted} transactions before {BEFORE:%Y-%m}")
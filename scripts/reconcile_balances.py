@@ -0,0 +1,27 @@
+"""Checks the materialized account balances of the profile database against the
+transactions table.
+
+Uses the same `PROFILE_DB_NAME` & `PROFILE_DB_URL` environment variables as the action
+server. Set `FIX=1` to overwrite the differing balances with the summed transactions.
+"""
+import os
+import pprint
+import sys
+from pathlib import Path
+
+sys.path.insert(1, str(Path(__file__).parent.parent))
+
+from actions.profile_db import create_database_engine, ProfileDB  # noqa: E402
+
+PROFILE_DB_NAME = os.environ.get("PROFILE_DB_NAME", "profile")
+PROFILE_DB_URL = os.environ.get("PROFILE_DB_URL", f"sqlite:///{PROFILE_DB_NAME}.db")
+FIX = int(os.environ.get("FIX", 0))
+
+profile_db = ProfileDB(create_database_engine(PROFILE_DB_URL))
+mismatches = profile_db.reconcile_balances(fix=bool(FIX))
+
+print(f"--\nFound {len(mismatches)} balances that differ from the transactions")
+if mismatches:
+    pprint.pprint(mismatches)
+    if not FIX:
+        sys.exit(1)
@@ -0,0 +1,42 @@
+from actions.cache import TTLCache
+
+
+def test_read_through():
+    cache = TTLCache()
+    loads = []
+
+    def load():
+        loads.append(1)
+        return ["iron bank"]
+
+    assert cache.get_or_load(("test", "credit_cards"), load) == ["iron bank"]
+    assert cache.get_or_load(("test", "credit_cards"), load) == ["iron bank"]
+    assert len(loads) == 1
+    assert cache.stats() == {"hits": 1, "misses": 1, "evictions": 0, "size": 1}
+
+
+def test_ttl_expiry():
+    cache = TTLCache(ttl=0)
+    cache.get_or_load(("test", "vendors"), lambda: 1)
+    assert cache.get_or_load(("test", "vendors"), lambda: 2) == 2
+
+
+def test_lru_eviction():
+    cache = TTLCache(max_size=2)
+    cache.get_or_load(("a", "recipients"), lambda: 1)
+    cache.get_or_load(("b", "recipients"), lambda: 2)
+    cache.get_or_load(("a", "recipients"), lambda: 1)
+    cache.get_or_load(("c", "recipients"), lambda: 3)
+    assert cache.get_or_load(("a", "recipients"), lambda: None) == 1
+    assert cache.get_or_load(("b", "recipients"), lambda: None) is None
+    assert cache.stats()["evictions"] == 2
+
+
+def test_invalidate_session():
+    cache = TTLCache()
+    cache.get_or_load(("a", "recipients"), lambda: 1)
+    cache.get_or_load(("a", "credit_cards"), lambda: 2)
+    cache.get_or_load(("b", "recipients"), lambda: 3)
+    cache.invalidate("a")
+    assert cache.stats()["size"] == 1
+    assert cache.get_or_load(("a", "recipients"), lambda: 4) == 4
@@ -1,13 +1,23 @@
 import os
+import asyncio
+import shutil
+import threading
+from datetime import datetime
 import sqlalchemy as sa
 import pytest
 
 from actions.profile_db import (
     GENERAL_ACCOUNTS,
     create_database,
+    create_database_engine,
     ProfileDB,
+    AsyncProfileDB,
     Account,
+    SQLITE_PRAGMAS,
+    TransactionRollup,
 )
+from actions.ledger import ColumnarLedger
+from actions.migrations import MIGRATIONS, get_schema_version, migrate
 
 PROFILE_DB_NAME = os.environ.get("PROFILE_DB_NAME", "profile")
 PROFILE_DB_URL = os.environ.get("PROFILE_DB_URL", f"sqlite:///{PROFILE_DB_NAME}.db")
@@ -52,6 +62,11 @@ def test_transact():
     assert account_balance_now == account_balance - 100
 
 
+def test_materialized_balance():
+    assert account_balance_now == profile_db.get_ledger_balance(account_number)
+    assert profile_db.reconcile_balances() == {}
+
+
 def test_cc_payment_1():
     credit_card_name = credit_cards[0]
     balance_type = balance_types[0]
@@ -78,3 +93,614 @@ def test_cc_payment_2():
         session_id, credit_card_name, balance_type
     )
     assert credit_card_balance_now == 0
+
+
+@pytest.mark.asyncio
+async def test_async_profile_db():
+    async_profile_db = AsyncProfileDB(ProfileDB(ENGINE), max_workers=1)
+    balance = await async_profile_db.get_account_balance(session_id)
+    assert balance == profile_db.get_account_balance(session_id)
+    assert async_profile_db.list_balance_types() == balance_types
+
+
+@pytest.mark.asyncio
+async def test_async_profile_db_concurrent_sessions():
+    async_profile_db = AsyncProfileDB(ProfileDB(ENGINE), max_workers=4)
+    balances = await asyncio.gather(
+        *[async_profile_db.get_account_balance(session_id) for _ in range(20)]
+    )
+    assert set(balances) == {profile_db.get_account_balance(session_id)}
+
+
+def test_schema_migrated():
+    assert get_schema_version(ENGINE) == MIGRATIONS[-1][0]
+    assert migrate(ENGINE) == []
+
+
+def test_migrate_adds_indexes(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    engine.execute(
+        "CREATE TABLE transactions (id INTEGER PRIMARY KEY, timestamp DATETIME, "
+        "amount REAL, from_account_number VARCHAR(14), to_account_number VARCHAR(14))"
+    )
+    ProfileDB(engine)
+    index_names = [
+        index["name"] for index in sa.inspect(engine).get_indexes("transactions")
+    ]
+    assert "ix_transactions_from_account_number_timestamp" in index_names
+    assert "ix_transactions_to_account_number_timestamp" in index_names
+
+
+def test_seeded_profiles_are_reproducible(tmp_path):
+    def generated_transactions(database_name):
+        engine = sa.create_engine(f"sqlite:///{tmp_path / database_name}")
+        seeded_profile_db = ProfileDB(engine, seed=42)
+        seeded_profile_db.populate_profile_db(session_id)
+        return engine.execute(
+            "SELECT amount, timestamp FROM transactions ORDER BY id"
+        ).fetchall()
+
+    transactions = generated_transactions("first.db")
+    assert len(transactions) > 0
+    assert transactions == generated_transactions("second.db")
+
+
+def test_lazy_population(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'lazy.db'}")
+    lazy_profile_db = ProfileDB(engine, population="lazy")
+    lazy_profile_db.populate_profile_db(session_id)
+    assert engine.execute("SELECT COUNT(*) FROM transactions").scalar() == 0
+    assert lazy_profile_db.get_account_balance(session_id) > 0
+    assert len(lazy_profile_db.list_credit_cards(session_id)) == 4
+
+
+@pytest.mark.asyncio
+async def test_background_population(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'background.db'}")
+    async_profile_db = AsyncProfileDB(ProfileDB(engine, population="background"))
+    await async_profile_db.populate_profile_db(session_id)
+    await asyncio.gather(*async_profile_db.background_tasks)
+    assert engine.execute("SELECT COUNT(*) FROM transactions").scalar() > 0
+    assert len(await async_profile_db.list_credit_cards(session_id)) == 4
+
+
+def test_pregenerated_profiles(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+    pool_profile_db = ProfileDB(engine, pregenerated_profiles=2)
+    assert pool_profile_db.refill_profile_pool() == 2
+    assert pool_profile_db.refill_profile_pool() == 0
+    number_of_transactions = engine.execute(
+        "SELECT COUNT(*) FROM transactions"
+    ).scalar()
+
+    pool_profile_db.populate_profile_db(session_id)
+    assert pool_profile_db.count_pregenerated_profiles() == 1
+    assert len(pool_profile_db.list_credit_cards(session_id)) == 4
+    assert (
+        engine.execute("SELECT COUNT(*) FROM transactions").scalar()
+        == number_of_transactions
+    )
+
+
+def test_concurrent_pool_refills(tmp_path, monkeypatch):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'pool.db'}")
+    other_process_db = ProfileDB(engine, pregenerated_profiles=2)
+    pool_profile_db = ProfileDB(engine, pregenerated_profiles=2)
+    count_pregenerated_profiles = pool_profile_db.count_pregenerated_profiles
+    stale_counts = [0]
+
+    def count_before_other_refill():
+        if stale_counts:
+            return stale_counts.pop()
+        return count_pregenerated_profiles()
+
+    # the other process refills the pool after this one counted it as empty
+    monkeypatch.setattr(
+        pool_profile_db, "count_pregenerated_profiles", count_before_other_refill
+    )
+    assert other_process_db.refill_profile_pool() == 2
+    assert pool_profile_db.refill_profile_pool() == 0
+    assert other_process_db.count_pregenerated_profiles() == 2
+
+
+def test_reference_data_cache():
+    profile_db.list_credit_cards(session_id)
+    profile_db.list_known_recipients(session_id)
+    hits = profile_db.cache.stats()["hits"]
+    assert profile_db.list_credit_cards(session_id) == credit_cards
+    assert profile_db.list_known_recipients(session_id) == recipient_names
+    assert profile_db.cache.stats()["hits"] == hits + 2
+
+
+def test_cc_balance_read_after_payment():
+    credit_card_name = credit_cards[2]
+    other_process_db = ProfileDB(ENGINE)
+    balance = other_process_db.get_credit_card_balance(session_id, credit_card_name)
+    profile_db.pay_off_credit_card(session_id, credit_card_name, 10)
+    assert other_process_db.get_credit_card_balance(
+        session_id, credit_card_name
+    ) == pytest.approx(balance - 10)
+    other_process_db.session.remove()
+
+
+def test_account_resolution_is_cached():
+    statements = []
+
+    def count_statement(*args):
+        statements.append(args[2])
+
+    sa.event.listen(ENGINE, "before_cursor_execute", count_statement)
+    try:
+        profile_db.get_account_balance(session_id)
+        profile_db.get_credit_card_balance(session_id, credit_cards[0])
+    finally:
+        sa.event.remove(ENGINE, "before_cursor_execute", count_statement)
+    # one query per balance
+    assert len(statements) == 2
+
+
+def test_search_transactions_summary():
+    search = dict(
+        start_time=datetime(2020, 1, 1),
+        end_time=datetime(2020, 12, 31),
+        vendor="target",
+    )
+    transactions = profile_db.search_transactions(session_id, **search).all()
+    summary = profile_db.search_transactions_summary(session_id, **search)
+    assert summary["count"] == len(transactions)
+    assert summary["total"] == pytest.approx(sum(t.amount for t in transactions))
+    assert summary["min"] == min(t.amount for t in transactions)
+    assert summary["max"] == max(t.amount for t in transactions)
+
+    by_month = profile_db.search_transactions_summary(
+        session_id, grain="month", **search
+    )
+    assert len(by_month["breakdown"]) == 12
+    assert by_month["breakdown"][0]["period"] == "2020-01"
+    assert by_month["count"] == summary["count"]
+    assert by_month["total"] == pytest.approx(summary["total"])
+
+
+@pytest.mark.parametrize(
+    "search",
+    [
+        dict(start_time=datetime(2019, 3, 14, 15, 9), end_time=datetime(2020, 6, 1)),
+        dict(start_time=datetime(2019, 5, 1), end_time=datetime(2019, 5, 1, 23)),
+        dict(end_time=datetime(2020, 2, 29, 12)),
+        dict(deposit=True),
+        dict(vendor="starbucks"),
+    ],
+)
+def test_rollup_summary_matches_transactions(search):
+    profile_db.transact(account_number, recipient_account_number, 12.5)
+    transactions = profile_db.search_transactions(session_id, **search).all()
+    summary = profile_db.search_transactions_summary(session_id, **search)
+    assert summary["count"] == len(transactions)
+    assert summary["total"] == pytest.approx(sum(t.amount for t in transactions))
+    if transactions:
+        assert summary["min"] == min(t.amount for t in transactions)
+        assert summary["max"] == max(t.amount for t in transactions)
+
+
+def test_rollups_backfilled_by_migration(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path}/rollups.db")
+    db = ProfileDB(engine)
+    db.populate_profile_db(session_id)
+    search = dict(start_time=datetime(2019, 1, 1), end_time=datetime(2020, 1, 1))
+    expected = db.search_transactions_summary(session_id, **search)
+    with engine.begin() as connection:
+        connection.execute("DELETE FROM transaction_rollups")
+        connection.execute("DELETE FROM schema_version WHERE version >= 3")
+    assert 3 in migrate(engine)
+    db.cache.clear()
+    assert db.search_transactions_summary(session_id, **search) == pytest.approx(
+        expected
+    )
+
+
+def test_rollup_inserted_concurrently(tmp_path, monkeypatch):
+    engine = sa.create_engine(f"sqlite:///{tmp_path}/rollups.db")
+    db = ProfileDB(engine)
+    timestamp = datetime(2021, 3, 17, 12)
+    update_rollup = db.update_rollup
+
+    def racing_update_rollup(key, amount):
+        # another transaction inserts the rollup right after this update misses it
+        if key["grain"] == "day" and not db.session.query(TransactionRollup).count():
+            row = dict(count=1, total=10.0, min_amount=10.0, max_amount=10.0, **key)
+            db.session.execute(TransactionRollup.__table__.insert().values(row))
+            return 0
+        return update_rollup(key, amount)
+
+    monkeypatch.setattr(db, "update_rollup", racing_update_rollup)
+    with db.session_scope():
+        db.add_to_rollups("1", "2", 5.0, timestamp)
+    with db.session_scope():
+        rollup = db.session.query(TransactionRollup).filter_by(grain="day").one()
+    assert (rollup.count, rollup.total, rollup.min_amount) == (2, 15.0, 5.0)
+
+
+def test_columnar_ledger_matches_sql(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path}/ledger.db")
+    sql_db = ProfileDB(engine)
+    columnar_db = ProfileDB(engine, ledger_engine="columnar")
+    sql_db.populate_profile_db(session_id)
+    searches = [
+        dict(start_time=datetime(2019, 3, 14, 15, 9), end_time=datetime(2020, 6, 1)),
+        dict(end_time=datetime(2020, 2, 29, 12)),
+        dict(deposit=True),
+        dict(vendor="starbucks", start_time=datetime(2020, 1, 1)),
+    ]
+    for search in searches:
+        expected = sql_db.search_transactions_summary(session_id, **search)
+        summary = columnar_db.search_transactions_summary(session_id, **search)
+        assert summary == pytest.approx(expected)
+
+    # writes go through to the loaded columns
+    own_number = columnar_db.get_account_number_from_session_id(session_id)
+    vendor_number = columnar_db.get_vendor_account_number("starbucks")
+    columnar_db.transact(own_number, vendor_number, 1000.5)
+    summary = columnar_db.search_transactions_summary(session_id, vendor="starbucks")
+    assert summary == pytest.approx(
+        sql_db.search_transactions_summary(session_id, vendor="starbucks")
+    )
+    assert summary["max"] == 1000.5
+
+
+def test_columnar_ledger_load_during_write():
+    transactions = [("1", "2", 10.0, datetime(2021, 3, 1))]
+    ledger = ColumnarLedger(lambda account_number: list(transactions), max_accounts=2)
+    with ledger.writing_to("1", "2"):
+        transactions.append(("1", "2", 5.0, datetime(2021, 3, 2)))
+        # a search between the commit and the write-through sees the transaction
+        assert ledger.summarize("1")["count"] == 2
+        ledger.append("1", "2", 5.0, datetime(2021, 3, 2))
+    assert ledger.summarize("1")["count"] == 2
+    assert ledger.summarize("2", deposit=True, counterparty_account_number="1") == {
+        "count": 2,
+        "total": 15.0,
+        "min": 5.0,
+        "max": 10.0,
+    }
+    for account_number in ["3", "4", "5"]:
+        ledger.summarize(account_number)
+    assert len(ledger.accounts) == 2
+    assert not (ledger.loading or ledger.writing or ledger.stale)
+
+
+def test_delete_expired_profiles(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path}/expired.db")
+    db = ProfileDB(engine, profile_ttl=3600, sweep_batch_size=2)
+    for expired_session_id in ["expired_1", "expired_2", "expired_3"]:
+        db.populate_profile_db(expired_session_id)
+    db.populate_profile_db("active")
+    db.get_account_balance("expired_1")
+    engine.execute(
+        "UPDATE account SET last_active_at = '2020-01-01 00:00:00.000000' "
+        "WHERE session_id LIKE 'expired%'"
+    )
+
+    metrics = db.delete_expired_profiles()
+    assert metrics["profiles"] == 2
+    assert metrics["transactions"] > 0 and metrics["credit_cards"] > 0
+    assert db.delete_expired_profiles()["profiles"] == 1
+    assert db.delete_expired_profiles()["profiles"] == 0
+    assert db.sweep_metrics["batches"] == 2
+    assert db.sweep_metrics["profiles"] == 3
+
+    for session_id_prefix in ["expired", "active"]:
+        remaining = engine.execute(
+            "SELECT count(*) FROM account WHERE session_id LIKE ?",
+            f"{session_id_prefix}%",
+        ).scalar()
+        assert remaining == (session_id_prefix == "active")
+    # the general accounts and the active profile are kept
+    assert db.check_general_accounts_populated(GENERAL_ACCOUNTS)
+    assert db.list_credit_cards("active")
+    assert db.reconcile_balances() == {}
+    # a returning session gets a new profile
+    assert db.get_account_balance("expired_1")
+
+
+def test_active_profiles_are_not_expired(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path}/active.db")
+    db = ProfileDB(engine, profile_ttl=3600)
+    other_process_db = ProfileDB(engine, profile_ttl=3600)
+    db.populate_profile_db("active")
+    other_process_db.get_account_id_from_session_id("returning")
+    engine.execute(
+        "UPDATE account SET last_active_at = '2020-01-01 00:00:00.000000' "
+        "WHERE session_id IN ('active', 'returning')"
+    )
+
+    # the session keeps being used after the throttling interval
+    db.touches.clear()
+    assert db.get_account_balance("active")
+    assert db.delete_expired_profiles()["profiles"] == 1
+    assert db.list_credit_cards("active")
+
+    # a process that still has the deleted account cached resolves a new one
+    other_process_db.touches.clear()
+    account_id = other_process_db.get_account_id_from_session_id("returning")
+    assert (
+        account_id
+        == engine.execute(
+            "SELECT id FROM account WHERE session_id = 'returning'"
+        ).scalar()
+    )
+    assert other_process_db.get_account_balance("returning")
+
+
+@pytest.mark.asyncio
+async def test_delete_expired_idempotency_keys(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'idempotency.db'}")
+    db = ProfileDB(engine, idempotency_ttl=3600, sweep_batch_size=2)
+    db.populate_profile_db("expired")
+    recipient = db.list_known_recipients("expired")[0]
+    for i in range(3):
+        assert db.transfer_money("expired", recipient, 1, f"expired:{i}")
+        db.save_idempotent_result("expired", f"expired:{i}", {"events": []})
+    engine.execute(
+        "UPDATE idempotency_keys SET created_at = '2020-01-01 00:00:00.000000'"
+    )
+    assert db.transfer_money("expired", recipient, 1, "active")
+
+    async_db = AsyncProfileDB(db, max_workers=0)
+    assert await async_db.sweep_batch()
+    assert not await async_db.sweep_batch()
+    assert db.sweep_metrics["idempotency_keys"] == 3
+    assert db.get_idempotent_result("expired", "expired:0") is None
+    assert not db.transfer_money("expired", recipient, 1, "active")
+
+
+@pytest.mark.asyncio
+async def test_concurrent_payments_and_transfers(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'payments.db'}")
+    async_profile_db = AsyncProfileDB(ProfileDB(engine), max_workers=8)
+    await async_profile_db.populate_profile_db(session_id)
+    credit_card = (await async_profile_db.list_credit_cards(session_id))[0]
+    recipient = (await async_profile_db.list_known_recipients(session_id))[0]
+    card_balance = await async_profile_db.get_credit_card_balance(
+        session_id, credit_card
+    )
+    account_balance = await async_profile_db.get_account_balance(session_id)
+
+    payments = [
+        async_profile_db.pay_off_credit_card(
+            session_id, credit_card, 1.25, idempotency_key=f"payment_{i % 40}"
+        )
+        for i in range(80)
+    ]
+    transfers = [
+        async_profile_db.transfer_money(
+            session_id, recipient, 2.5, idempotency_key=f"transfer_{i % 40}"
+        )
+        for i in range(80)
+    ]
+    applied = await asyncio.gather(*payments, *transfers)
+
+    # every key is applied exactly once, and no update is lost
+    assert sum(applied) == 80
+    assert await async_profile_db.get_credit_card_balance(
+        session_id, credit_card
+    ) == pytest.approx(card_balance - 40 * 1.25)
+    assert await async_profile_db.get_account_balance(session_id) == pytest.approx(
+        account_balance - 40 * 1.25 - 40 * 2.5
+    )
+    assert await async_profile_db.reconcile_balances() == {}
+
+
+@pytest.mark.asyncio
+async def test_group_commit(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path / 'group_commit.db'}")
+    async_profile_db = AsyncProfileDB(
+        ProfileDB(engine), max_workers=4, group_commit_interval=0.01
+    )
+    await async_profile_db.populate_profile_db(session_id)
+    recipient = (await async_profile_db.list_known_recipients(session_id))[0]
+    account_balance = await async_profile_db.get_account_balance(session_id)
+    from_account_number = await async_profile_db.get_account_number_from_session_id(
+        session_id
+    )
+    to_account_number = async_profile_db.get_account_number(
+        await async_profile_db.get_recipient_from_name(session_id, recipient)
+    )
+
+    inserts = []
+
+    def count_insert(conn, cursor, statement, parameters, context, executemany):
+        if statement.startswith("INSERT INTO transactions"):
+            inserts.append(statement)
+
+    sa.event.listen(engine, "before_cursor_execute", count_insert)
+    try:
+        added = await asyncio.gather(
+            *[
+                async_profile_db.transact(
+                    from_account_number,
+                    to_account_number,
+                    1.5,
+                    idempotency_key=f"transfer_{i % 25}",
+                )
+                for i in range(50)
+            ]
+        )
+    finally:
+        sa.event.remove(engine, "before_cursor_execute", count_insert)
+
+    assert sum(added) == 25
+    # the transactions queued together are inserted in one batch
+    assert len(inserts) == 1
+    assert await async_profile_db.get_account_balance(session_id) == pytest.approx(
+        account_balance - 25 * 1.5
+    )
+    assert await async_profile_db.reconcile_balances() == {}
+    # a key that was committed in an earlier batch is not applied again
+    assert not await async_profile_db.transfer_money(
+        session_id, recipient, 1.5, idempotency_key="transfer_0"
+    )
+
+
+@pytest.mark.asyncio
+async def test_sqlite_production_mode(tmp_path):
+    engine = create_database_engine(
+        f"sqlite:///{tmp_path / 'production.db'}", sqlite_pragmas=SQLITE_PRAGMAS
+    )
+    with engine.connect() as connection:
+        assert connection.execute("PRAGMA journal_mode").scalar() == "wal"
+        assert connection.execute("PRAGMA synchronous").scalar() == 1
+        assert connection.execute("PRAGMA busy_timeout").scalar() == 5000
+
+    async_profile_db = AsyncProfileDB(
+        ProfileDB(engine), max_workers=8, single_writer=True
+    )
+    db = async_profile_db.profile_db
+    assert async_profile_db.executor_for(db.transact) is async_profile_db.writer
+    assert async_profile_db.executor_for(db.get_account_balance) is (
+        async_profile_db.executor
+    )
+
+    session_ids = [f"writer_{i}" for i in range(8)]
+    await asyncio.gather(
+        *[async_profile_db.populate_profile_db(s) for s in session_ids]
+    )
+    recipients = await asyncio.gather(
+        *[async_profile_db.list_known_recipients(s) for s in session_ids]
+    )
+    await asyncio.gather(
+        *[
+            async_profile_db.transfer_money(s, names[0], 1.0)
+            for s, names in zip(session_ids, recipients)
+            for _ in range(5)
+        ],
+        *[async_profile_db.get_account_balance(s) for s in session_ids * 5],
+    )
+    assert await async_profile_db.reconcile_balances() == {}
+
+
+@pytest.mark.asyncio
+async def test_sqlite_production_mode_reads_do_not_write(tmp_path):
+    engine = create_database_engine(
+        f"sqlite:///{tmp_path / 'production.db'}", sqlite_pragmas=SQLITE_PRAGMAS
+    )
+    async_profile_db = AsyncProfileDB(
+        ProfileDB(engine, population="lazy", profile_ttl=3600),
+        max_workers=8,
+        single_writer=True,
+    )
+    writing_threads = set()
+
+    @sa.event.listens_for(engine, "before_cursor_execute")
+    def record_writing_thread(conn, cursor, statement, *args):
+        if statement.split()[0] in ["INSERT", "UPDATE", "DELETE"]:
+            writing_threads.add(threading.current_thread().name)
+
+    # sessions that were never started, e.g. after a restart of the action server
+    session_ids = [f"restarted_{i}" for i in range(8)]
+    balances = await asyncio.gather(
+        *[async_profile_db.get_account_balance(s) for s in session_ids]
+    )
+    assert all(balances)
+    async_profile_db.profile_db.touches.clear()
+    await asyncio.gather(*[async_profile_db.list_credit_cards(s) for s in session_ids])
+    assert writing_threads and all(
+        name.startswith("profile_db_writer") for name in writing_threads
+    )
+
+
+@pytest.mark.asyncio
+async def test_replica_routing(tmp_path):
+    primary = sa.create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    setup_db = ProfileDB(primary)
+    for routed_session_id in ["writer", "reader"]:
+        setup_db.populate_profile_db(routed_session_id)
+        setup_db.get_account_balance(routed_session_id)
+    setup_db.session.remove()
+    # the replica is a copy of the primary that does not catch up
+    shutil.copy(tmp_path / "primary.db", tmp_path / "replica.db")
+    replica = sa.create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+
+    db = ProfileDB(primary, replica_engines=[replica], sticky_seconds=60)
+    async_db = AsyncProfileDB(db, max_workers=0)
+    balances = {s: await async_db.get_account_balance(s) for s in ["writer", "reader"]}
+    recipient = (await async_db.list_known_recipients("writer"))[0]
+    await async_db.transfer_money("writer", recipient, 1.23)
+
+    # the writing session reads its own write from the primary
+    assert await async_db.get_account_balance("writer") == pytest.approx(
+        balances["writer"] - 1.23
+    )
+    # others read from the replica
+    recipient = (await async_db.list_known_recipients("reader"))[0]
+    await async_db.transfer_money("reader", recipient, 1.23)
+    db.router.sticky_until.clear()
+    assert await async_db.get_account_balance("reader") == pytest.approx(
+        balances["reader"]
+    )
+    assert (
+        replica.execute(
+            "SELECT COUNT(*) FROM transactions WHERE amount = 1.23"
+        ).scalar()
+        == 0
+    )
+
+
+@pytest.mark.asyncio
+async def test_replica_routing_with_group_commit(tmp_path):
+    primary = sa.create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    setup_db = ProfileDB(primary)
+    setup_db.populate_profile_db("writer")
+    setup_db.get_account_balance("writer")
+    setup_db.session.remove()
+    shutil.copy(tmp_path / "primary.db", tmp_path / "replica.db")
+    replica = sa.create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+
+    db = ProfileDB(primary, replica_engines=[replica], sticky_seconds=60)
+    async_db = AsyncProfileDB(db, max_workers=2, group_commit_interval=0.01)
+    balance = await async_db.get_account_balance("writer")
+    recipient = (await async_db.list_known_recipients("writer"))[0]
+    await asyncio.gather(
+        *[async_db.transfer_money("writer", recipient, 1.23) for _ in range(3)]
+    )
+    assert await async_db.get_account_balance("writer") == pytest.approx(
+        balance - 3 * 1.23
+    )
+
+
+@pytest.mark.asyncio
+async def test_replica_reads_own_writes(tmp_path):
+    primary = sa.create_engine(f"sqlite:///{tmp_path / 'primary.db'}")
+    ProfileDB(primary).session.remove()
+    # the replica lags behind: it was copied before the session was populated
+    shutil.copy(tmp_path / "primary.db", tmp_path / "replica.db")
+    replica = sa.create_engine(f"sqlite:///{tmp_path / 'replica.db'}")
+    db = ProfileDB(primary, replica_engines=[replica], sticky_seconds=60)
+    async_db = AsyncProfileDB(db, max_workers=0)
+
+    await async_db.populate_profile_db("new_user")
+    assert await async_db.check_session_id_exists("new_user")
+    assert await async_db.get_currency("new_user")
+    assert await async_db.get_account_balance("new_user") > 0
+    recipients = await async_db.list_known_recipients("new_user")
+    assert await async_db.get_recipient_from_name("new_user", recipients[0])
+    credit_cards = await async_db.list_credit_cards("new_user")
+    assert await async_db.get_credit_card("new_user", credit_cards[0])
+    await async_db.save_idempotent_result("new_user", "new_user:key", {"events": []})
+    assert await async_db.get_idempotent_result("new_user", "new_user:key") == {
+        "events": []
+    }
+
+
+def test_name_indexes():
+    recipient_index = profile_db.get_recipient_index(session_id)
+    assert profile_db.get_recipient_index(session_id) is recipient_index
+    assert recipient_index.resolve(recipient_name.upper()) == recipient_name
+    first_name = recipient_name.split()[0]
+    assert recipient_index.resolve(first_name) in recipient_names
+
+    vendor = profile_db.list_vendors()[0]
+    assert profile_db.get_vendor_index().resolve(vendor[:-1] + "x") == vendor
+    credit_card = profile_db.list_credit_cards(session_id)[0]
+    assert profile_db.get_credit_card_index(session_id).resolve(credit_card) == (
+        credit_card
+    )
@@ -0,0 +1,87 @@
+from datetime import datetime
+
+from dateutil import tz
+
+from actions.parsing import parse_duckling_currency, parse_duckling_time_as_interval
+from components.local_duckling import parse
+
+TIMEZONE = "America/Los_Angeles"
+# Wednesday March 17, 2021, noon
+REFERENCE_TIME = int(
+    datetime(2021, 3, 17, 12, tzinfo=tz.gettz(TIMEZONE)).timestamp() * 1000
+)
+
+
+def as_entity(match):
+    """Convert a match like `DucklingEntityExtractor` does"""
+    return {
+        "entity": match["dim"],
+        "value": match["value"].get("value"),
+        "additional_info": match["value"],
+    }
+
+
+def parse_one(text):
+    matches = parse(text, REFERENCE_TIME, TIMEZONE)
+    assert len(matches) == 1
+    return as_entity(matches[0])
+
+
+def test_money_and_numbers():
+    assert parse_duckling_currency(parse_one("transfer $1,200.50 to Bob")) == {
+        "amount-of-money": "1200.50",
+        "currency": "$",
+    }
+    assert parse_one("Pay Karen 60 Euros")["additional_info"]["unit"] == "EUR"
+    assert parse_one("100 dollars")["additional_info"] == {
+        "value": 100,
+        "type": "value",
+        "unit": "$",
+    }
+    assert parse_one("pay $ 50")["additional_info"]["unit"] == "$"
+    assert parse_one("5000") == {
+        "entity": "number",
+        "value": 5000,
+        "additional_info": {"value": 5000, "type": "value"},
+    }
+
+
+def test_relative_dates():
+    assert parse_duckling_time_as_interval(
+        parse_one("what did I spend last month?")
+    ) == {
+        "start_time": "2021-02-01T00:00:00.000-08:00",
+        "start_time_formatted": "Feb 2021",
+        "end_time": "2021-03-01T00:00:00-08:00",
+        "end_time_formatted": "Mar 2021",
+        "grain": "month",
+    }
+    assert parse_one("this week")["value"] == "2021-03-15T00:00:00.000-07:00"
+    assert parse_one("tomorrow")["value"] == "2021-03-18T00:00:00.000-07:00"
+    assert parse_one("on Sunday")["value"] == "2021-03-21T00:00:00.000-07:00"
+    assert parse_one("for April 12th")["value"] == "2021-04-12T00:00:00.000-07:00"
+    assert parse_one("in January")["value"] == "2022-01-01T00:00:00.000-08:00"
+
+    interval = parse_duckling_time_as_interval(parse_one("in the last two weeks"))
+    assert interval["start_time"] == "2021-03-01T00:00:00.000-08:00"
+    assert interval["end_time"] == "2021-03-15T00:00:00.000-07:00"
+    assert interval["grain"] == "week"
+
+
+def test_uncovered_messages_need_duckling():
+    assert parse("thanks, have a good day", REFERENCE_TIME, TIMEZONE) == []
+    assert parse("may I pay my bill", REFERENCE_TIME, TIMEZONE) == []
+    assert parse("3 weeks ago", REFERENCE_TIME, TIMEZONE) is None
+    assert parse("the last day of the month", REFERENCE_TIME, TIMEZONE) is None
+    assert parse("pay twenty dollars", REFERENCE_TIME, TIMEZONE) is None
+    assert parse("tomorrow morning", REFERENCE_TIME, TIMEZONE) is None
+    # years and numbers after a time preposition may be times
+    assert parse("how much did I spend in 2020", REFERENCE_TIME, TIMEZONE) is None
+    assert parse("what was my target in 2019?", REFERENCE_TIME, TIMEZONE) is None
+    assert parse("transactions since 2018", REFERENCE_TIME, TIMEZONE) is None
+    assert parse("during 12", REFERENCE_TIME, TIMEZONE) is None
+
+
+def test_default_timezone_is_utc():
+    today = parse("today", REFERENCE_TIME)[0]["value"]["value"]
+    assert today == "2021-03-17T00:00:00.000+00:00"
@@ -0,0 +1,34 @@
+from actions.names import NameIndex
+
+VENDORS = ["starbucks", "target", "amazon", "costco", "legoland"]
+RECIPIENTS = ["evan oslo", "lisa clark", "lisa brown", "lisa"]
+
+
+def test_exact_names_and_aliases():
+    recipients = NameIndex(RECIPIENTS, [(name.split()[0], name) for name in RECIPIENTS])
+    assert recipients.resolve("Evan  Oslo") == "evan oslo"
+    assert recipients.resolve("evan") == "evan oslo"
+    # a name wins over an alias, and the first of colliding aliases is kept
+    assert recipients.resolve("lisa") == "lisa"
+    assert (
+        NameIndex(
+            RECIPIENTS[:3], [("lisa", "lisa clark"), ("lisa", "lisa brown")]
+        ).resolve("lisa")
+        == "lisa clark"
+    )
+    assert recipients.resolve(None) is None
+    assert recipients.resolve(" ") is None
+
+
+def test_typos():
+    vendors = NameIndex(VENDORS)
+    assert vendors.resolve("starbuks") == "starbucks"
+    assert vendors.resolve("Starbucks") == "starbucks"
+    assert vendors.resolve("tagret") == "target"
+    assert vendors.resolve("amazn") == "amazon"
+    assert vendors.resolve("ikea") is None
+    # short names must match exactly
+    assert NameIndex(["bob", "rob"]).resolve("bob") == "bob"
+    assert NameIndex(["bob"]).resolve("bo") is None
+    # equally close names are ambiguous
+    assert NameIndex(["lisa clark", "lisa clerk"]).resolve("lisa clurk") is None
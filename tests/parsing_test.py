@@ -0,0 +1,113 @@
+from rasa_sdk import Tracker
+
+from actions.parsing import (
+    index_entities,
+    normalize_entities,
+    parse_duckling_time,
+    parse_duckling_time_as_interval,
+    parse_interval,
+    parse_isotime,
+)
+
+
+def test_interval_from_value():
+    interval = parse_duckling_time_as_interval(
+        {
+            "additional_info": {
+                "type": "value",
+                "value": "2021-03-01T00:00:00.000-08:00",
+                "grain": "month",
+            }
+        }
+    )
+    assert interval == {
+        "start_time": "2021-03-01T00:00:00.000-08:00",
+        "start_time_formatted": "Mar 2021",
+        "end_time": "2021-04-01T00:00:00-08:00",
+        "end_time_formatted": "Apr 2021",
+        "grain": "month",
+    }
+
+
+def test_open_interval_is_closed_by_grain():
+    interval = parse_duckling_time_as_interval(
+        {
+            "additional_info": {
+                "type": "interval",
+                "to": {"value": "2021-03-15T00:00:00.000-07:00", "grain": "day"},
+            }
+        }
+    )
+    assert interval["start_time"] == "2021-03-14T00:00:00-07:00"
+    assert interval["start_time_formatted"] == "Sunday Mar 14, 2021"
+    assert interval["end_time_formatted"] == "Monday Mar 15, 2021"
+
+
+def test_timestamps_are_parsed_once():
+    parse_interval.cache_clear()
+    parse_isotime.cache_clear()
+    entity = {
+        "additional_info": {
+            "type": "value",
+            "value": "2021-03-15T09:30:00.000-07:00",
+            "grain": "minute",
+        }
+    }
+    for _ in range(3):
+        parse_duckling_time_as_interval(entity)
+    time = parse_duckling_time(entity)
+    assert time["time_formatted"] == "09:30AM, Monday Mar 15, 2021"
+    assert parse_interval.cache_info().misses == 1
+    # the start, the end, and nothing more for `parse_duckling_time`
+    assert parse_isotime.cache_info().misses == 2
+
+
+MESSAGE_ENTITIES = [
+    {"entity": "number", "value": 50},
+    {
+        "entity": "amount-of-money",
+        "value": 50.0,
+        "additional_info": {"value": 50.0, "unit": "$"},
+    },
+    {
+        "entity": "time",
+        "value": "2021-03-01T00:00:00.000-08:00",
+        "additional_info": {
+            "type": "value",
+            "value": "2021-03-01T00:00:00.000-08:00",
+            "grain": "month",
+        },
+    },
+    {"entity": "PERSON", "value": "Lisa"},
+]
+
+
+def test_index_entities():
+    entities = index_entities(MESSAGE_ENTITIES)
+    assert entities.money == {"amount-of-money": "50.00", "currency": "$"}
+    assert entities.number == 50.0
+    assert entities.time["time_formatted"] == "Mar 2021"
+    assert entities.time_interval["end_time_formatted"] == "Apr 2021"
+    assert entities.person == "Lisa"
+    assert entities.first("number") is MESSAGE_ENTITIES[0]
+
+    # a number is read as dollars when there is no amount of money
+    assert index_entities(MESSAGE_ENTITIES[:1]).money == {
+        "amount-of-money": "50.00",
+        "currency": "$",
+    }
+    # entities that do not parse are left out
+    assert index_entities([{"entity": "number", "value": None}]).money is None
+    assert index_entities([{"entity": "greet"}]).time_interval is None
+
+
+def test_entities_are_normalized_once_per_turn():
+    tracker = Tracker(
+        "default", {}, {"entities": MESSAGE_ENTITIES}, [], False, None, None, ""
+    )
+    entities = normalize_entities(tracker)
+    assert normalize_entities(tracker) is entities
+    next_turn = Tracker(
+        "default", {}, {"entities": MESSAGE_ENTITIES[:1]}, [], False, None, None, ""
+    )
+    assert normalize_entities(next_turn).time is None
@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.schema import CreateTable
+
+from actions import partitions
+from actions.profile_db import ProfileDB
+
+
+def test_months():
+    assert partitions.months(datetime(2019, 11, 15), datetime(2020, 2, 1)) == [
+        datetime(2019, 11, 1),
+        datetime(2019, 12, 1),
+        datetime(2020, 1, 1),
+        datetime(2020, 2, 1),
+    ]
+
+
+def test_partitioned_table_ddl():
+    ddl = str(
+        CreateTable(partitions.partitioned_transactions).compile(
+            dialect=postgresql.dialect()
+        )
+    )
+    assert "id SERIAL NOT NULL" in ddl
+    assert "PRIMARY KEY (id, timestamp)" in ddl
+    assert ddl.rstrip().endswith("PARTITION BY RANGE (timestamp)")
+
+
+def test_drop_transactions_before_without_partitions(tmp_path):
+    engine = sa.create_engine(f"sqlite:///{tmp_path}/partitions.db")
+    profile_db = ProfileDB(engine, partition_transactions=True)
+    profile_db.populate_profile_db("test")
+    balance = profile_db.get_account_balance("test")
+    count = "SELECT count(*) FROM {} WHERE {} < '2020-01-01'"
+    assert engine.execute(count.format("transactions", "timestamp")).scalar()
+
+    deleted = profile_db.drop_transactions_before(datetime(2020, 1, 15))
+    assert deleted > 0
+    assert not engine.execute(count.format("transactions", "timestamp")).scalar()
+    assert not engine.execute(
+        count.format("transaction_rollups", "period_start")
+    ).scalar()
+    assert engine.execute("SELECT count(*) FROM transactions").scalar()
+
+    # the removed amounts moved to the opening balances, the ledger still matches
+    assert profile_db.reconcile_balances(fix=True) == {}
+    profile_db.drop_transactions_before(datetime(2020, 6, 1))
+    assert profile_db.reconcile_balances(fix=True) == {}
+    assert profile_db.get_account_balance("test") == balance
@@ -0,0 +1,42 @@
+import os
+import sys
+
+from actions.prefork import ProcessLocal, check_actions
+
+
+def test_process_local_is_created_once_per_process():
+    created = []
+
+    def factory():
+        created.append(os.getpid())
+        return object()
+
+    local = ProcessLocal(factory)
+    assert not created
+    instance = local.get()
+    assert local.get() is instance
+    assert created == [os.getpid()]
+
+    read, write = os.pipe()
+    pid = os.fork()
+    if not pid:
+        # a forked worker creates its own instance
+        os.write(write, b"1" if local.get() is not instance else b"0")
+        os._exit(0)
+    os.waitpid(pid, 0)
+    assert os.read(read, 1) == b"1"
+    assert local.get() is instance
+
+
+def test_process_local_proxies_attributes():
+    local = ProcessLocal(lambda: {"balance": 10})
+    assert list(local.keys()) == ["balance"]
+
+
+def test_check_actions_imports_in_a_child_process(tmp_path, monkeypatch):
+    (tmp_path / "broken_actions.py").write_text("raise ImportError('broken')\n")
+    monkeypatch.chdir(tmp_path)
+    assert not check_actions("broken_actions")
+    (tmp_path / "fixed_actions.py").write_text("")
+    assert check_actions("fixed_actions")
+    assert "fixed_actions" not in sys.modules
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+from actions.rollups import aggregate, split_range
+
+
+def test_split_range_in_months_days_and_edges():
+    periods, edges = split_range(datetime(2020, 1, 30, 12), datetime(2020, 4, 2, 6))
+    assert periods == [
+        ("month", datetime(2020, 2, 1), datetime(2020, 4, 1)),
+        ("day", datetime(2020, 1, 31), datetime(2020, 2, 1)),
+        ("day", datetime(2020, 4, 1), datetime(2020, 4, 2)),
+    ]
+    assert edges == [
+        (datetime(2020, 1, 30, 12), datetime(2020, 1, 31)),
+        (datetime(2020, 4, 2), datetime(2020, 4, 2, 6)),
+    ]
+
+
+def test_split_range_within_a_day():
+    start, end = datetime(2020, 1, 30, 12), datetime(2020, 1, 30, 18)
+    assert split_range(start, end) == ([], [(start, end)])
+
+
+def test_split_open_range():
+    periods, edges = split_range(None, datetime(2020, 3, 15))
+    assert periods == [
+        ("month", None, datetime(2020, 3, 1)),
+        ("day", datetime(2020, 3, 1), datetime(2020, 3, 15)),
+    ]
+    assert edges == []
+
+
+def test_aggregate():
+    transactions = [
+        {
+            "from_account_number": "1",
+            "to_account_number": "2",
+            "amount": amount,
+            "timestamp": timestamp,
+        }
+        for amount, timestamp in [
+            (10.0, datetime(2020, 1, 1, 10)),
+            (5.0, datetime(2020, 1, 1, 11)),
+            (7.0, datetime(2020, 1, 2)),
+        ]
+    ]
+    rollups = {
+        (rollup["grain"], rollup["period_start"]): rollup
+        for rollup in aggregate(transactions)
+    }
+    assert len(rollups) == 3
+    month = rollups[("month", datetime(2020, 1, 1))]
+    assert (month["count"], month["total"]) == (3, 22.0)
+    assert (month["min_amount"], month["max_amount"]) == (5.0, 10.0)
+    assert rollups[("day", datetime(2020, 1, 1))]["count"] == 2
@@ -0,0 +1,117 @@
+import sqlalchemy as sa
+import pytest
+
+from actions.profile_db import ProfileDB, AsyncProfileDB
+from actions.sharding import (
+    CLEARING_ACCOUNT_NUMBER,
+    ShardedProfileDB,
+    shard_score,
+)
+
+
+@pytest.fixture
+def sharded_db(tmp_path):
+    return ShardedProfileDB(
+        [
+            ProfileDB(sa.create_engine(f"sqlite:///{tmp_path / f'shard_{i}.db'}"))
+            for i in range(3)
+        ]
+    )
+
+
+def sessions_on_different_shards(sharded_db):
+    session_ids = [f"sharded_{i}" for i in range(20)]
+    first = session_ids[0]
+    other = next(
+        s
+        for s in session_ids
+        if sharded_db.shard_for(s) is not sharded_db.shard_for(first)
+    )
+    return first, other
+
+
+def test_sessions_are_spread_over_shards(sharded_db):
+    session_ids = [f"sharded_{i}" for i in range(30)]
+    shards = {id(sharded_db.shard_for(s)) for s in session_ids}
+    assert len(shards) == 3
+
+    # adding a shard only moves sessions to the new shard
+    grown = ShardedProfileDB(sharded_db.shards + [sharded_db.shards[0]])
+    moved = 0
+    for s in session_ids:
+        scores = [shard_score(name, s) for name in grown.shard_names]
+        if scores.index(max(scores)) == 3:
+            moved += 1
+        else:
+            assert grown.shard_for(s) is sharded_db.shard_for(s)
+    assert 0 < moved < len(session_ids)
+
+
+def test_methods_are_routed_by_session_id(sharded_db):
+    sharded_db.populate_profile_db("sharded_0")
+    shard = sharded_db.shard_for("sharded_0")
+    assert shard.check_session_id_exists("sharded_0")
+    assert sum(s.check_session_id_exists("sharded_0") for s in sharded_db.shards) == 1
+    assert sharded_db.get_account_balance("sharded_0") == shard.get_account_balance(
+        "sharded_0"
+    )
+    # the general accounts have the same numbers on all shards
+    vendor_numbers = {s.get_vendor_account_number("target") for s in sharded_db.shards}
+    assert len(vendor_numbers) == 1
+
+
+def test_transfer_between_shards(sharded_db):
+    sender, recipient = sessions_on_different_shards(sharded_db)
+    for session_id in [sender, recipient]:
+        sharded_db.populate_profile_db(session_id)
+    balances = {s: sharded_db.get_account_balance(s) for s in [sender, recipient]}
+
+    assert sharded_db.transfer_between_sessions(sender, recipient, 25, "transfer_1")
+    # a retry is not applied again
+    assert not sharded_db.transfer_between_sessions(sender, recipient, 25, "transfer_1")
+    assert sharded_db.get_account_balance(sender) == pytest.approx(
+        balances[sender] - 25
+    )
+    assert sharded_db.get_account_balance(recipient) == pytest.approx(
+        balances[recipient] + 25
+    )
+    # the credit was applied, so the transfer can no longer be cancelled
+    assert not sharded_db.cancel_transfer_between_sessions(
+        sender, recipient, 25, "transfer_1"
+    )
+    assert sharded_db.reconcile_balances() == {}
+
+
+def test_cancel_transfer_between_shards(sharded_db):
+    sender, recipient = sessions_on_different_shards(sharded_db)
+    for session_id in [sender, recipient]:
+        sharded_db.populate_profile_db(session_id)
+    source = sharded_db.shard_for(sender)
+    balance = sharded_db.get_account_balance(sender)
+
+    # the credit failed after the debit
+    source.transact(
+        source.get_account_number_from_session_id(sender),
+        CLEARING_ACCOUNT_NUMBER,
+        25,
+        "transfer_2:debit",
+    )
+    assert sharded_db.cancel_transfer_between_sessions(
+        sender, recipient, 25, "transfer_2"
+    )
+    assert sharded_db.get_account_balance(sender) == pytest.approx(balance)
+    # a late retry does not credit the cancelled transfer
+    sharded_db.transfer_between_sessions(sender, recipient, 25, "transfer_2")
+    assert sharded_db.get_account_balance(sender) == pytest.approx(balance)
+
+
+@pytest.mark.asyncio
+async def test_async_sharded_profile_db(sharded_db):
+    async_profile_db = AsyncProfileDB(sharded_db, max_workers=2)
+    await async_profile_db.populate_profile_db("sharded_0")
+    recipient = (await async_profile_db.list_known_recipients("sharded_0"))[0]
+    balance = await async_profile_db.get_account_balance("sharded_0")
+    await async_profile_db.transfer_money("sharded_0", recipient, 10)
+    assert await async_profile_db.get_account_balance("sharded_0") == pytest.approx(
+        balance - 10
+    )
@@ -1,4 +1,5 @@
 import json
+import time
 import pytest
 
 from rasa_sdk.executor import CollectingDispatcher, Tracker
@@ -71,3 +72,32 @@ async def test_action_pay_cc_confirmed(dispatcher, domain):
     expected_response = "utter_cc_pay_scheduled"
     assert events == expected_events
     assert dispatcher.messages[0]["response"] == expected_response
+
+
+@pytest.mark.asyncio
+async def test_action_pay_cc_retry_is_idempotent(domain):
+    await actions.ActionSessionStart().run(
+        CollectingDispatcher(), EMPTY_TRACKER, domain
+    )
+    tracker = Tracker.from_dict(
+        json.loads(
+            json.dumps(PAY_CC_CONFIRMED.current_state()).replace(
+                "1607396994.449022", str(time.time())
+            )
+        )
+    )
+    credit_card = tracker.get_slot("credit_card")
+    balance = await actions.profile_db.get_credit_card_balance(
+        tracker.sender_id, credit_card
+    )
+    action = actions.ActionPayCC()
+    first, retry = CollectingDispatcher(), CollectingDispatcher()
+    events = await action.run(first, tracker, domain)
+    retried_events = await action.run(retry, tracker, domain)
+
+    assert retried_events == events
+    assert retry.messages == first.messages
+    paid = float(tracker.get_slot("amount-of-money"))
+    assert await actions.profile_db.get_credit_card_balance(
+        tracker.sender_id, credit_card
+    ) == pytest.approx(balance - paid)